@@ -0,0 +1,64 @@
+"""Benchmark de memória: lista de dicts x ProcessoStore colunar.
+
+Uso:
+    python benchmarks/bench_memoria.py [--processos 10000] [--json]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dados import gerar_processos  # noqa: E402
+from main import ProcessoStore, SearchIndex, SessionAggregates  # noqa: E402
+
+
+def medir(construir):
+    """Memória retida (bytes) pelo objeto retornado por construir()"""
+    gc.collect()
+    tracemalloc.start()
+    inicio = tracemalloc.get_traced_memory()[0]
+    objeto = construir()
+    gc.collect()
+    retido = tracemalloc.get_traced_memory()[0] - inicio
+    tracemalloc.stop()
+    return retido, objeto
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processos', type=int, default=10000)
+    parser.add_argument('--json', action='store_true', help='saída em JSON')
+    args = parser.parse_args()
+
+    bytes_dicts, processos = medir(lambda: gerar_processos(args.processos))
+    bytes_store, store = medir(lambda: ProcessoStore(gerar_processos(args.processos)))
+    bytes_indice, _ = medir(lambda: SearchIndex(store))
+    bytes_agregados, _ = medir(lambda: SessionAggregates(store))
+
+    resultado = {
+        'processos': args.processos,
+        'lista_dicts_bytes': bytes_dicts,
+        'processo_store_bytes': bytes_store,
+        'reducao': round(1 - bytes_store / bytes_dicts, 3) if bytes_dicts else None,
+        'indice_busca_bytes': bytes_indice,
+        'agregados_bytes': bytes_agregados,
+    }
+
+    if args.json:
+        print(json.dumps(resultado))
+        return
+
+    print(f"📦 {args.processos} processos")
+    print(f"   Lista de dicts:  {bytes_dicts / 1024 / 1024:8.2f} MB")
+    print(f"   ProcessoStore:   {bytes_store / 1024 / 1024:8.2f} MB ({resultado['reducao']:.0%} menor)")
+    print(f"   Índice de busca: {bytes_indice / 1024 / 1024:8.2f} MB")
+    print(f"   Agregados:       {bytes_agregados / 1024 / 1024:8.2f} MB")
+
+
+if __name__ == '__main__':
+    main()
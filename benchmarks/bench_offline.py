@@ -0,0 +1,192 @@
+"""Benchmarks offline de parse, agrupamento, busca, formatação e cache com fixtures do ESAJ.
+
+Uso:
+    python benchmarks/bench_offline.py [--tamanhos 100,1000,10000] [--filtro parse] [--json]
+                                       [--verificar] [--limites benchmarks/limites.json]
+
+Com --verificar o script sai com código 1 se alguma mediana passar do limite
+registrado em limites.json (ms) com tolerância de 50% ou de 0,05 ms, o que for
+maior (casos abaixo de 1 ms oscilam mais que isso só com o ruído da máquina).
+--atualizar-limites grava novos limites com folga de 3x sobre as medianas
+medidas nesta máquina.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(DIRETORIO, '..'))
+sys.path.insert(0, DIRETORIO)
+
+from dados import gerar_processos  # noqa: E402
+from esaj_html import FIXTURES  # noqa: E402
+
+LIMITES = os.path.join(DIRETORIO, 'limites.json')
+FOLGA_LIMITES = 3
+TOLERANCIA = 1.5
+TOLERANCIA_ABSOLUTA_MS = 0.05
+
+
+def acima_do_limite(mediana, limite):
+    """Mediana passou do limite mesmo com a tolerância relativa e a absoluta"""
+    return limite is not None and mediana > max(limite * TOLERANCIA, limite + TOLERANCIA_ABSOLUTA_MS)
+
+
+def cronometrar(funcao, tempo_minimo=0.2, repeticoes_maximas=200):
+    """Executa funcao() repetidamente e devolve os tempos em ms"""
+    funcao()
+    tempos = []
+    inicio_total = time.perf_counter()
+    while len(tempos) < repeticoes_maximas:
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        if len(tempos) >= 5 and time.perf_counter() - inicio_total >= tempo_minimo:
+            break
+    return tempos
+
+
+def ler_fixture(nome):
+    with open(os.path.join(FIXTURES, nome), encoding='utf-8') as f:
+        return f.read()
+
+
+def casos(main, tamanhos, diretorio):
+    """Gera (nome, função) para cada benchmark"""
+    service = main.TJSPScrapingService()
+    service.cache_manager = main.CacheManager(main.MemoryStateBackend())
+
+    for fixture in ('cpopg_1.html', 'cpopg_25.html', 'cpopg_200.html'):
+        html_pagina = ler_fixture(fixture)
+        yield f"parse_pagina[{fixture}]", lambda h=html_pagina: service._parse_processos_pagina(h, '123456SP')
+
+    html_detalhe = ler_fixture('detalhe.html')
+    yield "parse_detalhes[detalhe.html]", lambda: service._parse_detalhes_completos(html_detalhe)
+    yield "hash_detalhes[detalhe.html]", lambda: service.paginas_detalhes.impressao(html_detalhe)
+    detalhes = service._parse_detalhes_completos(html_detalhe)
+    yield "formatar_detalhes_processo", lambda: service.formatar_detalhes_processo(detalhes['numero_processo'], detalhes)
+
+    for tamanho in tamanhos:
+        processos = main.ProcessoStore(gerar_processos(tamanho))
+        agregados = main.SessionAggregates(processos)
+        agrupado = agregados.agrupado()
+        indice = main.SearchIndex(processos)
+        ano = next(iter(agrupado))
+        numero = processos[tamanho // 2]['numero']
+
+        yield f"agrupar_por_ano[{tamanho}]", lambda p=processos: service.agrupar_por_ano(p)
+        yield f"buscar_por_numero_sem_indice[{tamanho}]", lambda p=processos, n=numero: service.buscar_por_numero(p, n)
+        yield (f"buscar_por_numero[{tamanho}]",
+               lambda p=processos, n=numero, i=indice: service.buscar_por_numero(p, n, indice=i))
+        yield (f"buscar_por_texto[{tamanho}]",
+               lambda p=processos, i=indice: service.buscar_por_numero(p, 'cobranca', indice=i))
+        yield f"formatar_todos_processos[{tamanho}]", lambda p=processos, a=agrupado: service.formatar_todos_processos(p, a)
+        yield f"formatar_apenas_numeros[{tamanho}]", lambda p=processos, a=agrupado: service.formatar_apenas_numeros(p, a)
+        yield (f"formatar_processos_ano[{tamanho}]",
+               lambda a=agrupado, ano=ano: service.formatar_processos_ano(a[ano], ano))
+
+        itens = [(p['id'], p['numero'], f"https://esaj.tjsp.jus.br/cpopg/show.do?processo.numero={p['numero']}")
+                 for p in processos]
+        cache_file = os.path.join(diretorio, f'links_cache_{tamanho}.jsonl')
+
+        def salvar(itens=itens, cache_file=cache_file):
+            # O arquivo só recebe acréscimos: cada rodada grava todos os links num arquivo novo
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            cache = main.CacheManager(main.MemoryStateBackend())
+            cache.cache_file = cache_file
+            cache.save_links(itens)
+
+        def carregar(cache_file=cache_file):
+            cache = main.CacheManager.__new__(main.CacheManager)
+            cache.cache_file = cache_file
+            cache.backend = main.MemoryStateBackend()
+            return cache._load_cache()
+
+        yield f"cache_save_links[{tamanho}]", salvar
+        yield f"cache_load[{tamanho}]", carregar
+
+        snapshots = main.SnapshotStore(os.path.join(diretorio, f'snapshots_{tamanho}'))
+        yield f"snapshot_salvar[{tamanho}]", lambda p=processos, s=snapshots: s.salvar('123456SP', p)
+        yield f"snapshot_carregar[{tamanho}]", lambda s=snapshots: sum(1 for _ in s.carregar('123456SP'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tamanhos', default='100,1000,10000')
+    parser.add_argument('--filtro', default='', help='roda só benchmarks cujo nome contém o texto')
+    parser.add_argument('--json', action='store_true', help='saída em JSON')
+    parser.add_argument('--limites', default=LIMITES)
+    parser.add_argument('--verificar', action='store_true', help='falha se alguma mediana passar do limite')
+    parser.add_argument('--atualizar-limites', action='store_true')
+    args = parser.parse_args()
+
+    tamanhos = [int(t) for t in args.tamanhos.split(',') if t]
+    limites = {}
+    if os.path.exists(args.limites):
+        with open(args.limites, encoding='utf-8') as f:
+            limites = json.load(f)
+
+    resultados = []
+    diretorio_original = os.getcwd()
+    with tempfile.TemporaryDirectory() as diretorio:
+        # O service grava links_cache.jsonl no diretório atual
+        os.chdir(diretorio)
+        try:
+            # Logs do bot vão para stderr para não misturar com a saída JSON
+            with contextlib.redirect_stdout(sys.stderr):
+                import main as bot
+            for nome, funcao in casos(bot, tamanhos, diretorio):
+                if args.filtro not in nome:
+                    continue
+                with contextlib.redirect_stdout(sys.stderr):
+                    tempos = cronometrar(funcao)
+                mediana = statistics.median(tempos)
+                limite = limites.get(nome)
+                resultados.append({
+                    'nome': nome,
+                    'repeticoes': len(tempos),
+                    'min_ms': round(min(tempos), 4),
+                    'mediana_ms': round(mediana, 4),
+                    'max_ms': round(max(tempos), 4),
+                    'limite_ms': limite,
+                    'regressao': acima_do_limite(mediana, limite),
+                })
+        finally:
+            os.chdir(diretorio_original)
+
+    regressoes = [r for r in resultados if r['regressao']]
+
+    if args.atualizar_limites:
+        limites.update({r['nome']: round(max(r['mediana_ms'] * FOLGA_LIMITES, 0.05), 3) for r in resultados})
+        with open(args.limites, 'w', encoding='utf-8') as f:
+            json.dump(dict(sorted(limites.items())), f, indent=2)
+            f.write('\n')
+
+    if args.json:
+        print(json.dumps({
+            'python': platform.python_version(),
+            'maquina': platform.machine(),
+            'resultados': resultados,
+            'regressoes': [r['nome'] for r in regressoes],
+        }, ensure_ascii=False))
+    else:
+        for r in resultados:
+            limite = f"{r['limite_ms']:10.3f}" if r['limite_ms'] is not None else '         -'
+            marca = '❌' if r['regressao'] else '✅'
+            print(f"{marca} {r['nome']:<45} {r['mediana_ms']:10.3f} ms (min {r['min_ms']:.3f}) limite {limite}")
+        if regressoes:
+            print(f"\n❌ {len(regressoes)} regressões acima do limite")
+
+    if args.verificar and regressoes:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Benchmark ponta a ponta do consultar_por_oab (Playwright + Chromium) contra o mock local do ESAJ.
+
+Sobe tools/mock_esaj.py no mesmo processo, aponta o service para ele
+(base_url) e roda consultas concorrentes, reportando duração por consulta
+e as fases medidas em /metrics (landing, form, pagina, detalhe).
+
+Uso:
+    python benchmarks/bench_scrape.py [--consultas 4] [--concorrencia 2] [--processos 300]
+                                      [--latencia-ms 150] [--erro-taxa 0.02] [--detalhes 5] [--json]
+
+Requer o Chromium do Playwright instalado (playwright install chromium).
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(DIRETORIO, '..'))
+sys.path.insert(0, os.path.join(DIRETORIO, '..', 'tools'))
+
+import mock_esaj  # noqa: E402
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def resumo_fases(metrics):
+    """Média e contagem por fase a partir do histograma tjsp_scrape_fase_segundos"""
+    fases = {}
+    for chave, (_, soma, total) in metrics.series['tjsp_scrape_fase_segundos'].items():
+        fase = dict(chave)['fase']
+        fases[fase] = {'quantidade': total, 'media_ms': round(soma / total * 1000, 1) if total else None}
+    return fases
+
+
+async def executar(args):
+    mock_args = mock_esaj.criar_parser().parse_args([
+        '--port', str(args.port), '--processos', str(args.processos),
+        '--latencia-ms', str(args.latencia_ms), '--jitter-ms', str(args.jitter_ms),
+        '--erro-taxa', str(args.erro_taxa), '--seed', '1',
+    ])
+    mock = mock_esaj.mock_dos_argumentos(mock_args)
+    runner = await mock_esaj.iniciar(mock, '127.0.0.1', args.port)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        import main as bot
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    semaforo = asyncio.Semaphore(args.concorrencia)
+    duracoes, falhas, processos_por_consulta = [], 0, []
+
+    async def consulta(i):
+        nonlocal falhas
+        oab = f"{100001 + i:06d}SP"
+        service = bot.TJSPScrapingService(base_url=base_url)
+        service.cache_manager = bot.CacheManager(bot.MemoryStateBackend())
+        async with semaforo:
+            inicio = time.perf_counter()
+            with contextlib.redirect_stdout(sys.stderr):
+                processos, erro = await service.consultar_por_oab(oab)
+                for processo in list(processos)[:args.detalhes]:
+                    await service.obter_detalhes_processo(processo['id'])
+            duracoes.append(time.perf_counter() - inicio)
+        if erro or not processos:
+            falhas += 1
+        processos_por_consulta.append(len(processos))
+
+    inicio_total = time.perf_counter()
+    try:
+        await asyncio.gather(*(consulta(i) for i in range(args.consultas)))
+    finally:
+        total = time.perf_counter() - inicio_total
+        await bot.browser_pool.fechar()
+        await runner.cleanup()
+
+    return {
+        'consultas': args.consultas,
+        'concorrencia': args.concorrencia,
+        'falhas': falhas,
+        'duracao_total_s': round(total, 2),
+        'consulta_p50_s': round(percentil(duracoes, 50), 2) if duracoes else None,
+        'consulta_p95_s': round(percentil(duracoes, 95), 2) if duracoes else None,
+        'consulta_media_s': round(statistics.mean(duracoes), 2) if duracoes else None,
+        'processos_por_consulta': processos_por_consulta,
+        'fases': resumo_fases(bot.metrics),
+        'mock': dict(mock.stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--consultas', type=int, default=4)
+    parser.add_argument('--concorrencia', type=int, default=2)
+    parser.add_argument('--processos', type=int, default=300, help='processos por OAB no mock')
+    parser.add_argument('--latencia-ms', type=float, default=150)
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    parser.add_argument('--erro-taxa', type=float, default=0.0)
+    parser.add_argument('--detalhes', type=int, default=0, help='detalhes abertos por consulta')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--json', action='store_true', help='saída em JSON')
+    args = parser.parse_args()
+
+    diretorio_original = os.getcwd()
+    with tempfile.TemporaryDirectory() as diretorio:
+        # Cache de links e JSON de processos ficam no diretório temporário
+        os.chdir(diretorio)
+        try:
+            resultado = asyncio.run(executar(args))
+        finally:
+            os.chdir(diretorio_original)
+
+    if args.json:
+        print(json.dumps(resultado, ensure_ascii=False))
+        return
+
+    print(f"🧪 {resultado['consultas']} consultas (concorrência {resultado['concorrencia']}) "
+          f"em {resultado['duracao_total_s']} s - {resultado['falhas']} falhas")
+    print(f"   Por consulta: p50 {resultado['consulta_p50_s']} s | p95 {resultado['consulta_p95_s']} s")
+    for fase, dados in resultado['fases'].items():
+        print(f"   {fase:<10} {dados['quantidade']:5d}x  média {dados['media_ms']} ms")
+    print(f"   Mock: {resultado['mock']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""Teste de carga dos handlers do bot contra a Bot API local (tools/mock_telegram.py).
+
+Roda o Application de setup_bot() em polling no mesmo processo e simula N
+usuários que consultam uma OAB, abrem um ano, pedem /detalhes_ e /stats,
+todos ao mesmo tempo. Reporta p50/p95/p99 da latência até a primeira
+resposta do bot (por tipo de comando), vazão de mensagens e o atraso do
+event loop.
+
+Por padrão as OABs e os detalhes são servidos pelo cache de resultados,
+pré-carregado com processos sintéticos, para medir só o bot. Com
+--esaj-url as consultas vão ao ESAJ indicado (ex.: tools/mock_esaj.py),
+o que exige o Chromium do Playwright.
+
+Uso:
+    python benchmarks/bench_telegram.py [--usuarios 50] [--rodadas 2] [--processos 200] [--json]
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(DIRETORIO, '..'))
+sys.path.insert(0, os.path.join(DIRETORIO, '..', 'tools'))
+sys.path.insert(0, DIRETORIO)
+
+import mock_telegram  # noqa: E402
+from dados import gerar_processos  # noqa: E402
+
+
+def percentis(valores):
+    if not valores:
+        return {'quantidade': 0}
+    ordenados = sorted(valores)
+
+    def p(q):
+        return round(ordenados[min(len(ordenados) - 1, int(round(q / 100 * (len(ordenados) - 1))))] * 1000, 1)
+
+    return {'quantidade': len(ordenados), 'p50_ms': p(50), 'p95_ms': p(95), 'p99_ms': p(99),
+            'max_ms': round(ordenados[-1] * 1000, 1)}
+
+
+def oab_do_usuario(indice):
+    return f"{200001 + indice:06d}SP"
+
+
+def semear_caches(bot, usuarios, quantidade):
+    """Resultados e detalhes em cache para cada OAB simulada (sem Chromium)"""
+    cache_links = bot.CacheManager()
+    for indice in range(usuarios):
+        oab = oab_do_usuario(indice)
+        processos = gerar_processos(quantidade, seed=oab)
+        links = []
+        for processo in processos:
+            processo['id'] = hashlib.md5(f"{processo['numero']}_{oab}".encode()).hexdigest()[:10]
+            links.append((processo['id'], processo['numero'],
+                          f"https://esaj.tjsp.jus.br/cpopg/show.do?processo.numero={processo['numero']}"))
+            bot.result_cache.save_detalhes(processo['id'], {
+                'numero_processo': processo['numero'], 'classe': processo['classe'],
+                'assunto': processo['assunto'], 'foro': processo['data_movimentacao'].split(' - ')[-1],
+                'vara': '1ª Vara Cível', 'area': 'Cível',
+            })
+        cache_links.save_links(links)
+        bot.result_cache.save_resultado(oab, bot.ProcessoStore(processos))
+
+
+async def medir_lag(amostras, parar, intervalo=0.01):
+    """Atraso do event loop: quanto um sleep(intervalo) passa do esperado"""
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        amostras.append(max(0.0, time.perf_counter() - inicio - intervalo))
+
+
+async def usuario(mock, indice, rodadas, latencias, erros, timeout):
+    chat_id = 500000 + indice
+    username = f"carga{indice}"
+
+    async def enviar(tipo, texto, final=None):
+        inicio = mock.enviar_mensagem(chat_id, username, texto)
+        primeira = await mock.aguardar_mensagem(chat_id, inicio, timeout=timeout)
+        if primeira is None:
+            erros[tipo] = erros.get(tipo, 0) + 1
+            return None
+        latencias.setdefault(tipo, []).append(primeira['instante'] - inicio)
+        if final is None:
+            return primeira
+        concluida = await mock.aguardar_mensagem(chat_id, inicio, final, timeout=timeout)
+        if concluida is None:
+            erros[f"{tipo}_conclusao"] = erros.get(f"{tipo}_conclusao", 0) + 1
+            return None
+        latencias.setdefault(f"{tipo}_conclusao", []).append(concluida['instante'] - inicio)
+        return concluida
+
+    for _ in range(rodadas):
+        resumo = await enviar('oab', oab_do_usuario(indice),
+                              final=lambda t: 'CONSULTA COMPLETA' in t or t.startswith('❌'))
+        anos = re.findall(r'`/(\d{4})`', resumo['text']) if resumo else []
+        if not anos:
+            continue
+        lista = await enviar('ano', f"/{anos[0]}")
+        ids = re.findall(r'/detalhes_(\w+)', lista['text']) if lista else []
+        if ids:
+            await enviar('detalhes', f"/detalhes_{ids[0]}", final=lambda t: 'DETALHES DO PROCESSO' in t)
+        await enviar('stats', '/stats')
+        await enviar('limpar', '/limpar')
+
+
+async def executar(args):
+    mock = mock_telegram.MockTelegram(latencia_ms=args.latencia_api_ms)
+    runner = await mock_telegram.iniciar(mock, '127.0.0.1', args.port)
+
+    os.environ['TELEGRAM_API_URL'] = f"http://127.0.0.1:{args.port}"
+    os.environ.setdefault('BOT_TOKEN', '123456:CARGA')
+    if args.esaj_url:
+        os.environ['ESAJ_BASE_URL'] = args.esaj_url
+
+    with contextlib.redirect_stdout(sys.stderr):
+        import main as bot
+        # Uma linha de log por chamada HTTP distorce a medição
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        bot.BOT_TOKEN = os.environ['BOT_TOKEN']
+        for indice in range(args.usuarios):
+            bot.license_manager.add_license(f"carga{indice}", 7)
+        if not args.esaj_url:
+            semear_caches(bot, args.usuarios, args.processos)
+        app = bot.setup_bot()
+        await app.initialize()
+        await app.updater.start_polling(poll_interval=0, timeout=1, drop_pending_updates=True)
+        await app.start()
+
+    latencias, erros, lag = {}, {}, []
+    parar = asyncio.Event()
+    tarefa_lag = asyncio.create_task(medir_lag(lag, parar))
+    mensagens_antes = mock.total_mensagens()
+    inicio = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            await asyncio.gather(*(
+                usuario(mock, indice, args.rodadas, latencias, erros, args.timeout)
+                for indice in range(args.usuarios)
+            ))
+    finally:
+        duracao = time.perf_counter() - inicio
+        parar.set()
+        await tarefa_lag
+        mock.encerrar()
+        with contextlib.redirect_stdout(sys.stderr):
+            await app.updater.stop()
+            await app.stop()
+            await app.shutdown()
+            await bot.browser_pool.fechar()
+        await runner.cleanup()
+
+    enviadas_usuarios = sum(len(v) for k, v in latencias.items() if not k.endswith('_conclusao'))
+    return {
+        'usuarios': args.usuarios,
+        'rodadas': args.rodadas,
+        'duracao_s': round(duracao, 2),
+        'mensagens_usuarios': enviadas_usuarios,
+        'mensagens_bot': mock.total_mensagens() - mensagens_antes,
+        'vazao_mensagens_usuarios_s': round(enviadas_usuarios / duracao, 1) if duracao else None,
+        'vazao_mensagens_bot_s': round((mock.total_mensagens() - mensagens_antes) / duracao, 1) if duracao else None,
+        'latencia': {tipo: percentis(valores) for tipo, valores in sorted(latencias.items())},
+        'lag_event_loop': dict(percentis(lag), media_ms=round(statistics.mean(lag) * 1000, 2) if lag else None),
+        'erros': erros,
+        'chamadas_api': mock.chamadas,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--usuarios', type=int, default=50)
+    parser.add_argument('--rodadas', type=int, default=2)
+    parser.add_argument('--processos', type=int, default=200, help='processos por OAB no cache semeado')
+    parser.add_argument('--latencia-api-ms', type=float, default=0, help='atraso simulado da Bot API')
+    parser.add_argument('--esaj-url', default=None, help='consultar um ESAJ de verdade/mock em vez do cache')
+    parser.add_argument('--timeout', type=float, default=60, help='segundos aguardando cada resposta')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--json', action='store_true', help='saída em JSON')
+    args = parser.parse_args()
+
+    diretorio_original = os.getcwd()
+    with tempfile.TemporaryDirectory() as diretorio:
+        # Sessões, cache de links e licenças temporárias ficam fora do repositório
+        os.chdir(diretorio)
+        try:
+            resultado = asyncio.run(executar(args))
+        finally:
+            os.chdir(diretorio_original)
+
+    if args.json:
+        print(json.dumps(resultado, ensure_ascii=False))
+        return
+
+    print(f"🧪 {resultado['usuarios']} usuários x {resultado['rodadas']} rodadas em {resultado['duracao_s']} s")
+    print(f"   Vazão: {resultado['vazao_mensagens_usuarios_s']} msg/s de usuários | "
+          f"{resultado['vazao_mensagens_bot_s']} msg/s do bot")
+    for tipo, dados in resultado['latencia'].items():
+        if dados['quantidade']:
+            print(f"   {tipo:<20} {dados['quantidade']:5d}x  p50 {dados['p50_ms']:8.1f} ms  "
+                  f"p95 {dados['p95_ms']:8.1f} ms  p99 {dados['p99_ms']:8.1f} ms")
+    lag = resultado['lag_event_loop']
+    if lag['quantidade']:
+        print(f"   Lag do event loop: p50 {lag['p50_ms']} ms | p99 {lag['p99_ms']} ms | máx {lag['max_ms']} ms")
+    if resultado['erros']:
+        print(f"   ❌ Sem resposta: {resultado['erros']}")
+
+
+if __name__ == '__main__':
+    main()
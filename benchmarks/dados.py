@@ -0,0 +1,33 @@
+"""Processos sintéticos para benchmarks e servidores de teste (sem importar o bot)."""
+import random
+
+CLASSES = [
+    'Procedimento Comum Cível', 'Execução de Título Extrajudicial', 'Cumprimento de Sentença',
+    'Monitória', 'Busca e Apreensão em Alienação Fiduciária', 'Despejo por Falta de Pagamento',
+    'Procedimento do Juizado Especial Cível', 'Inventário', 'Usucapião', 'Embargos à Execução',
+]
+ASSUNTOS = [
+    'Indenização por Dano Moral', 'Cobrança', 'Contratos Bancários', 'Prestação de Serviços',
+    'Locação de Imóvel', 'Alienação Fiduciária', 'Obrigações', 'Espécies de Contratos',
+    'Inadimplemento', 'Compra e Venda', 'Rescisão / Resolução', 'Duplicata',
+] + [f'Assunto Específico {i}' for i in range(40)]
+FOROS = ['Foro Central Cível', 'Foro de Guarulhos', 'Foro de Santo André', 'Foro Regional II - Santo Amaro']
+
+
+def gerar_processos(quantidade, seed=42):
+    """Gera processos sintéticos com strings novas a cada linha, como o parser do BeautifulSoup"""
+    rnd = random.Random(seed)
+    processos = []
+    for i in range(quantidade):
+        ano = rnd.choice(range(2010, 2026))
+        numero = f"{rnd.randint(0, 9999999):07d}-{rnd.randint(10, 99)}.{ano}.8.26.{rnd.randint(1, 999):04d}"
+        processos.append({
+            'id': f"{i:010x}",
+            'numero': numero,
+            'classe': ''.join(rnd.choice(CLASSES)),
+            'assunto': ''.join(rnd.choice(ASSUNTOS)),
+            'ano': ano,
+            'data_movimentacao': f"{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/{ano} - {rnd.choice(FOROS)}",
+            'advogado': ''.join(rnd.choice(['N/A', 'João da Silva Advogados', 'Maria Souza'])),
+        })
+    return processos
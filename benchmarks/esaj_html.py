@@ -0,0 +1,170 @@
+"""HTML no formato das páginas do ESAJ (cpopg) para fixtures de benchmark e servidores de teste.
+
+Regenerar as fixtures:
+    python benchmarks/esaj_html.py
+"""
+import html
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dados import gerar_processos  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+CABECALHO = """<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+<meta charset="utf-8">
+<title>{titulo}</title>
+<link rel="stylesheet" href="/cpopg/css/unj.min.css">
+<script src="/cpopg/js/jquery.min.js"></script>
+</head>
+<body class="unj-body">
+<header class="unj-header"><div class="unj-header__logo"><a href="/esaj/portal.do">e-SAJ</a></div>
+<nav class="unj-header__menu"><ul><li><a href="/cpopg/open.do">Consultas Processuais</a></li>
+<li><a href="/cpo/pg/open.do">1º Grau</a></li><li><a href="/cpo/sg/open.do">2º Grau</a></li></ul></nav></header>
+<main class="unj-main">
+"""
+
+RODAPE = """</main>
+<footer class="unj-footer"><p>Tribunal de Justiça do Estado de São Paulo</p></footer>
+</body>
+</html>
+"""
+
+FORMULARIO = """<form id="formConsulta" action="{acao}" method="get" class="unj-form">
+<div class="unj-form-group">
+<label for="cbPesquisa">Consultar por</label>
+<select name="cbPesquisa" id="cbPesquisa" class="unj-select">
+<option value="NUMPROC">Número do Processo</option>
+<option value="NMPARTE">Nome da parte</option>
+<option value="DOCPARTE">Documento da Parte</option>
+<option value="NMADVOGADO">Nome do Advogado</option>
+<option value="NUMOAB">OAB</option>
+<option value="PRECATORIA">Nº da Carta Precatória na Origem</option>
+</select>
+</div>
+<div class="unj-form-group">
+<input type="text" id="campo_NUMOAB" name="dadosConsulta.valorConsulta" class="unj-input" disabled>
+</div>
+<input type="submit" id="botaoConsultarProcessos" value="Consultar" class="unj-button">
+</form>
+<script>
+document.getElementById('cbPesquisa').addEventListener('change', function () {{
+  document.getElementById('campo_NUMOAB').disabled = this.value !== 'NUMOAB';
+}});
+</script>
+"""
+
+
+def _e(texto):
+    return html.escape(str(texto), quote=True)
+
+
+def link_processo(processo, base=''):
+    numero = processo['numero']
+    codigo = processo['id'].upper()[:10]
+    return f"{base}/cpopg/show.do?processo.codigo={codigo}&processo.foro={numero[-4:]}&processo.numero={numero}"
+
+
+def pagina_inicial(acao='/cpopg/search.do'):
+    """Tela de consulta (open.do) com o seletor de tipo de pesquisa"""
+    return CABECALHO.format(titulo='Consulta de Processos de 1ºGrau') + FORMULARIO.format(acao=_e(acao)) + RODAPE
+
+
+def pagina_resultados(processos, inicio=1, total=None, proxima=None, base=''):
+    """Página de resultados do cpopg (search.do) com uma linha <li> por processo"""
+    total = len(processos) if total is None else total
+    fim = inicio + len(processos) - 1
+    partes = [CABECALHO.format(titulo='Consulta de Processos de 1ºGrau'), FORMULARIO.format(acao='/cpopg/search.do')]
+    partes.append(
+        f'<div class="unj-entity-header__summary">'
+        f'<span id="contadorDeProcessos">{total} Processos encontrados</span></div>\n'
+        f'<div class="resultadoPaginacao">Resultados {inicio} a {fim} de {total}</div>\n'
+        f'<div id="listagemDeProcessos"><ul class="unj-list-row">\n'
+    )
+    for processo in processos:
+        partes.append(
+            '<li>\n'
+            '<div class="row unj-ai-c home__lista-de-processos">\n'
+            '<div class="col-md-3 nuProcesso">'
+            f'<a href="{_e(link_processo(processo, base))}" class="linkProcesso">{_e(processo["numero"])}</a>'
+            '<input type="hidden" class="codigoProcesso" value="' + _e(processo['id'].upper()) + '"></div>\n'
+            '<div class="col-md-3">'
+            f'<div class="classeProcesso">{_e(processo["classe"])}</div>'
+            f'<div class="assuntoPrincipalProcesso">{_e(processo["assunto"])}</div></div>\n'
+            '<div class="col-md-3">'
+            f'<div class="dataLocalDistribuicaoProcesso">{_e(processo["data_movimentacao"])}</div></div>\n'
+            '<div class="col-md-3">'
+            f'<div class="tipoDeParticipacao">Reqte</div><div class="nomeParte">{_e(processo["advogado"])}</div></div>\n'
+            '</div>\n'
+            '</li>\n'
+        )
+    partes.append('</ul></div>\n<nav class="unj-pagination">\n')
+    partes.append('<a class="unj-pagination__previous" href="#">Anterior</a>\n')
+    if proxima:
+        partes.append(f'<a class="unj-pagination__next" href="{_e(proxima)}">Próxima</a>\n')
+    else:
+        partes.append('<a class="unj-pagination__next disabled" href="#">Próxima</a>\n')
+    partes.append('</nav>\n')
+    partes.append(RODAPE)
+    return ''.join(partes)
+
+
+def pagina_detalhes(processo, movimentacoes=40, seed=7):
+    """Página de um processo (show.do) com partes e movimentações"""
+    rnd = random.Random(seed)
+    foro = processo['data_movimentacao'].split(' - ', 1)[-1]
+    partes = [CABECALHO.format(titulo=f"Processo {processo['numero']}")]
+    partes.append(
+        '<div class="unj-entity-header">\n'
+        f'<span id="numeroProcesso" class="unj-larger">{_e(processo["numero"])}</span>\n'
+        '<span class="unj-tag">Em andamento</span>\n'
+        f'<span id="classeProcesso">{_e(processo["classe"])}</span>\n'
+        f'<span id="assuntoProcesso">{_e(processo["assunto"])}</span>\n'
+        f'<span id="foroProcesso">{_e(foro)}</span>\n'
+        f'<span id="varaProcesso">{rnd.randint(1, 45)}ª Vara Cível</span>\n'
+        '<span id="juizProcesso">Juiz de Direito</span>\n'
+        '<div id="areaProcesso"><span>Cível</span></div>\n'
+        f'<div id="valorAcaoProcesso">R$ {rnd.randint(1000, 900000):,}.00</div>\n'
+        '</div>\n'
+    )
+    partes.append('<table id="tablePartesPrincipais">\n')
+    for tipo, nome in (('Reqte', 'Fulano de Tal'), ('Advogado', processo['advogado']), ('Reqdo', 'Banco Exemplo S/A')):
+        partes.append(f'<tr class="fundoClaro"><td class="label">{tipo}</td>'
+                      f'<td class="nomeParteEAdvogado">{_e(nome)}</td></tr>\n')
+    partes.append('</table>\n<table id="tabelaTodasMovimentacoes"><tbody>\n')
+    for i in range(movimentacoes):
+        partes.append(
+            f'<tr class="containerMovimentacao"><td class="dataMovimentacao">'
+            f'{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/{processo["ano"]}</td>'
+            f'<td class="descricaoMovimentacao">Movimentação {i + 1}: '
+            f'{rnd.choice(["Conclusos para Despacho", "Juntada de Petição", "Publicado", "Certidão Expedida"])}</td></tr>\n'
+        )
+    partes.append('</tbody></table>\n')
+    partes.append(RODAPE)
+    return ''.join(partes)
+
+
+def gerar_fixtures(diretorio=FIXTURES):
+    """Grava as fixtures usadas pelos benchmarks offline"""
+    os.makedirs(diretorio, exist_ok=True)
+    processos = gerar_processos(200, seed=2024)
+    arquivos = {
+        'cpopg_1.html': pagina_resultados(processos[:1]),
+        'cpopg_25.html': pagina_resultados(processos[:25], total=312, proxima='/cpopg/trocarPagina.do?paginaConsulta=2'),
+        'cpopg_200.html': pagina_resultados(processos, total=1200, proxima='/cpopg/trocarPagina.do?paginaConsulta=2'),
+        'detalhe.html': pagina_detalhes(processos[0]),
+    }
+    for nome, conteudo in arquivos.items():
+        with open(os.path.join(diretorio, nome), 'w', encoding='utf-8') as f:
+            f.write(conteudo)
+    return sorted(arquivos)
+
+
+if __name__ == '__main__':
+    for nome in gerar_fixtures():
+        print(f"📝 {os.path.join(FIXTURES, nome)}")
@@ -1,33 +1,122 @@
-from playwright.async_api import async_playwright
-from bs4 import BeautifulSoup
+import time
+
+# Marco zero da inicialização (o Render mede o cold start a partir daqui)
+INICIO_PROCESSO = time.monotonic()
+
+# Playwright, BeautifulSoup e requests são importados só quando usados (~250 ms a menos no cold start)
+
 import re
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.request import HTTPXRequest
 import asyncio
+import contextlib
+import contextvars
+import functools
+import itertools
+import inspect
 import os
 import json
 from datetime import datetime, timedelta
 import hashlib
+import hmac
+import signal
+import uuid
+import bisect
+import sys
+import weakref
+from array import array
+from collections import Counter, OrderedDict, deque
+import unicodedata
 import pickle
+import csv
+import tempfile
+import gzip
+import random
 from threading import Thread
-from flask import Flask
-import requests
+from aiohttp import web
 import logging
+import socket
+import sqlite3
+import threading
+import urllib.parse
+import multiprocessing
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos no índice de snapshots
+    fcntl = None
 
-# ✅ CONFIGURAÇÃO RENDER
-app = Flask(__name__)
+# ✅ CONFIGURAÇÃO RENDER - servidor HTTP assíncrono no mesmo event loop do bot
+routes = web.RouteTableDef()
 
-@app.route('/')
-def home():
-    return "🤖 Bot TJSP Online - Render.com + GitHub Gist"
+# Token validado em cada chamada do webhook; obrigatório no modo webhook (sem ele o bot fica no polling)
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
 
-@app.route('/health')
-def health():
-    return "✅ OK", 200
+@routes.get('/')
+async def home(request):
+    return web.Response(text="🤖 Bot TJSP Online - Render.com + GitHub Gist")
+
+@routes.get('/health')
+async def health(request):
+    """Saúde do bot: 503 só enquanto o bot não roda; sem licenças carregadas fica 'degradado' (200)"""
+    bot_app = request.app['bot_app']
+    saude = {
+        'modo': request.app['estado']['modo'],
+        'bot_rodando': bot_app.running,
+        'licencas_carregadas': license_manager.loaded,
+        'licencas_origem': license_manager.origem,
+        'browser_pool_aquecido': browser_pool.aquecido,
+        'fila_updates': bot_app.update_queue.qsize(),
+        'jobs_ativos': len(job_registry.ativos()),
+        'fila_workers': scrape_workers.tamanho_fila(),
+        'sessoes_ativas': session_manager.active_sessions(),
+        'fila_consultas': scrape_scheduler.resumo(),
+        'memoria': memory_governor.resumo(),
+        'esaj': esaj_limiter.resumo(),
+        'inicializacao': inicializacao.fases
+    }
+    # Gist fora do ar sem cache em disco não é motivo para o orquestrador reiniciar o bot em loop
+    if not saude['bot_rodando']:
+        saude['status'] = 'iniciando'
+    elif not saude['licencas_carregadas']:
+        saude['status'] = 'degradado'
+    else:
+        saude['status'] = 'ok'
+    return web.json_response(saude, status=200 if saude['bot_rodando'] else 503)
+
+@routes.get('/metrics')
+async def metrics_endpoint(request):
+    """Métricas no formato texto do Prometheus"""
+    return web.Response(
+        body=metrics.renderizar().encode('utf-8'),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    return "📩 Webhook received", 200
+@routes.post('/webhook')
+async def webhook(request):
+    """Recebe updates do Telegram e os entrega à fila do Application sem esperar o processamento"""
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not WEBHOOK_SECRET or not hmac.compare_digest(token, WEBHOOK_SECRET):
+        return web.Response(text="🚫 Token inválido", status=403)
+    
+    bot_app = request.app['bot_app']
+    if request.app['estado']['modo'] != 'webhook':
+        return web.Response(text="🚧 Bot não está em modo webhook", status=503)
+    
+    try:
+        dados = await request.json()
+    except Exception:
+        return web.Response(text="❌ Update inválido", status=400)
+    
+    # Aceita um update ou uma lista deles; tudo é enfileirado e confirmado de uma vez
+    for item in dados if isinstance(dados, list) else [dados]:
+        try:
+            bot_app.update_queue.put_nowait(Update.de_json(item, bot_app.bot))
+        except Exception as e:
+            print(f"⚠️ Update do webhook ignorado: {e}")
+    
+    return web.Response(text="📩 Webhook received")
 
 # Configure logging
 logging.basicConfig(
@@ -35,71 +124,1053 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-class CacheManager:
+class MetricsRegistry:
+    """Contadores, gauges e histogramas em memória, expostos em /metrics no formato do Prometheus"""
+    
+    BUCKETS_SEGUNDOS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+    
+    def __init__(self):
+        self.definicoes = {}
+        self.series = {}
+        self.callbacks = {}
+        self.lock = threading.Lock()
+        # Nos workers as observações são acumuladas aqui e enviadas ao processo do bot
+        self.encaminhar = None
+    
+    def declarar(self, nome, tipo, ajuda, buckets=None):
+        """Registra uma métrica (counter, gauge ou histogram)"""
+        self.definicoes[nome] = (tipo, ajuda, tuple(buckets or self.BUCKETS_SEGUNDOS))
+        self.series.setdefault(nome, {})
+    
+    def gauge_dinamico(self, nome, ajuda, funcao):
+        """Gauge calculado na leitura; a função devolve um número ou {labels: valor}"""
+        self.declarar(nome, 'gauge', ajuda)
+        self.callbacks[nome] = funcao
+    
+    def incrementar(self, nome, valor=1, **labels):
+        self._aplicar('incrementar', nome, valor, labels)
+    
+    def definir(self, nome, valor, **labels):
+        self._aplicar('definir', nome, valor, labels)
+    
+    def observar(self, nome, valor, **labels):
+        self._aplicar('observar', nome, valor, labels)
+    
+    @contextlib.contextmanager
+    def cronometrar(self, nome, **labels):
+        """Observa a duração do bloco em segundos, menos o que o bloco puser em medicao['descontar']"""
+        medicao = {'descontar': 0}
+        inicio = time.monotonic()
+        try:
+            yield medicao
+        finally:
+            self.observar(nome, max(0.0, time.monotonic() - inicio - medicao['descontar']), **labels)
+    
+    def _aplicar(self, operacao, nome, valor, labels):
+        if self.encaminhar is not None:
+            self.encaminhar.append((operacao, nome, valor, labels))
+            return
+        
+        definicao = self.definicoes.get(nome)
+        if not definicao:
+            return
+        
+        chave = tuple(sorted(labels.items()))
+        with self.lock:
+            serie = self.series[nome]
+            if operacao == 'observar':
+                buckets = definicao[2]
+                atual = serie.get(chave)
+                if atual is None:
+                    atual = serie[chave] = [[0] * len(buckets), 0.0, 0]
+                posicao = bisect.bisect_left(buckets, valor)
+                if posicao < len(buckets):
+                    atual[0][posicao] += 1
+                atual[1] += valor
+                atual[2] += 1
+            elif operacao == 'incrementar':
+                serie[chave] = serie.get(chave, 0) + valor
+            else:
+                serie[chave] = valor
+    
+    def aplicar(self, itens):
+        """Aplica observações encaminhadas por um worker"""
+        for operacao, nome, valor, labels in itens:
+            self._aplicar(operacao, nome, valor, labels)
+    
+    def retirar_encaminhados(self):
+        itens, self.encaminhar = self.encaminhar or [], []
+        return itens
+    
+    def valor(self, nome, **labels):
+        """Valor atual de um contador/gauge (0 se ainda não existe)"""
+        return self.series.get(nome, {}).get(tuple(sorted(labels.items())), 0)
+    
+    @staticmethod
+    def _escapar(valor):
+        return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    
+    @staticmethod
+    def _formatar_labels(chave, extra=()):
+        pares = list(chave) + list(extra)
+        if not pares:
+            return ''
+        texto = ','.join(f'{nome}="{MetricsRegistry._escapar(valor)}"' for nome, valor in pares)
+        return '{' + texto + '}'
+    
+    @staticmethod
+    def _numero(valor):
+        return repr(float(valor)) if isinstance(valor, float) else str(valor)
+    
+    def renderizar(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)"""
+        linhas = []
+        for nome, (tipo, ajuda, buckets) in self.definicoes.items():
+            if nome in self.callbacks:
+                try:
+                    resultado = self.callbacks[nome]()
+                except Exception as e:
+                    print(f"⚠️ Erro ao calcular métrica {nome}: {e}")
+                    continue
+                if not isinstance(resultado, dict):
+                    resultado = {(): resultado}
+                series = {tuple(sorted(dict(chave).items())): valor for chave, valor in resultado.items()}
+            else:
+                with self.lock:
+                    series = {chave: (list(v[0]), v[1], v[2]) if tipo == 'histogram' else v
+                              for chave, v in self.series[nome].items()}
+            
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            for chave, valor in sorted(series.items()):
+                if tipo != 'histogram':
+                    linhas.append(f"{nome}{self._formatar_labels(chave)} {self._numero(valor)}")
+                    continue
+                contagens, soma, total = valor
+                acumulado = 0
+                for limite, quantidade in zip(buckets, contagens):
+                    acumulado += quantidade
+                    linhas.append(f"{nome}_bucket{self._formatar_labels(chave, [('le', limite)])} {acumulado}")
+                linhas.append(f"{nome}_bucket{self._formatar_labels(chave, [('le', '+Inf')])} {total}")
+                linhas.append(f"{nome}_sum{self._formatar_labels(chave)} {self._numero(soma)}")
+                linhas.append(f"{nome}_count{self._formatar_labels(chave)} {total}")
+        return '\n'.join(linhas) + '\n'
+
+class MetricsHTTPXRequest(HTTPXRequest):
+    """Cliente HTTP do bot que mede a fila de envio e a latência das chamadas à API do Telegram"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pendentes = 0
+    
+    async def do_request(self, url, method, *args, **kwargs):
+        self.pendentes += 1
+        metrics.definir('tjsp_telegram_fila_envio', self.pendentes)
+        try:
+            metodo = url.rsplit('/', 1)[-1]
+            with tracer.span(f"telegram.{metodo}"), metrics.cronometrar('tjsp_telegram_requisicao_segundos', metodo=metodo):
+                return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            self.pendentes -= 1
+            metrics.definir('tjsp_telegram_fila_envio', self.pendentes)
+
+def declarar_metricas(registro):
+    """Métricas do bot; gauges dinâmicos leem os gerenciadores no momento da coleta"""
+    registro.declarar('tjsp_scrape_fase_segundos', 'histogram',
+                      'Duração das fases do scraping (landing, form, pagina, detalhe)')
+    registro.declarar('tjsp_paginas_por_oab', 'histogram', 'Páginas de resultados percorridas por consulta de OAB',
+                      buckets=(1, 2, 3, 5, 10, 20, 30, 50, 100, 200))
+    registro.declarar('tjsp_processos_indexados', 'histogram', 'Processos indexados por consulta de OAB',
+                      buckets=(1, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000))
+    registro.declarar('tjsp_pagina_retentativas_total', 'counter', 'Retentativas de leitura de páginas de resultados')
+    registro.declarar('tjsp_retomadas_total', 'counter', 'Consultas retomadas em um contexto novo do navegador')
+    registro.declarar('tjsp_consultas_incompletas_total', 'counter', 'Consultas encerradas com resultado parcial')
+    registro.declarar('tjsp_cache_consultas_total', 'counter', 'Consultas aos caches de links, resultados e detalhes')
+    registro.declarar('tjsp_detalhes_paginas_total', 'counter',
+                      'Páginas de detalhes por resultado da comparação de hash (nova, alterada, inalterada)')
+    registro.gauge_dinamico('tjsp_cache_acerto_razao', 'Razão de acertos por cache', lambda: {
+        (('cache', cache),): acertos / (acertos + erros)
+        for cache in ('links', 'resultados', 'detalhes')
+        for acertos, erros in [(registro.valor('tjsp_cache_consultas_total', cache=cache, resultado='hit'),
+                                registro.valor('tjsp_cache_consultas_total', cache=cache, resultado='miss'))]
+        if acertos + erros
+    })
+    registro.declarar('tjsp_gist_duracao_segundos', 'histogram', 'Latência das chamadas à API do GitHub Gist')
+    registro.declarar('tjsp_gist_erros_total', 'counter', 'Falhas nas chamadas ao GitHub Gist')
+    registro.declarar('tjsp_telegram_requisicao_segundos', 'histogram', 'Latência das chamadas à API do Telegram')
+    registro.declarar('tjsp_telegram_fila_envio', 'gauge', 'Chamadas à API do Telegram aguardando resposta')
+    registro.gauge_dinamico('tjsp_sessoes_ativas', 'Sessões ativas', lambda: session_manager.active_sessions())
+    registro.gauge_dinamico('tjsp_jobs_ativos', 'Consultas de OAB em andamento', lambda: len(job_registry.ativos()))
+    registro.gauge_dinamico('tjsp_fila_workers', 'Jobs aguardando ou em execução nos workers',
+                            lambda: scrape_workers.tamanho_fila())
+    registro.declarar('tjsp_workers_reiniciados_total', 'counter', 'Workers de scraping que morreram e foram substituídos')
+    registro.gauge_dinamico('tjsp_inicializacao_segundos', 'Duração das fases da inicialização', lambda: {
+        (('fase', fase),): duracao for fase, duracao in inicializacao.fases.items()
+    })
+    registro.gauge_dinamico('tjsp_fila_consultas', 'Consultas ao TJSP esperando a vez no agendador',
+                            lambda: scrape_scheduler.aguardando())
+    registro.declarar('tjsp_fila_consultas_espera_segundos', 'histogram', 'Espera na fila do agendador de consultas')
+    registro.declarar('tjsp_cota_recusas_total', 'counter', 'Consultas recusadas por cota esgotada da licença')
+    registro.declarar('tjsp_esaj_latencia_segundos', 'histogram', 'Latência das requisições ao ESAJ por tipo')
+    registro.declarar('tjsp_esaj_espera_segundos', 'histogram',
+                      'Espera no limitador antes de cada requisição ao ESAJ, por tipo (fora das fases do scraping)')
+    registro.declarar('tjsp_esaj_erros_total', 'counter', 'Respostas com erro, bloqueio ou captcha do ESAJ')
+    registro.declarar('tjsp_esaj_circuito_aberturas_total', 'counter', 'Vezes em que o ESAJ foi pausado pelo circuit breaker')
+    registro.gauge_dinamico('tjsp_esaj_taxa', 'Taxa atual de requisições ao ESAJ (req/s)', lambda: esaj_limiter.taxa)
+    registro.gauge_dinamico('tjsp_esaj_circuito_aberto', 'Circuit breaker do ESAJ aberto (1) ou fechado (0)',
+                            lambda: 0 if esaj_limiter.estado == 'fechado' else 1)
+    registro.gauge_dinamico('tjsp_memoria_mb', 'RSS em MB do bot e dos processos filhos (Chromium, driver, workers)',
+                            lambda: {(('processo', processo),): memory_governor.amostrar()[f"{processo}_mb"]
+                                     for processo in ('bot', 'filhos')})
+    registro.declarar('tjsp_browser_reciclagens_total', 'counter', 'Reinícios do Chromium por páginas abertas ou memória')
+    registro.gauge_dinamico('tjsp_scrapes_aguardando_memoria', 'Consultas na fila esperando memória livre',
+                            lambda: memory_governor.aguardando)
+    registro.declarar('tjsp_scrapes_recusados_memoria_total', 'counter', 'Consultas recusadas por falta de memória')
+    registro.gauge_dinamico('tjsp_monitoramento_oabs', 'OABs monitoradas', lambda: len(watchlist.oabs()))
+    registro.declarar('tjsp_monitoramento_verificacoes_total', 'counter', 'Verificações de OABs monitoradas')
+    registro.declarar('tjsp_monitoramento_novidades_total', 'counter', 'Processos novos ou alterados encontrados pelo monitoramento')
+
+class Tracer:
+    """Spans leves por requisição (contextvars); traces lentos vão para um log JSONL e para o /trace"""
+    
+    def __init__(self, limite_ms=None, arquivo=None, maximo=50):
+        self.limite_ms = float(limite_ms if limite_ms is not None else os.environ.get('TRACE_SLOW_MS', '10000'))
+        self.arquivo = arquivo or os.environ.get('TRACE_LOG', 'traces_lentos.jsonl')
+        self.lentos = deque(maxlen=maximo)
+        self.atual = contextvars.ContextVar('span_atual', default=None)
+    
+    def _novo_span(self, nome, atributos, raiz=False):
+        pai = None if raiz else self.atual.get()
+        span = {'nome': nome, 'atributos': atributos, 'filhos': [], 'inicio': time.monotonic()}
+        if pai is None:
+            span['trace_id'] = uuid.uuid4().hex[:12]
+            span['iniciado_em'] = datetime.now().isoformat(timespec='seconds')
+        else:
+            pai['filhos'].append(span)
+        return span, pai
+    
+    @contextlib.contextmanager
+    def span(self, nome, raiz=False, **atributos):
+        """Abre um span filho do span atual (ou a raiz de um novo trace)"""
+        span, pai = self._novo_span(nome, atributos, raiz)
+        token = self.atual.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span['erro'] = type(e).__name__
+            raise
+        finally:
+            span['duracao_ms'] = round((time.monotonic() - span.pop('inicio')) * 1000, 1)
+            self.atual.reset(token)
+            if pai is None:
+                self._finalizar(span)
+    
+    def registrar(self, nome, inicio, **atributos):
+        """Anexa ao span atual uma etapa já concluída, iniciada em time.monotonic() == inicio"""
+        pai = self.atual.get()
+        if pai is not None:
+            pai['filhos'].append({
+                'nome': nome, 'atributos': atributos, 'filhos': [],
+                'duracao_ms': round((time.monotonic() - inicio) * 1000, 1)
+            })
+    
+    def anotar(self, **atributos):
+        """Acrescenta atributos ao span atual"""
+        span = self.atual.get()
+        if span is not None:
+            span['atributos'].update(atributos)
+    
+    def _finalizar(self, trace):
+        if trace['duracao_ms'] < self.limite_ms:
+            return
+        self.lentos.append(trace)
+        try:
+            with open(self.arquivo, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(trace, ensure_ascii=False, default=str) + '\n')
+        except Exception as e:
+            print(f"⚠️ Erro ao gravar trace lento: {e}")
+    
+    def ultimos_lentos(self, quantidade=5):
+        return list(self.lentos)[-quantidade:][::-1]
+    
+    @classmethod
+    def formatar(cls, trace, nivel=0, limite_filhos=15):
+        """Árvore de spans legível para o Telegram"""
+        atributos = ' '.join(f"{k}={v}" for k, v in trace['atributos'].items())
+        erro = f" ⚠️{trace['erro']}" if trace.get('erro') else ''
+        linhas = [f"{'  ' * nivel}{'└ ' if nivel else ''}{trace['nome']} {trace['duracao_ms']:.0f} ms {atributos}{erro}".rstrip()]
+        filhos = trace['filhos']
+        for filho in filhos[:limite_filhos]:
+            linhas.extend(cls.formatar(filho, nivel + 1, limite_filhos).split('\n'))
+        if len(filhos) > limite_filhos:
+            linhas.append(f"{'  ' * (nivel + 1)}… +{len(filhos) - limite_filhos} spans")
+        return '\n'.join(linhas)
+
+def _atributos_update(args):
+    """Usuário e texto da mensagem, se algum argumento for um Update"""
+    for arg in args:
+        if isinstance(arg, Update) and arg.message:
+            return {
+                'usuario': arg.message.from_user.username if arg.message.from_user else None,
+                'texto': (arg.message.text or '')[:40]
+            }
+    return {}
+
+def rastrear(nome, raiz=False):
+    """Decorator que envolve a função (síncrona ou assíncrona) em um span"""
+    def decorador(funcao):
+        if inspect.iscoroutinefunction(funcao):
+            @functools.wraps(funcao)
+            async def envoltorio(*args, **kwargs):
+                with tracer.span(nome, raiz=raiz, **_atributos_update(args)):
+                    return await funcao(*args, **kwargs)
+        else:
+            @functools.wraps(funcao)
+            def envoltorio(*args, **kwargs):
+                with tracer.span(nome, raiz=raiz, **_atributos_update(args)):
+                    return funcao(*args, **kwargs)
+        return envoltorio
+    return decorador
+
+class StartupTimings:
+    """Duração das fases da inicialização, logadas e expostas no /health e em /metrics"""
+    
+    def __init__(self, inicio):
+        self.inicio = inicio
+        self.ultimo_marco = inicio
+        self.fases = {}
+    
+    def _registrar(self, nome, duracao):
+        self.fases[nome] = round(duracao, 3)
+        print(f"⏱ Inicialização - {nome}: {duracao * 1000:.0f} ms")
+    
+    def marco(self, nome):
+        """Fase sequencial: tempo desde o marco anterior"""
+        agora = time.monotonic()
+        self._registrar(nome, agora - self.ultimo_marco)
+        self.ultimo_marco = agora
+    
+    @contextlib.contextmanager
+    def fase(self, nome):
+        """Fase que roda em paralelo com as outras (licenças, Chromium)"""
+        inicio = time.monotonic()
+        try:
+            yield
+        finally:
+            self._registrar(nome, time.monotonic() - inicio)
+    
+    def total(self, nome='pronto'):
+        """Tempo desde o início do processo"""
+        self._registrar(nome, time.monotonic() - self.inicio)
+
+class StateBackend:
+    """Armazenamento de estado (sessões, caches, licenças) separado por namespace"""
+    
+    shared = False
+    
+    def get(self, namespace, key, default=None):
+        raise NotImplementedError
+    
+    def set(self, namespace, key, value, ttl=None):
+        raise NotImplementedError
+    
+    def set_many(self, namespace, items, ttl=None):
+        for key, value in items.items():
+            self.set(namespace, key, value, ttl)
+    
+    def delete(self, namespace, key):
+        raise NotImplementedError
+    
+    def keys(self, namespace):
+        raise NotImplementedError
+    
+    def get_all(self, namespace):
+        return {key: self.get(namespace, key) for key in self.keys(namespace)}
+    
+    def get_many(self, namespace, keys):
+        """{key: valor} das chaves existentes"""
+        valores = {}
+        for key in keys:
+            valor = self.get(namespace, key)
+            if valor is not None:
+                valores[key] = valor
+        return valores
+    
+    def incr(self, namespace, key, amount=1, ttl=None):
+        """Incrementa um contador (lido com get_counter)"""
+        raise NotImplementedError
+    
+    def get_counter(self, namespace, key):
+        raise NotImplementedError
+
+class MemoryStateBackend(StateBackend):
+    """Estado no próprio processo (uma réplica só)"""
+    
     def __init__(self):
-        self.cache_file = 'links_cache.pkl'
-        self.links_cache = self._load_cache()
+        self.dados = {}
+    
+    def _namespace(self, namespace):
+        return self.dados.setdefault(namespace, {})
+    
+    def _vivo(self, namespace, key):
+        itens = self._namespace(namespace)
+        item = itens.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] < time.time():
+            del itens[key]
+            return None
+        return item
+    
+    def get(self, namespace, key, default=None):
+        item = self._vivo(namespace, key)
+        return item[0] if item else default
+    
+    def set(self, namespace, key, value, ttl=None):
+        self._namespace(namespace)[key] = (value, time.time() + ttl if ttl else None)
+    
+    def delete(self, namespace, key):
+        self._namespace(namespace).pop(key, None)
+    
+    def keys(self, namespace):
+        return [key for key in list(self._namespace(namespace)) if self._vivo(namespace, key)]
+    
+    def incr(self, namespace, key, amount=1, ttl=None):
+        item = self._vivo(namespace, key)
+        if item:
+            valor, expira = item[0] + amount, item[1]
+        else:
+            valor, expira = amount, time.time() + ttl if ttl else None
+        self._namespace(namespace)[key] = (valor, expira)
+        return valor
+    
+    def get_counter(self, namespace, key):
+        return self.get(namespace, key, 0)
+
+class RedisStateBackend(StateBackend):
+    """Estado compartilhado entre réplicas via protocolo Redis (RESP), sem dependências extras.
+    
+    Os valores vão como JSON (nunca pickle: o que vem da rede não executa código ao ser lido);
+    datetime, set e os contêineres de processos são marcados com '__tipo__'. Tuplas voltam como listas.
+    """
+    
+    shared = True
+    LOTE_MGET = 1000
+    
+    def __init__(self, host='localhost', port=6379, db=0, password=None, prefixo='tjspbot', timeout=5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefixo = prefixo
+        self.timeout = timeout
+        self._sock = None
+        self._arquivo = None
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """Cria a partir de redis://[:senha@]host:porta/db"""
+        partes = urllib.parse.urlparse(url)
+        db = int(partes.path.lstrip('/') or 0)
+        return cls(partes.hostname or 'localhost', partes.port or 6379, db, partes.password, **kwargs)
+    
+    def _conectar(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._arquivo = self._sock.makefile('rb')
+        if self.password:
+            self._executar(('AUTH', self.password))
+        if self.db:
+            self._executar(('SELECT', self.db))
+    
+    def _fechar(self):
+        try:
+            if self._sock:
+                self._sock.close()
+        except OSError:
+            pass
+        self._sock = None
+        self._arquivo = None
+    
+    @staticmethod
+    def _codificar(args):
+        partes = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            partes.append(f"${len(arg)}\r\n".encode() + arg + b"\r\n")
+        return b''.join(partes)
+    
+    def _ler_resposta(self):
+        linha = self._arquivo.readline()
+        if not linha:
+            raise ConnectionError("Conexão com o Redis encerrada")
+        tipo, conteudo = linha[:1], linha[1:-2]
+        if tipo == b'+':
+            return conteudo.decode()
+        if tipo == b'-':
+            raise RuntimeError(f"Redis: {conteudo.decode()}")
+        if tipo == b':':
+            return int(conteudo)
+        if tipo == b'$':
+            tamanho = int(conteudo)
+            if tamanho < 0:
+                return None
+            dados = self._arquivo.read(tamanho + 2)
+            return dados[:-2]
+        if tipo == b'*':
+            tamanho = int(conteudo)
+            if tamanho < 0:
+                return None
+            return [self._ler_resposta() for _ in range(tamanho)]
+        raise ConnectionError(f"Resposta Redis inválida: {linha!r}")
+    
+    def _executar(self, *comandos):
+        self._sock.sendall(b''.join(self._codificar(args) for args in comandos))
+        return [self._ler_resposta() for _ in comandos]
+    
+    def _comando(self, *comandos):
+        """Envia um ou mais comandos (pipeline) reconectando uma vez em caso de queda"""
+        with self._lock:
+            for tentativa in range(2):
+                try:
+                    if self._sock is None:
+                        self._conectar()
+                    return self._executar(*comandos)
+                except (OSError, ConnectionError):
+                    self._fechar()
+                    if tentativa:
+                        raise
+    
+    def _chave(self, namespace, key):
+        return f"{self.prefixo}:{namespace}:{key}"
+    
+    @staticmethod
+    def _json_padrao(valor):
+        """Tipos que o json não conhece, marcados para _json_objeto reconstruir"""
+        if isinstance(valor, datetime):
+            return {'__tipo__': 'datetime', 'valor': valor.isoformat()}
+        if isinstance(valor, (set, frozenset)):
+            return {'__tipo__': 'set', 'valor': list(valor)}
+        if isinstance(valor, ProcessoArquivo):
+            return {'__tipo__': 'ProcessoArquivo', **valor.__getstate__()}
+        if isinstance(valor, ProcessoStore):
+            return {
+                '__tipo__': 'ProcessoStore',
+                'linhas': [[processo[campo] for campo in ProcessoStore.CAMPOS] for processo in valor],
+                'incompleto': valor.incompleto,
+                'pagina_falha': valor.pagina_falha
+            }
+        if isinstance(valor, ProcessoRegistro):
+            return dict(valor)
+        if isinstance(valor, ProcessoSelecao):
+            return [dict(processo) for processo in valor]
+        raise TypeError(f"Tipo não serializável no backend de estado: {type(valor).__name__}")
+    
+    @staticmethod
+    def _json_objeto(dados):
+        tipo = dados.get('__tipo__')
+        if tipo is None:
+            return dados
+        if tipo == 'datetime':
+            return datetime.fromisoformat(dados['valor'])
+        if tipo == 'set':
+            return set(dados['valor'])
+        if tipo == 'ProcessoArquivo':
+            arquivo = ProcessoArquivo.__new__(ProcessoArquivo)
+            arquivo.__setstate__(dados)
+            return arquivo
+        if tipo == 'ProcessoStore':
+            store = ProcessoStore(dict(zip(ProcessoStore.CAMPOS, linha)) for linha in dados['linhas'])
+            store.incompleto = dados['incompleto']
+            store.pagina_falha = dados['pagina_falha']
+            return store
+        return dados
+    
+    @classmethod
+    def _serializar(cls, valor):
+        return json.dumps(valor, default=cls._json_padrao, ensure_ascii=False, separators=(',', ':')).encode()
+    
+    @classmethod
+    def _desserializar(cls, dados, default=None):
+        """Valor gravado por _serializar; o que não for JSON válido (ex.: pickle antigo) conta como ausente"""
+        try:
+            return json.loads(dados, object_hook=cls._json_objeto)
+        except (ValueError, UnicodeDecodeError):
+            return default
+    
+    @classmethod
+    def _set_args(cls, chave, value, ttl):
+        args = ['SET', chave, cls._serializar(value)]
+        if ttl:
+            args += ['EX', max(1, int(ttl))]
+        return args
+    
+    def ping(self):
+        return self._comando(('PING',))[0] == 'PONG'
+    
+    def get(self, namespace, key, default=None):
+        valor = self._comando(('GET', self._chave(namespace, key)))[0]
+        return self._desserializar(valor, default) if valor is not None else default
+    
+    def set(self, namespace, key, value, ttl=None):
+        self._comando(self._set_args(self._chave(namespace, key), value, ttl))
+    
+    def set_many(self, namespace, items, ttl=None):
+        if items:
+            self._comando(*[self._set_args(self._chave(namespace, k), v, ttl) for k, v in items.items()])
+    
+    def delete(self, namespace, key):
+        self._comando(('DEL', self._chave(namespace, key)))
+    
+    def keys(self, namespace):
+        inicio = self._chave(namespace, '')
+        chaves = []
+        cursor = b'0'
+        while True:
+            cursor, lote = self._comando(('SCAN', cursor, 'MATCH', f"{inicio}*", 'COUNT', 500))[0]
+            chaves.extend(chave.decode()[len(inicio):] for chave in lote)
+            if cursor in (b'0', '0'):
+                return chaves
+    
+    def get_all(self, namespace):
+        return self.get_many(namespace, self.keys(namespace))
+    
+    def get_many(self, namespace, keys):
+        """Um MGET por bloco de chaves em vez de um GET por chave"""
+        keys = list(keys)
+        valores = {}
+        for inicio in range(0, len(keys), self.LOTE_MGET):
+            lote = keys[inicio:inicio + self.LOTE_MGET]
+            resposta = self._comando(('MGET', *[self._chave(namespace, k) for k in lote]))[0]
+            for k, v in zip(lote, resposta):
+                valor = self._desserializar(v) if v is not None else None
+                if valor is not None:
+                    valores[k] = valor
+        return valores
+    
+    def incr(self, namespace, key, amount=1, ttl=None):
+        chave = self._chave(namespace, key)
+        valor = self._comando(('INCRBY', chave, amount))[0]
+        if ttl and valor == amount:
+            self._comando(('EXPIRE', chave, max(1, int(ttl))))
+        return valor
+    
+    def get_counter(self, namespace, key):
+        valor = self._comando(('GET', self._chave(namespace, key)))[0]
+        return int(valor) if valor is not None else 0
+
+def criar_state_backend():
+    """Redis se REDIS_URL estiver configurado (e acessível); senão memória local"""
+    url = os.environ.get('REDIS_URL')
+    if url:
+        try:
+            backend = RedisStateBackend.from_url(url)
+            backend.ping()
+            print(f"✅ Estado compartilhado via Redis: {backend.host}:{backend.port}/{backend.db}")
+            return backend
+        except Exception as e:
+            print(f"❌ Redis indisponível ({e}) - usando estado em memória")
+    return MemoryStateBackend()
+
+class CacheManager:
+    NAMESPACE = 'links'
+    # número do processo -> id, para find_by_numero não varrer o cache
+    NAMESPACE_NUMEROS = 'links_numero'
+    
+    def __init__(self, backend=None):
+        self.cache_file = 'links_cache.jsonl'
+        self.backend = backend if backend is not None else state_backend
+        if not self.backend.shared and not self.backend.get('carregado', self.NAMESPACE):
+            links = self._load_cache()
+            self.backend.set_many(self.NAMESPACE, links)
+            self.backend.set_many(self.NAMESPACE_NUMEROS, {info['numero']: processo_id for processo_id, info in links.items()})
+            self.backend.set('carregado', self.NAMESPACE, True)
     
     def _load_cache(self):
-        """Carrega o cache do arquivo"""
+        """Carrega o cache do arquivo (uma linha JSON por link salvo; a última de cada id vale)"""
+        links = {}
+        linhas = 0
         try:
             if os.path.exists(self.cache_file):
-                with open(self.cache_file, 'rb') as f:
-                    return pickle.load(f)
+                with open(self.cache_file, encoding='utf-8') as f:
+                    # Um json.loads para o arquivo todo em vez de um por linha
+                    registros = json.loads('[' + ','.join(f.read().splitlines()) + ']')
+                linhas = len(registros)
+                for processo_id, numero, link, timestamp in registros:
+                    links[processo_id] = {'numero': numero, 'link': link, 'timestamp': timestamp}
+                for info in links.values():
+                    info['timestamp'] = datetime.fromisoformat(info['timestamp'])
         except Exception as e:
             print(f"❌ Erro ao carregar cache: {e}")
-        return {}
+        if linhas > 2 * len(links):
+            # Arquivo só recebe acréscimos: compacta quando metade das linhas já foi sobrescrita
+            self._save_cache([(processo_id, info['numero'], info['link'], info['timestamp'])
+                              for processo_id, info in links.items()], modo='w')
+        return links
     
-    def _save_cache(self):
-        """Salva o cache no arquivo"""
+    def _save_cache(self, linhas, modo='a'):
+        """Acrescenta só os links salvos agora ao arquivo (o backend compartilhado já é persistente)"""
+        if self.backend.shared:
+            return
+        codificar = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
         try:
-            with open(self.cache_file, 'wb') as f:
-                pickle.dump(self.links_cache, f)
+            with open(self.cache_file, modo, encoding='utf-8') as f:
+                f.write(''.join(
+                    codificar([processo_id, numero, link, timestamp.isoformat()]) + '\n'
+                    for processo_id, numero, link, timestamp in linhas
+                ))
         except Exception as e:
             print(f"❌ Erro ao salvar cache: {e}")
     
-    def get_link(self, processo_id):
+    def get_link(self, processo_id, contar=True):
         """Obtém link pelo ID"""
-        return self.links_cache.get(processo_id, {}).get('link')
+        link = self.backend.get(self.NAMESPACE, processo_id, {}).get('link')
+        if contar:
+            metrics.incrementar('tjsp_cache_consultas_total', cache='links', resultado='hit' if link else 'miss')
+        return link
+    
+    def get_links(self, processo_ids):
+        """{processo_id: link} dos processos com link em cache, em uma leitura em lote"""
+        return {
+            processo_id: info['link']
+            for processo_id, info in self.backend.get_many(self.NAMESPACE, processo_ids).items()
+            if info.get('link')
+        }
     
     def get_numero(self, processo_id):
         """Obtém número pelo ID"""
-        return self.links_cache.get(processo_id, {}).get('numero')
+        return self.backend.get(self.NAMESPACE, processo_id, {}).get('numero')
     
     def save_link(self, processo_id, numero, link):
         """Salva link no cache"""
-        self.links_cache[processo_id] = {
-            'numero': numero,
-            'link': link,
-            'timestamp': datetime.now()
-        }
-        self._save_cache()
+        self.save_links([(processo_id, numero, link)])
+    
+    def save_links(self, itens):
+        """Salva vários links (processo_id, numero, link) com uma única escrita"""
+        agora = datetime.now()
+        self.backend.set_many(self.NAMESPACE, {
+            processo_id: {
+                'numero': numero,
+                'link': link,
+                'timestamp': agora
+            }
+            for processo_id, numero, link in itens
+        })
+        self.backend.set_many(self.NAMESPACE_NUMEROS, {numero: processo_id for processo_id, numero, _ in itens})
+        self._save_cache((processo_id, numero, link, agora) for processo_id, numero, link in itens)
     
     def find_by_numero(self, numero_processo):
         """Encontra ID pelo número do processo"""
-        for processo_id, info in self.links_cache.items():
-            if info.get('numero') == numero_processo:
-                return processo_id
-        return None
+        return self.backend.get(self.NAMESPACE_NUMEROS, numero_processo)
+
+class ResultCache:
+    """Cache de resultados de consultas por OAB e de detalhes de processos"""
+    
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else state_backend
+        self.ttl_resultados = int(os.environ.get('RESULT_CACHE_TTL', '1800'))
+        self.ttl_detalhes = int(os.environ.get('DETAIL_CACHE_TTL', '3600'))
+    
+    def get_resultado(self, oab):
+        """Processos de uma consulta recente da OAB (ou None)"""
+        if self.ttl_resultados <= 0:
+            return None
+        resultado = self.backend.get('resultados', oab)
+        if resultado and getattr(resultado['processos'], 'ausente', False):
+            # Sem o arquivo em disco o resultado não serve: consulta de novo
+            self.backend.delete('resultados', oab)
+            resultado = None
+        metrics.incrementar('tjsp_cache_consultas_total', cache='resultados', resultado='hit' if resultado else 'miss')
+        return resultado
+    
+    def save_resultado(self, oab, processos):
+        if self.ttl_resultados > 0:
+            self.backend.set('resultados', oab, {
+                'processos': processos,
+                'data_consulta': datetime.now()
+            }, ttl=self.ttl_resultados)
+    
+    def get_detalhes(self, processo_id, contar=True):
+        if self.ttl_detalhes <= 0:
+            return None
+        detalhes = self.backend.get('detalhes', processo_id)
+        if contar:
+            metrics.incrementar('tjsp_cache_consultas_total', cache='detalhes', resultado='hit' if detalhes else 'miss')
+        return detalhes
+    
+    def get_detalhes_varios(self, processo_ids):
+        """{processo_id: detalhes} dos que estão em cache, em uma leitura em lote (sem contar acertos)"""
+        if self.ttl_detalhes <= 0:
+            return {}
+        return self.backend.get_many('detalhes', processo_ids)
+    
+    def save_detalhes(self, processo_id, detalhes):
+        if self.ttl_detalhes > 0:
+            self.backend.set('detalhes', processo_id, detalhes, ttl=self.ttl_detalhes)
+
+class ScrapeCheckpoints:
+    """Progresso página a página das consultas por OAB, para retomar de onde parou"""
+    
+    NAMESPACE = 'checkpoints'
+    # Processos novos de cada página, em partes 'oab:n': cada página grava só o que acrescentou
+    NAMESPACE_PARTES = 'checkpoints_partes'
+    
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else state_backend
+        self.ttl = int(os.environ.get('CHECKPOINT_TTL', '21600'))
+    
+    def carregar(self, oab):
+        """Checkpoint da OAB: última página concluída, total de páginas e processos coletados"""
+        checkpoint = self.backend.get(self.NAMESPACE, oab)
+        if not checkpoint:
+            return None
+        if checkpoint['arquivo'] is not None:
+            processos = checkpoint['arquivo']
+        else:
+            chaves = [f"{oab}:{parte}" for parte in range(checkpoint['partes'])]
+            partes = self.backend.get_many(self.NAMESPACE_PARTES, chaves)
+            # Parte expirada: sem ela os processos ficariam faltando
+            processos = ProcessoStore(processo for chave in chaves for processo in partes[chave]) \
+                if len(partes) == len(chaves) else None
+        if processos is None or getattr(processos, 'ausente', False):
+            self.limpar(oab)
+            return None
+        return dict(checkpoint, processos=processos)
+    
+    def salvar(self, oab, pagina, total_paginas, processos, novos=()):
+        """Registra a página concluída; novos são os processos que ela acrescentou a processos"""
+        anterior = self.backend.get(self.NAMESPACE, oab)
+        partes = anterior['partes'] if anterior else 0
+        arquivo = processos if isinstance(processos, ProcessoArquivo) else None
+        if arquivo is not None or not anterior or anterior['total'] + len(novos) != len(processos):
+            # Resultado em disco (basta o caminho) ou checkpoint de outra coleta: recomeça as partes
+            self._apagar_partes(oab, partes)
+            partes = 0
+            novos = processos if arquivo is None else ()
+        if novos:
+            self.backend.set(self.NAMESPACE_PARTES, f"{oab}:{partes}", [dict(processo) for processo in novos], ttl=self.ttl)
+            partes += 1
+        self.backend.set(self.NAMESPACE, oab, {
+            'oab': oab,
+            'pagina': pagina,
+            'total_paginas': total_paginas,
+            'total': len(processos),
+            'partes': partes,
+            'arquivo': arquivo,
+            'atualizado_em': datetime.now()
+        }, ttl=self.ttl)
+    
+    def _apagar_partes(self, oab, partes):
+        for parte in range(partes):
+            self.backend.delete(self.NAMESPACE_PARTES, f"{oab}:{parte}")
+    
+    def limpar(self, oab):
+        checkpoint = self.backend.get(self.NAMESPACE, oab)
+        if checkpoint:
+            self._apagar_partes(oab, checkpoint['partes'])
+        self.backend.delete(self.NAMESPACE, oab)
+
+class DetailFingerprints:
+    """Hash do HTML normalizado das páginas de detalhes; os detalhes parseados ficam guardados sob o hash"""
+    
+    NAMESPACE_PAGINAS = 'detalhes_paginas'
+    NAMESPACE_HASHES = 'detalhes_hash'
+    # Trechos que mudam a cada visita sem o processo mudar (scripts, tokens, sessão)
+    RUIDO = re.compile(
+        r'<script\b.*?</script>|<style\b.*?</style>|<!--.*?-->|<input\b[^>]*type="hidden"[^>]*>|;jsessionid=[\w.-]+',
+        re.S | re.I
+    )
+    ESPACOS = re.compile(r'\s+')
+    
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else state_backend
+        self.ttl = int(os.environ.get('DETALHES_HASH_TTL', str(30 * 86400)))
+    
+    def impressao(self, html_content):
+        """md5 do HTML sem scripts, estilos, comentários, campos ocultos e espaços repetidos"""
+        normalizado = self.ESPACOS.sub(' ', self.RUIDO.sub('', html_content)).strip()
+        return hashlib.md5(normalizado.encode('utf-8', 'replace')).hexdigest()
+    
+    def inalterada(self, link, impressao):
+        """Detalhes já parseados se a página tem o mesmo hash da última visita (senão None)"""
+        pagina = self.backend.get(self.NAMESPACE_PAGINAS, link)
+        if not pagina or pagina['hash'] != impressao:
+            return None
+        detalhes = self.backend.get(self.NAMESPACE_HASHES, impressao)
+        if detalhes is None:
+            return None
+        pagina['verificado_em'] = datetime.now()
+        self.backend.set(self.NAMESPACE_PAGINAS, link, pagina, ttl=self.ttl)
+        return dict(detalhes, sem_alteracoes_desde=pagina['desde'])
+    
+    def registrar(self, link, impressao, detalhes):
+        """Guarda os detalhes sob o hash; 'desde' só muda quando o conteúdo da página muda"""
+        agora = datetime.now()
+        pagina = self.backend.get(self.NAMESPACE_PAGINAS, link)
+        alterada = pagina is not None and pagina['hash'] != impressao
+        if pagina is None or alterada:
+            pagina = {'hash': impressao, 'desde': agora}
+        pagina['verificado_em'] = agora
+        self.backend.set(self.NAMESPACE_HASHES, impressao, detalhes, ttl=self.ttl)
+        self.backend.set(self.NAMESPACE_PAGINAS, link, pagina, ttl=self.ttl)
+        return alterada
+    
+    def exportar(self, link):
+        """Registro da página (hash e detalhes) para levar a outro processo"""
+        pagina = self.backend.get(self.NAMESPACE_PAGINAS, link)
+        if not pagina:
+            return None
+        return {'pagina': pagina, 'detalhes': self.backend.get(self.NAMESPACE_HASHES, pagina['hash'])}
+    
+    def importar(self, link, registro):
+        """Grava um registro vindo de exportar()"""
+        if not registro:
+            return
+        if registro['detalhes'] is not None:
+            self.backend.set(self.NAMESPACE_HASHES, registro['pagina']['hash'], registro['detalhes'], ttl=self.ttl)
+        self.backend.set(self.NAMESPACE_PAGINAS, link, registro['pagina'], ttl=self.ttl)
 
 class LicenseManager:
-    def __init__(self):
+    CAMPOS_COTA = ('cota_hora', 'cota_dia')
+    
+    def __init__(self, backend=None):
         self.gist_id = os.environ.get('GIST_ID')
         self.github_token = os.environ.get('GITHUB_TOKEN')
         self.admins = ["coder7br", "admin", "teste"]
         self.license_duration = 7
-        self.licenses = {}
+        self.backend = backend if backend is not None else state_backend
+        self.cache_arquivo = os.environ.get('LICENCAS_CACHE', 'licencas_cache.json')
+        self.loaded = False
+        self.origem = None
+        self.carregando = False
+        # Conteúdo gravado por último em LICENCAS_CACHE (o Gist é relido a cada comando)
+        self.conteudo_disco = None
+        # Consultas ao TJSP por licença (0 = sem limite); a licença pode ter cota própria
+        self.cota_hora = int(os.environ.get('COTA_HORA', '30'))
+        self.cota_dia = int(os.environ.get('COTA_DIA', '200'))
         
         # Verificar configuração
         if not self.gist_id or not self.github_token:
             print("⚠️  GIST_ID ou GITHUB_TOKEN não configurados")
             print("⚠️  Sistema de licenças funcionará em modo temporário")
+            self.loaded = True
+            self.origem = 'temporario'
         else:
+            # O Gist é lido em segundo plano (carregar_em_segundo_plano); até lá valem as licenças do disco
             print(f"✅ GitHub Gist configurado: {self.gist_id}")
-            self.licenses = self._load_from_gist()
+            self._carregar_cache_disco()
+    
+    @property
+    def licenses(self):
+        """Licenças em cache no backend de estado (o Gist continua sendo a fonte oficial)"""
+        return self.backend.get('licencas', 'todas', {})
+    
+    @licenses.setter
+    def licenses(self, licenses):
+        self.backend.set('licencas', 'todas', licenses)
+        if self._is_configured():
+            self._salvar_cache_disco(licenses)
+    
+    @classmethod
+    def _cotas_definidas(cls, license_info):
+        return {campo: license_info[campo] for campo in cls.CAMPOS_COTA if license_info.get(campo) is not None}
+    
+    @classmethod
+    def _serializar(cls, licenses):
+        """Licenças com datas em ISO (formato do licenses.json do Gist)"""
+        return {
+            username: {
+                'expiry_date': license_info['expiry_date'].isoformat(),
+                'created_at': license_info['created_at'].isoformat(),
+                'duration_days': license_info['duration_days'],
+                **cls._cotas_definidas(license_info)
+            }
+            for username, license_info in licenses.items()
+        }
+    
+    @classmethod
+    def _desserializar(cls, licenses_data):
+        """Converte as strings de data do licenses.json em datetime"""
+        return {
+            username: {
+                'expiry_date': datetime.fromisoformat(license_info['expiry_date']),
+                'created_at': datetime.fromisoformat(license_info['created_at']),
+                'duration_days': license_info['duration_days'],
+                **cls._cotas_definidas(license_info)
+            }
+            for username, license_info in licenses_data.items()
+        }
+    
+    def _carregar_cache_disco(self):
+        """Licenças da última leitura do Gist, para atender enquanto o Gist não responde"""
+        if self.backend.get('licencas', 'todas') is not None:
+            # Backend compartilhado (Redis) já tem as licenças de outra réplica
+            self.loaded = True
+            self.origem = 'backend'
+            return
+        try:
+            with open(self.cache_arquivo, encoding='utf-8') as f:
+                licenses = self._desserializar(json.load(f))
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"⚠️ Cache de licenças em disco ignorado: {e}")
+            return
+        self.backend.set('licencas', 'todas', licenses)
+        self.conteudo_disco = self._conteudo_cache(licenses)
+        self.loaded = True
+        self.origem = 'disco'
+        print(f"💾 {len(licenses)} licenças do cache em disco")
+    
+    def _conteudo_cache(self, licenses):
+        return json.dumps(self._serializar(licenses), ensure_ascii=False, sort_keys=True)
+    
+    def _salvar_cache_disco(self, licenses):
+        """Grava LICENCAS_CACHE só quando as licenças mudaram"""
+        conteudo = self._conteudo_cache(licenses)
+        if conteudo == self.conteudo_disco:
+            return
+        try:
+            temporario = f"{self.cache_arquivo}.tmp"
+            with open(temporario, 'w', encoding='utf-8') as f:
+                f.write(conteudo)
+            os.replace(temporario, self.cache_arquivo)
+            self.conteudo_disco = conteudo
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar cache de licenças: {e}")
+    
+    async def carregar_em_segundo_plano(self):
+        """Primeira leitura do Gist fora do event loop, sem segurar o início do bot"""
+        if not self._is_configured():
+            return
+        self.carregando = True
+        try:
+            with inicializacao.fase('licencas_gist'):
+                carregou = await asyncio.to_thread(self._reload_licenses)
+            if not carregou:
+                print(f"⚠️ Gist indisponível - licenças do cache ({self.origem or 'vazio'})")
+        finally:
+            self.carregando = False
+    
+    def _atualizar(self):
+        """Recarrega do Gist antes de uma leitura (exceto durante a carga inicial em segundo plano)"""
+        if self._is_configured() and not self.carregando:
+            self._reload_licenses()
+    
+    def _reload_licenses(self):
+        """Recarrega do Gist mantendo o cache atual se o Gist falhar"""
+        licenses = self._load_from_gist()
+        if licenses is not None:
+            self.licenses = licenses
+            self.loaded = True
+            self.origem = 'gist'
+        return licenses is not None
     
     def _load_from_gist(self):
         """Carrega licenças do GitHub Gist"""
+        import requests
+        
         if not self._is_configured():
             return {}
         
@@ -110,7 +1181,7 @@ class LicenseManager:
                 'Accept': 'application/vnd.github.v3+json'
             }
             
-            response = requests.get(url, headers=headers, timeout=10)
+            response = self._requisicao_gist('carregar', requests.get, url, headers=headers, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -118,20 +1189,13 @@ class LicenseManager:
                     content = data['files']['licenses.json']['content']
                     
                     # Converter strings de data para objetos datetime
-                    licenses_data = json.loads(content)
-                    converted_licenses = {}
-                    
-                    for username, license_info in licenses_data.items():
-                        converted_licenses[username] = {
-                            'expiry_date': datetime.fromisoformat(license_info['expiry_date']),
-                            'created_at': datetime.fromisoformat(license_info['created_at']),
-                            'duration_days': license_info['duration_days']
-                        }
+                    converted_licenses = self._desserializar(json.loads(content))
                     
                     print(f"✅ {len(converted_licenses)} licenças carregadas do Gist")
                     return converted_licenses
                 else:
                     print("⚠️  Arquivo licenses.json não encontrado no Gist")
+                    return {}
             else:
                 print(f"❌ Erro ao carregar Gist: {response.status_code} - {response.text}")
                 
@@ -144,23 +1208,19 @@ class LicenseManager:
         except Exception as e:
             print(f"❌ Erro inesperado ao carregar Gist: {e}")
         
-        return {}
+        return None
     
     def _save_to_gist(self):
         """Salva licenças no GitHub Gist"""
+        import requests
+        
         if not self._is_configured():
             print("⚠️  Gist não configurado - licenças não serão salvas")
             return False
         
         try:
             # Converter datetime para string ISO
-            save_data = {}
-            for username, license_info in self.licenses.items():
-                save_data[username] = {
-                    'expiry_date': license_info['expiry_date'].isoformat(),
-                    'created_at': license_info['created_at'].isoformat(),
-                    'duration_days': license_info['duration_days']
-                }
+            save_data = self._serializar(self.licenses)
             
             url = f'https://api.github.com/gists/{self.gist_id}'
             headers = {
@@ -178,7 +1238,7 @@ class LicenseManager:
                 }
             }
             
-            response = requests.patch(url, headers=headers, json=data, timeout=10)
+            response = self._requisicao_gist('salvar', requests.patch, url, headers=headers, json=data, timeout=10)
             
             if response.status_code == 200:
                 print("💾 Licenças salvas no Gist com sucesso")
@@ -197,6 +1257,18 @@ class LicenseManager:
             print(f"❌ Erro inesperado ao salvar Gist: {e}")
             return False
     
+    def _requisicao_gist(self, operacao, metodo, *args, **kwargs):
+        """Chamada HTTP ao Gist com latência e erros registrados em /metrics"""
+        try:
+            with tracer.span(f"gist.{operacao}"), metrics.cronometrar('tjsp_gist_duracao_segundos', operacao=operacao):
+                response = metodo(*args, **kwargs)
+        except Exception:
+            metrics.incrementar('tjsp_gist_erros_total', operacao=operacao)
+            raise
+        if response.status_code != 200:
+            metrics.incrementar('tjsp_gist_erros_total', operacao=operacao)
+        return response
+    
     def _is_configured(self):
         """Verifica se Gist está configurado"""
         return bool(self.gist_id and self.github_token)
@@ -213,11 +1285,15 @@ class LicenseManager:
         expiry_date = datetime.now() + timedelta(days=duration_days)
         username_lower = username.lower()
         
-        self.licenses[username_lower] = {
+        licenses = self.licenses
+        licenses[username_lower] = {
             'expiry_date': expiry_date,
             'created_at': datetime.now(),
-            'duration_days': duration_days
+            'duration_days': duration_days,
+            # Renovar a licença mantém a cota definida para o usuário
+            **self._cotas_definidas(licenses.get(username_lower, {}))
         }
+        self.licenses = licenses
         
         # Tentar salvar no Gist
         if self._is_configured():
@@ -229,6 +1305,7 @@ class LicenseManager:
         
         return expiry_date
     
+    @rastrear('licenca.verificar')
     def check_license(self, username: str):
         """Verifica se um username tem licença válida"""
         if not username:
@@ -240,13 +1317,12 @@ class LicenseManager:
             return True, "✅ **Acesso Admin - Ilimitado**"
         
         # Recarregar do Gist para garantir dados atualizados
-        if self._is_configured():
-            self.licenses = self._load_from_gist()
+        self._atualizar()
         
-        if username_lower not in self.licenses:
+        license_info = self.licenses.get(username_lower)
+        if not license_info:
             return False, f"❌ Licença não encontrada para @{username}"
         
-        license_info = self.licenses[username_lower]
         expiry_date = license_info['expiry_date']
         
         if datetime.now() > expiry_date:
@@ -261,8 +1337,10 @@ class LicenseManager:
         """Revoga uma licença"""
         username_lower = username.lower()
         
-        if username_lower in self.licenses:
-            del self.licenses[username_lower]
+        licenses = self.licenses
+        if username_lower in licenses:
+            del licenses[username_lower]
+            self.licenses = licenses
             
             # Salvar alterações no Gist
             if self._is_configured():
@@ -293,11 +1371,10 @@ class LicenseManager:
             }
         
         # Recarregar do Gist para dados atualizados
-        if self._is_configured():
-            self.licenses = self._load_from_gist()
+        self._atualizar()
         
-        if username_lower in self.licenses:
-            license_info = self.licenses[username_lower]
+        license_info = self.licenses.get(username_lower)
+        if license_info:
             expiry_date = license_info['expiry_date']
             days_left = (expiry_date - datetime.now()).days
             
@@ -311,11 +1388,81 @@ class LicenseManager:
             }
         return None
     
+    def cotas(self, username: str):
+        """(consultas por hora, por dia) da licença; usa os padrões onde ela não define"""
+        license_info = self.licenses.get(username.lower(), {})
+        por_hora, por_dia = (license_info.get(campo) for campo in self.CAMPOS_COTA)
+        return (self.cota_hora if por_hora is None else por_hora,
+                self.cota_dia if por_dia is None else por_dia)
+    
+    def definir_cota(self, username: str, por_hora: int, por_dia: int):
+        """Grava a cota junto com a licença (e no Gist)"""
+        licenses = self.licenses
+        license_info = licenses.get(username.lower())
+        if not license_info:
+            return False
+        license_info['cota_hora'] = por_hora
+        license_info['cota_dia'] = por_dia
+        self.licenses = licenses
+        if self._is_configured():
+            return self._save_to_gist()
+        return True
+    
+    def _contadores_cota(self, username: str, agora=None):
+        """Chaves dos contadores da hora e do dia correntes (janelas fixas, expiram sozinhas)"""
+        agora = agora or datetime.now()
+        usuario = username.lower()
+        return f"{usuario}:h:{agora.strftime('%Y%m%d%H')}", f"{usuario}:d:{agora.strftime('%Y%m%d')}"
+    
+    def uso(self, username: str):
+        """(consultas nesta hora, neste dia)"""
+        hora, dia = self._contadores_cota(username)
+        return self.backend.get_counter('uso_consultas', hora), self.backend.get_counter('uso_consultas', dia)
+    
+    def _recusa_cota(self, periodo, cota):
+        """Mensagem de cota esgotada com o início da próxima janela"""
+        metrics.incrementar('tjsp_cota_recusas_total', periodo=periodo)
+        agora = datetime.now()
+        if periodo == 'hora':
+            libera = agora.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            return (f"🎫 **Cota por hora esgotada** ({cota} consultas ao TJSP)\n"
+                    f"🕒 Nova consulta liberada às {libera.strftime('%H:%M')}")
+        libera = agora.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        return (f"🎫 **Cota diária esgotada** ({cota} consultas ao TJSP)\n"
+                f"🕒 Nova consulta liberada em {libera.strftime('%d/%m %H:%M')}")
+    
+    def verificar_cota(self, username: str):
+        """(True, None) se o usuário ainda tem cota; senão (False, mensagem com quando libera). Só consulta"""
+        if self.is_admin(username):
+            return True, None
+        por_hora, por_dia = self.cotas(username)
+        na_hora, no_dia = self.uso(username)
+        if por_hora and na_hora >= por_hora:
+            return False, self._recusa_cota('hora', por_hora)
+        if por_dia and no_dia >= por_dia:
+            return False, self._recusa_cota('dia', por_dia)
+        return True, None
+    
+    def reservar_consulta(self, username: str):
+        """Gasta uma consulta da cota de forma atômica (INCR); devolve (True, None) ou (False, mensagem)"""
+        if self.is_admin(username):
+            return True, None
+        por_hora, por_dia = self.cotas(username)
+        hora, dia = self._contadores_cota(username)
+        # Incrementa antes de comparar: réplicas concorrentes nunca passam juntas do limite
+        if self.backend.incr('uso_consultas', hora, ttl=3600) > por_hora > 0:
+            self.backend.incr('uso_consultas', hora, -1)
+            return False, self._recusa_cota('hora', por_hora)
+        if self.backend.incr('uso_consultas', dia, ttl=86400) > por_dia > 0:
+            self.backend.incr('uso_consultas', dia, -1)
+            self.backend.incr('uso_consultas', hora, -1)
+            return False, self._recusa_cota('dia', por_dia)
+        return True, None
+    
     def list_licenses(self):
         """Lista todas as licenças ativas"""
         # Recarregar do Gist para dados atualizados
-        if self._is_configured():
-            self.licenses = self._load_from_gist()
+        self._atualizar()
         
         active_licenses = {}
         now = datetime.now()
@@ -336,8 +1483,7 @@ class LicenseManager:
             return False
         
         print("🔄 Sincronizando licenças com Gist...")
-        self.licenses = self._load_from_gist()
-        return True
+        return self._reload_licenses()
     
     def get_stats(self):
         """Retorna estatísticas do sistema de licenças"""
@@ -359,184 +1505,2198 @@ class LicenseManager:
             'admins_count': len(self.admins)
         }
 
-class SessionManager:
-    def __init__(self):
-        self.user_sessions = {}
-        self.session_timeout = 3600
+class ProcessoRegistro:
+    """Visão somente leitura de uma linha do ProcessoStore, compatível com dict"""
     
-    def create_session(self, username, chat_id, oab):
-        """Cria uma sessão privada para o usuário"""
-        session_id = f"{username}_{chat_id}"
-        self.user_sessions[session_id] = {
-            'oab': oab,
-            'processos': [],
-            'service': TJSPScrapingService(),
-            'created_at': datetime.now(),
-            'user_info': {
-                'username': username,
-                'chat_id': chat_id
+    __slots__ = ('_store', '_linha')
+    
+    def __init__(self, store, linha):
+        self._store = store
+        self._linha = linha
+    
+    def __getitem__(self, campo):
+        return self._store.valor(self._linha, campo)
+    
+    def get(self, campo, padrao=None):
+        try:
+            return self[campo]
+        except KeyError:
+            return padrao
+    
+    def keys(self):
+        return ProcessoStore.CAMPOS
+    
+    def items(self):
+        return [(campo, self[campo]) for campo in ProcessoStore.CAMPOS]
+    
+    def __iter__(self):
+        return iter(ProcessoStore.CAMPOS)
+    
+    def __len__(self):
+        return len(ProcessoStore.CAMPOS)
+    
+    def __contains__(self, campo):
+        return campo in ProcessoStore.CAMPOS
+    
+    def __eq__(self, other):
+        if hasattr(other, 'keys'):
+            return dict(self.items()) == dict(other)
+        return NotImplemented
+    
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+class ProcessoSelecao:
+    """Sequência preguiçosa de processos escolhidos por posição"""
+    
+    __slots__ = ('_processos', '_posicoes')
+    
+    def __init__(self, processos, posicoes):
+        self._processos = processos
+        self._posicoes = posicoes
+    
+    def __len__(self):
+        return len(self._posicoes)
+    
+    def __iter__(self):
+        if hasattr(self._processos, 'linhas'):
+            return self._processos.linhas(self._posicoes)
+        return (self._processos[posicao] for posicao in self._posicoes)
+    
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return ProcessoSelecao(self._processos, self._posicoes[item])
+        return self._processos[self._posicoes[item]]
+
+class ProcessoStore:
+    """Armazenamento colunar dos processos, com campos repetitivos codificados em dicionário"""
+    
+    CAMPOS = ('id', 'numero', 'classe', 'assunto', 'ano', 'data_movimentacao', 'advogado')
+    CATEGORICOS = ('classe', 'assunto', 'advogado')
+    
+    _compartilhados = weakref.WeakValueDictionary()
+    
+    # Consulta que parou antes da última página (os processos coletados até ali são mantidos)
+    incompleto = False
+    pagina_falha = None
+    
+    def __init__(self, processos=()):
+        self._ids = []
+        self._numeros = []
+        self._datas = []
+        self._anos = array('H')
+        self._codigos = {campo: array('I') for campo in self.CATEGORICOS}
+        self._valores = {campo: [] for campo in self.CATEGORICOS}
+        self._dicionarios = {campo: {} for campo in self.CATEGORICOS}
+        self.extend(processos)
+    
+    def _codificar(self, campo, valor):
+        """Retorna o código do valor no dicionário do campo (criando se necessário)"""
+        dicionario = self._dicionarios[campo]
+        codigo = dicionario.get(valor)
+        if codigo is None:
+            valor = sys.intern(valor)
+            codigo = len(self._valores[campo])
+            dicionario[valor] = codigo
+            self._valores[campo].append(valor)
+        return codigo
+    
+    def append(self, processo):
+        """Adiciona um processo (dict no formato de _parse_processos_pagina)"""
+        self._ids.append(processo['id'])
+        self._numeros.append(processo['numero'])
+        self._datas.append(processo['data_movimentacao'])
+        self._anos.append(processo['ano'])
+        for campo in self.CATEGORICOS:
+            self._codigos[campo].append(self._codificar(campo, processo[campo]))
+    
+    def extend(self, processos):
+        for processo in processos:
+            self.append(processo)
+    
+    def valor(self, linha, campo):
+        """Valor de um campo em uma linha"""
+        if campo in self._codigos:
+            return self._valores[campo][self._codigos[campo][linha]]
+        if campo == 'id':
+            return self._ids[linha]
+        if campo == 'numero':
+            return self._numeros[linha]
+        if campo == 'ano':
+            return self._anos[linha]
+        if campo == 'data_movimentacao':
+            return self._datas[linha]
+        raise KeyError(campo)
+    
+    def __len__(self):
+        return len(self._ids)
+    
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return ProcessoSelecao(self, range(len(self))[item])
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+        return ProcessoRegistro(self, item)
+    
+    def __iter__(self):
+        for linha in range(len(self)):
+            yield ProcessoRegistro(self, linha)
+    
+    def assinatura(self):
+        """Hash dos IDs, usado para reaproveitar stores idênticos"""
+        return hashlib.md5('\n'.join(self._ids).encode()).hexdigest()
+    
+    @classmethod
+    def compartilhado(cls, oab, processos):
+        """Reaproveita o store de outra sessão com o mesmo resultado para a OAB"""
+        if not isinstance(processos, (cls, ProcessoArquivo)):
+            processos = cls(processos)
+        
+        chave = (oab, processos.assinatura())
+        existente = cls._compartilhados.get(chave)
+        if existente is not None:
+            return existente
+        
+        cls._compartilhados[chave] = processos
+        return processos
+
+class ProcessoArquivo:
+    """Processos de uma OAB em SQLite no disco; a memória guarda só o caminho e a contagem"""
+    
+    CAMPOS = ProcessoStore.CAMPOS
+    DIRETORIO = os.environ.get('PROCESSOS_DIR', 'processos_db')
+    LIMITE_MEMORIA = int(os.environ.get('PROCESSOS_EM_MEMORIA', '5000'))
+    RETENCAO = int(os.environ.get('PROCESSOS_RETENCAO', '86400'))
+    # Com backend compartilhado só transborda se todas as réplicas enxergam PROCESSOS_DIR
+    DIRETORIO_COMPARTILHADO = os.environ.get('PROCESSOS_DIR_COMPARTILHADO', '0') == '1'
+    LOTE = 500
+    
+    incompleto = False
+    pagina_falha = None
+    # Desserializado sem o arquivo (outra réplica ou já apagado pela retenção)
+    ausente = False
+    
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conexao = None
+        self._total = None
+    
+    @classmethod
+    def criar(cls, oab):
+        """Arquivo novo para uma consulta (remove os que passaram da retenção)"""
+        os.makedirs(cls.DIRETORIO, exist_ok=True)
+        cls.limpar_antigos()
+        nome = f"{re.sub(r'[^0-9A-Za-z]', '', oab)}_{uuid.uuid4().hex[:8]}.sqlite"
+        return cls(os.path.join(cls.DIRETORIO, nome))
+    
+    @classmethod
+    def limpar_antigos(cls):
+        """Apaga arquivos sem escrita há mais de PROCESSOS_RETENCAO segundos"""
+        limite = time.time() - cls.RETENCAO
+        try:
+            for nome in os.listdir(cls.DIRETORIO):
+                caminho = os.path.join(cls.DIRETORIO, nome)
+                if nome.endswith('.sqlite') and os.path.getmtime(caminho) < limite:
+                    os.remove(caminho)
+        except Exception as e:
+            print(f"⚠️ Erro ao limpar arquivos de processos: {e}")
+    
+    @classmethod
+    def precisa_disco(cls, processos):
+        """Se transbordar() vai gravar em disco: chamar transbordar/extend fora do event loop"""
+        return isinstance(processos, cls) or len(processos) > cls.LIMITE_MEMORIA
+    
+    @classmethod
+    def transbordar(cls, processos, oab):
+        """Move o store em memória para o disco quando passa de PROCESSOS_EM_MEMORIA processos (bloqueante)"""
+        if isinstance(processos, cls) or len(processos) <= cls.LIMITE_MEMORIA:
+            return processos
+        if state_backend.shared and not cls.DIRETORIO_COMPARTILHADO:
+            return processos
+        
+        arquivo = cls.criar(oab)
+        for inicio in range(0, len(processos), cls.LOTE):
+            arquivo.extend(processos[inicio:inicio + cls.LOTE])
+        arquivo.incompleto = processos.incompleto
+        arquivo.pagina_falha = processos.pagina_falha
+        print(f"💾 {len(arquivo)} processos da OAB {oab} movidos para {arquivo.caminho}")
+        return arquivo
+    
+    def _abrir(self):
+        if self._conexao is None:
+            self._conexao = sqlite3.connect(self.caminho, check_same_thread=False)
+            self._conexao.execute(
+                "CREATE TABLE IF NOT EXISTS processos ("
+                "linha INTEGER PRIMARY KEY, id TEXT, numero TEXT, classe TEXT, assunto TEXT, ano INTEGER, "
+                "data_movimentacao TEXT, advogado TEXT, digitos TEXT, classe_busca TEXT, assunto_busca TEXT, "
+                "advogado_busca TEXT)"
+            )
+            self._conexao.execute("CREATE INDEX IF NOT EXISTS processos_id ON processos (id)")
+            self._conexao.execute("CREATE INDEX IF NOT EXISTS processos_digitos ON processos (digitos)")
+            self._total = self._conexao.execute("SELECT COUNT(*) FROM processos").fetchone()[0]
+        return self._conexao
+    
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            return self._abrir().execute(sql, parametros).fetchall()
+    
+    @staticmethod
+    def _texto_busca(valor):
+        """Tokens normalizados entre espaços, para busca por prefixo com instr()"""
+        return f" {' '.join(SearchIndex._tokenizar(valor))} "
+    
+    def extend(self, processos):
+        linhas = [
+            (processo['id'], processo['numero'], processo['classe'], processo['assunto'], processo['ano'],
+             processo['data_movimentacao'], processo['advogado'], re.sub(r'\D', '', processo['numero']),
+             self._texto_busca(processo['classe']), self._texto_busca(processo['assunto']),
+             self._texto_busca(processo['advogado']))
+            for processo in processos
+        ]
+        if not linhas:
+            return
+        with self._lock:
+            conexao = self._abrir()
+            with conexao:
+                conexao.executemany(
+                    "INSERT INTO processos (linha, id, numero, classe, assunto, ano, data_movimentacao, advogado, "
+                    "digitos, classe_busca, assunto_busca, advogado_busca) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(self._total + i,) + linha for i, linha in enumerate(linhas)]
+                )
+            self._total += len(linhas)
+    
+    def append(self, processo):
+        self.extend([processo])
+    
+    def novos(self, processos):
+        """Processos cujo id ainda não está no arquivo"""
+        ids = [processo['id'] for processo in processos]
+        if not ids:
+            return []
+        existentes = {
+            linha[0] for linha in self._consultar(
+                f"SELECT id FROM processos WHERE id IN ({','.join('?' * len(ids))})", ids
+            )
+        }
+        return [processo for processo in processos if processo['id'] not in existentes]
+    
+    def _registro(self, linha):
+        return dict(zip(self.CAMPOS, linha))
+    
+    def linhas(self, posicoes):
+        """Processos nas posições pedidas (na mesma ordem), buscados em lotes"""
+        colunas = ', '.join(('linha',) + self.CAMPOS)
+        for inicio in range(0, len(posicoes), self.LOTE):
+            lote = list(posicoes[inicio:inicio + self.LOTE])
+            encontrados = {
+                linha[0]: self._registro(linha[1:]) for linha in self._consultar(
+                    f"SELECT {colunas} FROM processos WHERE linha IN ({','.join('?' * len(lote))})", lote
+                )
             }
+            for posicao in lote:
+                yield encontrados[posicao]
+    
+    def __len__(self):
+        if self._total is None:
+            with self._lock:
+                self._abrir()
+        return self._total
+    
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return ProcessoSelecao(self, range(len(self))[item])
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+        linha = self._consultar(f"SELECT {', '.join(self.CAMPOS)} FROM processos WHERE linha = ?", (item,))
+        return self._registro(linha[0])
+    
+    def __iter__(self):
+        return self.linhas(range(len(self)))
+    
+    def assinatura(self):
+        """Mesmo hash de ProcessoStore.assinatura, lendo os ids em lotes"""
+        md5 = hashlib.md5()
+        for inicio in range(0, len(self), self.LOTE):
+            ids = self._consultar(
+                "SELECT id FROM processos WHERE linha >= ? AND linha < ? ORDER BY linha", (inicio, inicio + self.LOTE)
+            )
+            for i, (processo_id,) in enumerate(ids):
+                if inicio + i:
+                    md5.update(b'\n')
+                md5.update(processo_id.encode())
+        return md5.hexdigest()
+    
+    def __getstate__(self):
+        # Só o caminho vai para o backend de estado / disco da sessão
+        return {'caminho': self.caminho, 'incompleto': self.incompleto, 'pagina_falha': self.pagina_falha}
+    
+    def __setstate__(self, estado):
+        self.__init__(estado['caminho'])
+        self.incompleto = estado['incompleto']
+        self.pagina_falha = estado['pagina_falha']
+        diretorio = os.path.realpath(self.DIRETORIO)
+        if os.path.commonpath([diretorio, os.path.realpath(self.caminho)]) != diretorio:
+            # Caminho vindo do backend de estado: só arquivos dentro de PROCESSOS_DIR
+            print(f"⚠️ Arquivo de processos fora de {self.DIRETORIO}: {self.caminho}")
+            self._total = 0
+            self.ausente = True
+        elif not os.path.exists(self.caminho):
+            print(f"⚠️ Arquivo de processos não encontrado: {self.caminho}")
+            self._total = 0
+            self.ausente = True
+
+class SearchIndex:
+    """Índice de busca da sessão: número CNJ (só dígitos) e texto livre, guardando só números de linha"""
+    
+    PESOS_CAMPOS = {'classe': 3, 'assunto': 2, 'advogado': 1}
+    STOPWORDS = {'de', 'da', 'do', 'das', 'dos', 'e', 'em', 'a', 'o', 'na', 'no', 'por', 'para'}
+    
+    def __init__(self, processos):
+        self.processos = processos
+        # token -> array de (linha << 2 | peso); os valores categóricos se repetem, então tokeniza cada um uma vez
+        postings = {}
+        tokens_valor = {}
+        com_numero = []
+        
+        for posicao, processo in enumerate(processos):
+            if self._digitos(processo['numero']):
+                com_numero.append(posicao)
+            
+            pesos = {}
+            for campo, peso in self.PESOS_CAMPOS.items():
+                valor = processo.get(campo, '')
+                tokens = tokens_valor.get(valor)
+                if tokens is None:
+                    tokens = tokens_valor[valor] = self._tokenizar(valor)
+                for token in tokens:
+                    pesos[token] = max(pesos.get(token, 0), peso)
+            if processo.get('ano'):
+                pesos[str(processo['ano'])] = 1
+            
+            for token, peso in pesos.items():
+                linhas = postings.get(token)
+                if linhas is None:
+                    linhas = postings[token] = array('I')
+                linhas.append(posicao << 2 | peso)
+        
+        self.postings = postings
+        self.vocabulario = sorted(postings)
+        # Linhas ordenadas pelos dígitos do número (calculados de novo na busca, sem guardar as strings)
+        self.numeros = array('I', sorted(com_numero, key=self._digitos_linha))
+    
+    @classmethod
+    def para(cls, processos):
+        """Índice adequado ao armazenamento: SQL para processos em disco, em memória para os demais"""
+        if isinstance(processos, ProcessoArquivo):
+            return DiskSearchIndex(processos)
+        return cls(processos)
+    
+    @classmethod
+    def _tokenizar(cls, texto):
+        """Normaliza (sem acentos, minúsculas) e quebra o texto em tokens"""
+        if not texto or texto == "N/A":
+            return []
+        texto = unicodedata.normalize('NFKD', texto)
+        texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+        return [t for t in re.findall(r'[a-z0-9]+', texto) if len(t) > 1 and t not in cls.STOPWORDS]
+    
+    @staticmethod
+    def _digitos(numero):
+        return re.sub(r'\D', '', numero)
+    
+    def _digitos_linha(self, posicao):
+        if isinstance(self.processos, ProcessoStore):
+            return self._digitos(self.processos.valor(posicao, 'numero'))
+        return self._digitos(self.processos[posicao]['numero'])
+    
+    def buscar(self, termo):
+        """Busca por número (prefixo/trecho) ou por palavras; resultados ordenados por relevância"""
+        termo = termo.strip()
+        if not termo:
+            return []
+        
+        if re.search(r'[A-Za-zÀ-ÿ]', termo):
+            pontuacao = self._buscar_texto(termo)
+        else:
+            pontuacao = self._buscar_numero(self._digitos(termo))
+        
+        ordenados = sorted(
+            pontuacao.items(),
+            key=lambda item: (-item[1], -(self.processos[item[0]].get('ano') or 0), item[0])
+        )
+        return [self.processos[posicao] for posicao, _ in ordenados]
+    
+    def _buscar_numero(self, digitos):
+        """Prefixo do número CNJ via busca binária; trecho do número como fallback"""
+        pontuacao = {}
+        if not digitos:
+            return pontuacao
+        
+        inicio = bisect.bisect_left(self.numeros, digitos, key=self._digitos_linha)
+        for posicao in self.numeros[inicio:]:
+            numero = self._digitos_linha(posicao)
+            if not numero.startswith(digitos):
+                break
+            pontuacao[posicao] = 100 if numero == digitos else 50
+        
+        if not pontuacao:
+            for posicao in self.numeros:
+                if digitos in self._digitos_linha(posicao):
+                    pontuacao[posicao] = 10
+        return pontuacao
+    
+    def _buscar_texto(self, termo):
+        """Todas as palavras precisam casar (exata ou por prefixo); peso por campo"""
+        pontuacao = None
+        for token in self._tokenizar(termo):
+            encontrados = {}
+            for i in range(bisect.bisect_left(self.vocabulario, token), len(self.vocabulario)):
+                candidato = self.vocabulario[i]
+                if not candidato.startswith(token):
+                    break
+                fator = 2 if candidato == token else 1
+                for item in self.postings[candidato]:
+                    posicao, peso = item >> 2, (item & 3) * fator
+                    if peso > encontrados.get(posicao, 0):
+                        encontrados[posicao] = peso
+            
+            if pontuacao is None:
+                pontuacao = encontrados
+            else:
+                pontuacao = {
+                    posicao: pontos + encontrados[posicao]
+                    for posicao, pontos in pontuacao.items()
+                    if posicao in encontrados
+                }
+            if not pontuacao:
+                break
+        return pontuacao or {}
+
+class DiskSearchIndex:
+    """Mesma busca do SearchIndex feita em SQL sobre um ProcessoArquivo (sem índice em memória)"""
+    
+    def __init__(self, processos):
+        self.processos = processos
+    
+    def buscar(self, termo):
+        termo = termo.strip()
+        if not termo:
+            return []
+        
+        if re.search(r'[A-Za-zÀ-ÿ]', termo):
+            linhas = self._buscar_texto(termo)
+        else:
+            linhas = self._buscar_numero(re.sub(r'\D', '', termo))
+        return ProcessoSelecao(self.processos, [linha for linha, in linhas])
+    
+    def _buscar_numero(self, digitos):
+        if not digitos:
+            return []
+        linhas = self.processos._consultar(
+            "SELECT linha FROM processos WHERE digitos LIKE ? || '%' "
+            "ORDER BY CASE WHEN digitos = ? THEN 0 ELSE 1 END, ano DESC, linha", (digitos, digitos)
+        )
+        if not linhas:
+            linhas = self.processos._consultar(
+                "SELECT linha FROM processos WHERE instr(digitos, ?) > 0 ORDER BY ano DESC, linha", (digitos,)
+            )
+        return linhas
+    
+    def _buscar_texto(self, termo):
+        """Cada palavra pontua pelo melhor campo (exata vale o dobro do prefixo); todas precisam casar"""
+        expressoes, parametros = [], []
+        for token in SearchIndex._tokenizar(termo):
+            partes = []
+            for campo, peso in SearchIndex.PESOS_CAMPOS.items():
+                partes.append(
+                    f"CASE WHEN instr({campo}_busca, ' ' || ? || ' ') > 0 THEN {peso * 2} "
+                    f"WHEN instr({campo}_busca, ' ' || ?) > 0 THEN {peso} ELSE 0 END"
+                )
+                parametros += [token, token]
+            partes.append("CASE WHEN CAST(ano AS TEXT) = ? THEN 2 WHEN CAST(ano AS TEXT) LIKE ? || '%' THEN 1 ELSE 0 END")
+            parametros += [token, token]
+            expressoes.append(f"max({', '.join(partes)})")
+        if not expressoes:
+            return []
+        
+        return self.processos._consultar(
+            f"SELECT linha FROM (SELECT linha, ano, {', '.join(f'{e} AS p{i}' for i, e in enumerate(expressoes))} "
+            f"FROM processos) WHERE {' AND '.join(f'p{i} > 0' for i in range(len(expressoes)))} "
+            f"ORDER BY {' + '.join(f'p{i}' for i in range(len(expressoes)))} DESC, ano DESC, linha",
+            parametros
+        )
+
+class SessionAggregates:
+    """Agregados da sessão (por ano, classes, assuntos, períodos) mantidos incrementalmente"""
+    
+    def __init__(self, processos=()):
+        self.total = 0
+        self.processos = processos
+        self.posicoes_por_ano = {}
+        self.classes_por_ano = {}
+        self.assuntos = Counter()
+        self.datas_por_ano = {}
+        self._agrupado = None
+        self.adicionar(processos)
+    
+    def adicionar(self, processos):
+        """Incorpora novos processos (ex.: cada página parseada durante a consulta)"""
+        for processo in processos:
+            ano = processo['ano']
+            self.posicoes_por_ano.setdefault(ano, array('I')).append(self.total)
+            self.total += 1
+            self.classes_por_ano.setdefault(ano, Counter())[processo['classe']] += 1
+            if processo['assunto'] != "N/A":
+                self.assuntos[processo['assunto']] += 1
+            
+            data = self._extrair_data(processo['data_movimentacao'])
+            if data:
+                inicio, fim = self.datas_por_ano.get(ano, (data, data))
+                self.datas_por_ano[ano] = (min(inicio, data), max(fim, data))
+        self._agrupado = None
+    
+    @staticmethod
+    def _extrair_data(texto):
+        """Extrai a primeira data dd/mm/aaaa do texto"""
+        match = re.search(r'(\d{2})/(\d{2})/(\d{4})', texto or '')
+        if not match:
+            return None
+        try:
+            return datetime(int(match.group(3)), int(match.group(2)), int(match.group(1)))
+        except ValueError:
+            return None
+    
+    def vincular(self, processos):
+        """Associa a sequência final cujas posições foram agregadas durante a consulta"""
+        self.processos = processos
+        self._agrupado = None
+    
+    def processos_do_ano(self, ano):
+        """Processos de um ano, sem copiar os registros"""
+        posicoes = self.posicoes_por_ano.get(ano)
+        if not posicoes:
+            return []
+        return ProcessoSelecao(self.processos, posicoes)
+    
+    def agrupado(self):
+        """Processos por ano, do mais recente ao mais antigo (mesmo formato de agrupar_por_ano)"""
+        if self._agrupado is None:
+            self._agrupado = {
+                ano: self.processos_do_ano(ano)
+                for ano in sorted(self.posicoes_por_ano, reverse=True)
+            }
+        return self._agrupado
+    
+    def classes_comuns(self, ano, limite=2):
+        """Classes mais frequentes em um ano"""
+        return self.classes_por_ano.get(ano, Counter()).most_common(limite)
+    
+    def assuntos_comuns(self, limite=5):
+        """Assuntos mais frequentes na sessão"""
+        return self.assuntos.most_common(limite)
+    
+    def periodo(self, ano):
+        """Primeira e última data de distribuição conhecidas para o ano"""
+        return self.datas_por_ano.get(ano)
+
+class SessionStore:
+    """Persistência local das sessões para sobreviver a restarts"""
+
+    def __init__(self, diretorio='sessoes'):
+        self.diretorio = diretorio
+
+    def _caminho(self, session_id):
+        """Caminho do arquivo da sessão (nome seguro para o filesystem)"""
+        nome = hashlib.md5(session_id.encode()).hexdigest()
+        return os.path.join(self.diretorio, f"{nome}.pkl")
+
+    def save(self, session_id, session):
+        """Salva OAB, processos e data de criação da sessão"""
+        try:
+            os.makedirs(self.diretorio, exist_ok=True)
+            dados = {
+                'session_id': session_id,
+                'oab': session['oab'],
+                'processos': session['processos'],
+                'created_at': session['created_at'],
+                'user_info': session['user_info']
+            }
+            caminho = self._caminho(session_id)
+            temporario = f"{caminho}.tmp"
+            with open(temporario, 'wb') as f:
+                pickle.dump(dados, f)
+            os.replace(temporario, caminho)
+        except Exception as e:
+            print(f"❌ Erro ao salvar sessão: {e}")
+
+    def load(self, session_id):
+        """Carrega uma sessão salva (ou None)"""
+        caminho = self._caminho(session_id)
+        try:
+            if os.path.exists(caminho):
+                with open(caminho, 'rb') as f:
+                    dados = pickle.load(f)
+                if dados.get('session_id') == session_id:
+                    return dados
+        except Exception as e:
+            print(f"❌ Erro ao carregar sessão: {e}")
+        return None
+
+    def delete(self, session_id):
+        """Remove a sessão salva"""
+        try:
+            caminho = self._caminho(session_id)
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        except Exception as e:
+            print(f"❌ Erro ao remover sessão: {e}")
+
+class SnapshotStore:
+    """Snapshots das consultas por OAB em JSONL compactado, com índice do mais recente e retenção"""
+    
+    LOTE = 500
+    COMPRESSAO = 3
+    
+    def __init__(self, diretorio='processos'):
+        self.diretorio = diretorio
+        self.manter = int(os.environ.get('SNAPSHOTS_POR_OAB', '5'))
+        self.max_dias = int(os.environ.get('SNAPSHOTS_MAX_DIAS', '30'))
+    
+    @property
+    def caminho_indice(self):
+        return os.path.join(self.diretorio, 'indice.json')
+    
+    @contextlib.contextmanager
+    def _travado(self):
+        """Exclusão mútua no índice entre o bot e os workers de scraping"""
+        os.makedirs(self.diretorio, exist_ok=True)
+        with open(os.path.join(self.diretorio, '.indice.lock'), 'w') as trava:
+            if fcntl:
+                fcntl.flock(trava, fcntl.LOCK_EX)
+            yield
+    
+    def _ler_indice(self):
+        try:
+            with open(self.caminho_indice, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"⚠️ Índice de snapshots inválido, recriando: {e}")
+            return {}
+    
+    def _gravar_indice(self, indice):
+        temporario = f"{self.caminho_indice}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(indice, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporario, self.caminho_indice)
+    
+    def _aplicar_retencao(self, snapshots):
+        """Mantém os últimos SNAPSHOTS_POR_OAB com até SNAPSHOTS_MAX_DIAS (o mais recente e o último completo sempre ficam)"""
+        limite = (datetime.now() - timedelta(days=self.max_dias)).isoformat()
+        completo = next((snapshot for snapshot in snapshots if not snapshot.get('incompleto')), None)
+        mantidos = [
+            snapshot for posicao, snapshot in enumerate(snapshots)
+            if posicao == 0 or snapshot is completo or (posicao < self.manter and snapshot['consultado_em'] >= limite)
+        ]
+        for snapshot in snapshots:
+            if snapshot not in mantidos:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.diretorio, snapshot['arquivo']))
+        return mantidos
+    
+    def _limpar_legado(self):
+        """Remove os JSON indentados do formato antigo que passaram da idade máxima"""
+        limite = time.time() - self.max_dias * 86400
+        for nome in os.listdir(self.diretorio):
+            caminho = os.path.join(self.diretorio, nome)
+            if nome.startswith('processos_') and nome.endswith('.json') and os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+    
+    @staticmethod
+    def _gravar_lote(arquivo, lote, conteudo):
+        dados = ('\n'.join(lote) + '\n').encode() if lote else b''
+        conteudo.update(dados)
+        arquivo.write(dados)
+        quantidade = len(lote)
+        lote.clear()
+        return quantidade
+    
+    def salvar(self, oab, processos, incompleto=False):
+        """Grava um processo por linha; se o conteúdo já existe em um snapshot, só atualiza a data dele"""
+        os.makedirs(self.diretorio, exist_ok=True)
+        agora = datetime.now()
+        nome = f"{re.sub(r'[^0-9A-Za-z]', '', oab)}_{agora.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}.jsonl.gz"
+        caminho = os.path.join(self.diretorio, nome)
+        temporario = f"{caminho}.tmp"
+        
+        conteudo = hashlib.md5()
+        total = 0
+        codificar = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+        with gzip.open(temporario, 'wb', compresslevel=self.COMPRESSAO) as f:
+            # Cabeçalho com os nomes dos campos; cada linha seguinte é a lista de valores de um processo
+            f.write((codificar({'campos': ProcessoStore.CAMPOS}) + '\n').encode())
+            lote = []
+            for processo in processos:
+                lote.append(codificar([processo[campo] for campo in ProcessoStore.CAMPOS]))
+                if len(lote) == self.LOTE:
+                    total += self._gravar_lote(f, lote, conteudo)
+            total += self._gravar_lote(f, lote, conteudo)
+        
+        with self._travado():
+            indice = self._ler_indice()
+            snapshots = indice.get(oab, [])
+            igual = next((s for s in snapshots if s['conteudo'] == conteudo.hexdigest()), None)
+            if igual:
+                os.remove(temporario)
+                snapshots.remove(igual)
+                igual['consultado_em'] = agora.isoformat()
+                snapshots.insert(0, igual)
+                caminho = os.path.join(self.diretorio, igual['arquivo'])
+            else:
+                os.replace(temporario, caminho)
+                snapshots.insert(0, {
+                    'arquivo': nome,
+                    'criado_em': agora.isoformat(),
+                    'consultado_em': agora.isoformat(),
+                    'total': total,
+                    'conteudo': conteudo.hexdigest(),
+                    'incompleto': incompleto
+                })
+            indice[oab] = self._aplicar_retencao(snapshots)
+            self._gravar_indice(indice)
+            self._limpar_legado()
+        return caminho
+    
+    def listar(self, oab):
+        """Snapshots da OAB, do mais recente ao mais antigo"""
+        return self._ler_indice().get(oab, [])
+    
+    def ultimo(self, oab, completo=False):
+        """Snapshot mais recente da OAB; com completo=True ignora os de consultas que pararam no meio"""
+        for snapshot in self.listar(oab):
+            if not completo or not snapshot.get('incompleto'):
+                return snapshot
+        return None
+    
+    def carregar(self, oab, arquivo=None):
+        """Lê um snapshot (o mais recente por padrão) processo a processo, sem descompactar tudo em memória"""
+        if arquivo is None:
+            snapshot = self.ultimo(oab)
+            if not snapshot:
+                return
+            arquivo = snapshot['arquivo']
+        
+        try:
+            with gzip.open(os.path.join(self.diretorio, arquivo), 'rb') as f:
+                campos = json.loads(f.readline())['campos']
+                while True:
+                    linhas = f.readlines(1 << 16)
+                    if not linhas:
+                        break
+                    # Um json.loads por bloco de linhas em vez de um por processo
+                    for valores in json.loads(b'[' + b','.join(linhas) + b']'):
+                        yield dict(zip(campos, valores))
+        except FileNotFoundError:
+            print(f"⚠️ Snapshot não encontrado: {arquivo}")
+
+class ResultExporter:
+    """Exporta os processos da sessão (com os detalhes em cache) para um arquivo CSV, XLSX ou JSON"""
+    
+    FORMATOS = ('csv', 'xlsx', 'json')
+    COLUNAS = ProcessoStore.CAMPOS + ('foro', 'vara', 'area', 'link')
+    
+    def __init__(self, cache_manager, resultados=None):
+        self.cache_manager = cache_manager
+        self.resultados = resultados if resultados is not None else result_cache
+    
+    LOTE = 1000
+    
+    def linhas(self, processos):
+        """Um dict por processo, completado com os detalhes e o link já conhecidos (lidos em lote, não um por linha)"""
+        restantes = iter(processos)
+        while True:
+            lote = [dict(processo) for processo in itertools.islice(restantes, self.LOTE)]
+            if not lote:
+                return
+            ids = [linha['id'] for linha in lote]
+            detalhes_lote = self.resultados.get_detalhes_varios(ids)
+            links = self.cache_manager.get_links(ids)
+            for linha in lote:
+                detalhes = detalhes_lote.get(linha['id']) or {}
+                for campo in ('foro', 'vara', 'area'):
+                    linha[campo] = detalhes.get(campo, '')
+                linha['link'] = links.get(linha['id'], '')
+                yield linha
+    
+    def exportar(self, processos, formato, destino):
+        """Grava o arquivo em `destino`; bloqueante, chamar fora do event loop"""
+        getattr(self, f"_exportar_{formato}")(self.linhas(processos), destino)
+        return destino
+    
+    def _exportar_csv(self, linhas, destino):
+        # utf-8-sig e ';' para o Excel em português abrir direto
+        with open(destino, 'w', encoding='utf-8-sig', newline='') as f:
+            escritor = csv.DictWriter(f, fieldnames=self.COLUNAS, delimiter=';')
+            escritor.writeheader()
+            escritor.writerows(linhas)
+    
+    def _exportar_json(self, linhas, destino):
+        with open(destino, 'w', encoding='utf-8') as f:
+            f.write('[')
+            for i, linha in enumerate(linhas):
+                f.write(f"{',' if i else ''}\n{json.dumps(linha, ensure_ascii=False)}")
+            f.write('\n]\n')
+    
+    def _exportar_xlsx(self, linhas, destino):
+        import openpyxl
+        
+        planilha = openpyxl.Workbook(write_only=True)
+        aba = planilha.create_sheet('Processos')
+        aba.append(list(self.COLUNAS))
+        for linha in linhas:
+            aba.append([linha[coluna] for coluna in self.COLUNAS])
+        planilha.save(destino)
+
+class SessionManager:
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else state_backend
+        self.user_sessions = {}
+        self.session_timeout = 3600
+        self.busca_max = int(os.environ.get('DETALHES_LOTE_MAX', '50'))
+        self.store = SessionStore()
+    
+    def _salvar(self, session_id, session, com_processos=False):
+        """Publica a sessão no backend de estado (e no disco quando o backend é local)"""
+        session['versao'] = uuid.uuid4().hex
+        meta = {
+            'oab': session['oab'],
+            'created_at': session['created_at'],
+            'user_info': session['user_info'],
+            'versao': session['versao']
+        }
+        if com_processos:
+            self.backend.set('sessoes_processos', session_id, session['processos'], ttl=self.session_timeout)
+        self.backend.set('sessoes', session_id, meta, ttl=self.session_timeout)
+        
+        if com_processos and not self.backend.shared:
+            self.store.save(session_id, session)
+    
+    def create_session(self, username, chat_id, oab):
+        """Cria uma sessão privada para o usuário"""
+        session_id = f"{username}_{chat_id}"
+        self.user_sessions[session_id] = {
+            'oab': oab,
+            'processos': [],
+            'agregados': SessionAggregates(),
+            'service': TJSPScrapingService(),
+            'created_at': datetime.now(),
+            'user_info': {
+                'username': username,
+                'chat_id': chat_id
+            }
+        }
+        self.backend.delete('sessoes_busca', session_id)
+        self._salvar(session_id, self.user_sessions[session_id])
+        return session_id
+    
+    def get_session(self, username, chat_id):
+        """Obtém a sessão do usuário"""
+        session_id = f"{username}_{chat_id}"
+        meta = self.backend.get('sessoes', session_id)
+        
+        if meta is None and not self.backend.shared:
+            meta = self._rehydrate_session(session_id)
+        
+        if meta is None:
+            self.user_sessions.pop(session_id, None)
+            return None
+        
+        session = self.user_sessions.get(session_id)
+        if not session or session.get('versao') != meta['versao']:
+            # Sessão criada/atualizada por outra réplica (ou após restart)
+            session = self._hidratar(session_id, meta)
+            if session is None:
+                self.clear_session(username, chat_id)
+                return None
+        
+        elapsed = (datetime.now() - session['created_at']).total_seconds()
+        if elapsed > self.session_timeout:
+            self.clear_session(username, chat_id)
+            return None
+        return session
+    
+    def set_processos(self, username, chat_id, processos):
+        """Define os processos da sessão e persiste no backend"""
+        session_id = f"{username}_{chat_id}"
+        session = self.user_sessions.get(session_id)
+        if not session:
+            return None
+        processos = ProcessoStore.compartilhado(session['oab'], processos)
+        session['processos'] = processos
+        session['indice'] = None
+        if session['agregados'].total == len(processos):
+            session['agregados'].vincular(processos)
+        else:
+            session['agregados'] = SessionAggregates(processos)
+        self._salvar(session_id, session, com_processos=True)
+        return session
+    
+    def salvar_busca(self, username, chat_id, termo, resultados):
+        """Guarda a última busca no backend para /detalhes_busca funcionar em qualquer réplica"""
+        busca = {
+            'termo': termo,
+            'processos': [dict(processo) for processo in resultados[:self.busca_max]],
+            'total': len(resultados)
+        }
+        self.backend.set('sessoes_busca', f"{username}_{chat_id}", busca, ttl=self.session_timeout)
+    
+    def ultima_busca(self, username, chat_id):
+        """Última busca do usuário (termo, até DETALHES_LOTE_MAX processos e total) ou None"""
+        return self.backend.get('sessoes_busca', f"{username}_{chat_id}")
+    
+    def indice_busca(self, session):
+        """Índice de busca da sessão, montado só na primeira busca"""
+        if session.get('indice') is None:
+            session['indice'] = SearchIndex.para(session['processos'])
+        return session['indice']
+    
+    def _hidratar(self, session_id, meta):
+        """Monta a sessão local (serviço, índice, agregados) a partir do backend"""
+        processos = self.backend.get('sessoes_processos', session_id)
+        if getattr(processos, 'ausente', False):
+            # Processos em disco de outra réplica (ou já apagados): a sessão não serve sem eles
+            return None
+        processos = processos or []
+        if processos:
+            processos = ProcessoStore.compartilhado(meta['oab'], processos)
+        session = {
+            'oab': meta['oab'],
+            'processos': processos,
+            'indice': None,
+            'agregados': SessionAggregates(processos),
+            'service': TJSPScrapingService(),
+            'created_at': meta['created_at'],
+            'user_info': meta['user_info'],
+            'versao': meta['versao']
+        }
+        self.user_sessions[session_id] = session
+        return session
+    
+    def _rehydrate_session(self, session_id):
+        """Recarrega do disco uma sessão salva antes do restart"""
+        dados = self.store.load(session_id)
+        if not dados:
+            return None
+        
+        session = {
+            'oab': dados['oab'],
+            'processos': ProcessoStore.compartilhado(dados['oab'], dados['processos']),
+            'created_at': dados['created_at'],
+            'user_info': dados['user_info']
+        }
+        self._salvar(session_id, session, com_processos=True)
+        print(f"♻️ Sessão restaurada do disco: {session_id}")
+        return self.backend.get('sessoes', session_id)
+    
+    def clear_session(self, username, chat_id):
+        """Limpa a sessão do usuário"""
+        session_id = f"{username}_{chat_id}"
+        if session_id in self.user_sessions:
+            del self.user_sessions[session_id]
+        self.backend.delete('sessoes', session_id)
+        self.backend.delete('sessoes_processos', session_id)
+        self.backend.delete('sessoes_busca', session_id)
+        self.store.delete(session_id)
+    
+    def active_sessions(self):
+        """Quantidade de sessões ativas (todas as réplicas)"""
+        return len(self.backend.keys('sessoes'))
+    
+    def get_user_sessions(self, username):
+        """Obtém todas as sessões de um usuário"""
+        return {k: v for k, v in self.user_sessions.items() if k.startswith(f"{username}_")}
+
+class ScrapeJob:
+    """Consulta de OAB executada em segundo plano"""
+    
+    ESTADOS = {
+        'queued': '⏳ Na fila',
+        'running': '🔄 Em andamento',
+        'done': '✅ Concluída',
+        'failed': '❌ Falhou',
+        'cancelled': '🛑 Cancelada'
+    }
+    
+    def __init__(self, username, chat_id, oab, unidade='página'):
+        self.id = uuid.uuid4().hex[:8]
+        self.username = username
+        self.chat_id = chat_id
+        self.oab = oab
+        self.unidade = unidade
+        self.estado = 'queued'
+        self.pagina_atual = 0
+        self.total_paginas = None
+        self.processos_indexados = 0
+        self.erro = None
+        self.task = None
+        self.criado_em = datetime.now()
+        self.finalizado_em = None
+    
+    @property
+    def ativo(self):
+        return self.estado in ('queued', 'running')
+    
+    def atualizar_progresso(self, pagina, total_paginas=None, processos=None):
+        """Atualiza página atual / total e processos indexados"""
+        self.estado = 'running'
+        self.pagina_atual = pagina
+        if total_paginas:
+            self.total_paginas = total_paginas
+        if processos is not None:
+            self.processos_indexados = processos
+    
+    def finalizar(self, estado, erro=None):
+        self.estado = estado
+        self.erro = erro
+        self.finalizado_em = datetime.now()
+    
+    def descrever(self):
+        """Texto de status para o usuário"""
+        fim = self.finalizado_em or datetime.now()
+        decorrido = int((fim - self.criado_em).total_seconds())
+        
+        posicao = scrape_scheduler.posicao(self.id)
+        if posicao:
+            progresso = f"na fila - posição {posicao} de {scrape_scheduler.aguardando()}"
+        elif self.total_paginas:
+            progresso = f"{self.unidade} {self.pagina_atual} de {self.total_paginas}"
+        elif self.pagina_atual:
+            progresso = f"{self.unidade} {self.pagina_atual}"
+        else:
+            progresso = "aguardando o TJSP"
+        
+        mensagem = (
+            f"🆔 **Job:** `{self.id}`\n"
+            f"🔍 **OAB:** {self.oab}\n"
+            f"📌 **Estado:** {self.ESTADOS[self.estado]}\n"
+            f"📄 **Progresso:** {progresso}\n"
+            f"📋 **Processos indexados:** {self.processos_indexados}\n"
+            f"⏱ **Tempo:** {decorrido // 60}min {decorrido % 60}s"
+        )
+        if self.erro:
+            mensagem += f"\n⚠️ {self.erro}"
+        return mensagem
+
+class JobRegistry:
+    """Registro dos jobs de consulta (um job ativo por usuário/chat)"""
+    
+    def __init__(self):
+        self.jobs = {}
+        self.ultimos_jobs = {}
+        self.retencao = 3600
+    
+    def _chave(self, username, chat_id):
+        return f"{username}_{chat_id}"
+    
+    def criar(self, username, chat_id, oab, unidade='página'):
+        """Registra um novo job na fila"""
+        self._limpar_antigos()
+        job = ScrapeJob(username, chat_id, oab, unidade)
+        self.jobs[job.id] = job
+        self.ultimos_jobs[self._chave(username, chat_id)] = job.id
+        return job
+    
+    def iniciar(self, job, coro):
+        """Executa a corrotina do job em segundo plano"""
+        job.task = asyncio.create_task(coro)
+        return job.task
+    
+    def ultimo_job(self, username, chat_id):
+        """Último job do usuário neste chat (ativo ou não)"""
+        job_id = self.ultimos_jobs.get(self._chave(username, chat_id))
+        return self.jobs.get(job_id) if job_id else None
+    
+    def job_ativo(self, username, chat_id):
+        """Job em andamento do usuário neste chat"""
+        job = self.ultimo_job(username, chat_id)
+        return job if job and job.ativo else None
+    
+    def cancelar(self, username, chat_id):
+        """Cancela o job ativo; o Chromium é fechado pelo finally da consulta"""
+        job = self.job_ativo(username, chat_id)
+        if not job:
+            return None
+        if job.task and not job.task.done():
+            job.task.cancel()
+        job.finalizar('cancelled')
+        return job
+    
+    def ativos(self):
+        return [job for job in self.jobs.values() if job.ativo]
+    
+    def _limpar_antigos(self):
+        """Descarta jobs finalizados há mais tempo que a retenção"""
+        agora = datetime.now()
+        for job_id, job in list(self.jobs.items()):
+            if job.finalizado_em and (agora - job.finalizado_em).total_seconds() > self.retencao:
+                del self.jobs[job_id]
+                chave = self._chave(job.username, job.chat_id)
+                if self.ultimos_jobs.get(chave) == job_id:
+                    del self.ultimos_jobs[chave]
+
+class ScrapeScheduler:
+    """Vez das consultas ao TJSP: N simultâneas, admins primeiro e rodízio entre usuários"""
+    
+    def __init__(self, capacidade=None):
+        if capacidade is None:
+            capacidade = int(os.environ.get('SCRAPE_CONCORRENCIA', '0')) or max(scrape_workers.quantidade, 2)
+        self.capacidade = capacidade
+        self.em_execucao = 0
+        # usuário -> fila de pedidos; a ordem das chaves é o rodízio (quem foi atendido vai para o fim)
+        self.filas_admin = OrderedDict()
+        self.filas_usuarios = OrderedDict()
+    
+    def aguardando(self):
+        return sum(len(fila) for filas in (self.filas_admin, self.filas_usuarios) for fila in filas.values())
+    
+    def _ordem(self):
+        """Pedidos na ordem em que serão atendidos: admins primeiro, depois um por usuário a cada rodada"""
+        ordem = []
+        for filas in (self.filas_admin, self.filas_usuarios):
+            pendentes = list(filas.values())
+            rodada = 0
+            while True:
+                da_rodada = [fila[rodada] for fila in pendentes if len(fila) > rodada]
+                if not da_rodada:
+                    break
+                ordem.extend(da_rodada)
+                rodada += 1
+        return ordem
+    
+    def posicao(self, chave):
+        """Posição (1 = próximo) do pedido na fila, ou None se não está esperando"""
+        for posicao, pedido in enumerate(self._ordem(), 1):
+            if pedido['chave'] == chave:
+                return posicao
+        return None
+    
+    def _proximo(self):
+        for filas in (self.filas_admin, self.filas_usuarios):
+            for usuario, fila in filas.items():
+                pedido = fila.popleft()
+                if fila:
+                    filas.move_to_end(usuario)
+                else:
+                    del filas[usuario]
+                return pedido
+        return None
+    
+    def _despachar(self):
+        while self.em_execucao < self.capacidade:
+            pedido = self._proximo()
+            if pedido is None:
+                return
+            if pedido['futuro'].done():
+                continue
+            self.em_execucao += 1
+            pedido['futuro'].set_result(True)
+    
+    def _remover(self, pedido):
+        filas = pedido['filas']
+        fila = filas.get(pedido['usuario'])
+        if fila and pedido in fila:
+            fila.remove(pedido)
+            if not fila:
+                del filas[pedido['usuario']]
+    
+    def _liberar(self):
+        self.em_execucao -= 1
+        self._despachar()
+    
+    @staticmethod
+    async def _avisar(avisar, texto):
+        """Aviso de fila sem garantia: erro do Telegram (NetworkError, RetryAfter) não pode prender a vaga"""
+        try:
+            await avisar(texto)
+        except Exception as e:
+            print(f"⚠️ Erro ao avisar a posição na fila: {e}")
+    
+    @contextlib.asynccontextmanager
+    async def vez(self, usuario, admin=False, chave=None, avisar=None):
+        """Espera a vez do usuário (avisando a posição na fila) e ocupa uma vaga até sair do bloco"""
+        pedido = {
+            'chave': chave or uuid.uuid4().hex,
+            'usuario': usuario,
+            'filas': self.filas_admin if admin else self.filas_usuarios,
+            'futuro': asyncio.get_running_loop().create_future()
+        }
+        pedido['filas'].setdefault(usuario, deque()).append(pedido)
+        self._despachar()
+        esperou = not pedido['futuro'].done()
+        inicio = time.monotonic()
+        try:
+            if esperou and avisar:
+                await self._avisar(
+                    avisar,
+                    f"⏳ **Na fila:** posição {self.posicao(pedido['chave'])} de {self.aguardando()}\n"
+                    f"⚡ {self.em_execucao} consultas ao TJSP em andamento\n"
+                    f"💡 `/status` mostra a posição atualizada"
+                )
+            await pedido['futuro']
+        except BaseException:
+            # Cancelado ou com erro na espera: sai da fila ou devolve a vaga concedida junto com o erro
+            if pedido['futuro'].done() and not pedido['futuro'].cancelled():
+                self._liberar()
+            else:
+                self._remover(pedido)
+            raise
+        
+        try:
+            metrics.observar('tjsp_fila_consultas_espera_segundos', time.monotonic() - inicio)
+            if esperou and avisar:
+                await self._avisar(avisar, "▶️ **Sua vez!** Consulta ao TJSP iniciada")
+            yield
+        finally:
+            self._liberar()
+    
+    def resumo(self):
+        return {'capacidade': self.capacidade, 'em_execucao': self.em_execucao, 'aguardando': self.aguardando()}
+
+class WatchlistManager:
+    """OABs monitoradas: verificação periódica com jitter, limite global de consultas e aviso de novidades"""
+    
+    NAMESPACE = 'monitoramento'
+    # Nome das verificações no rodízio do agendador ('#' não existe em usernames do Telegram)
+    USUARIO_AGENDADOR = '#monitoramento'
+    TICK = 60
+    MAX_LISTADOS = 15
+    
+    def __init__(self, backend=None):
+        self.arquivo = 'monitoramento.pkl'
+        self.backend = backend if backend is not None else state_backend
+        self.intervalo = int(os.environ.get('MONITOR_INTERVALO', '86400'))
+        self.jitter = float(os.environ.get('MONITOR_JITTER', '0.1'))
+        self.concorrencia = int(os.environ.get('MONITOR_CONCORRENCIA', '1'))
+        self.max_por_usuario = int(os.environ.get('MONITOR_MAX_POR_USUARIO', '5'))
+        self.em_execucao = set()
+        self.tarefas = set()
+        if not self.backend.shared and not self.backend.get('carregado', self.NAMESPACE):
+            self.backend.set_many(self.NAMESPACE, self._carregar_arquivo())
+            self.backend.set('carregado', self.NAMESPACE, True)
+    
+    def _carregar_arquivo(self):
+        try:
+            if os.path.exists(self.arquivo):
+                with open(self.arquivo, 'rb') as f:
+                    return pickle.load(f)
+        except Exception as e:
+            print(f"❌ Erro ao carregar monitoramento: {e}")
+        return {}
+    
+    def _salvar(self, oab, item):
+        """Grava a OAB monitorada (ou remove, se item for None) e persiste em disco quando o backend é local"""
+        if item is None:
+            self.backend.delete(self.NAMESPACE, oab)
+        else:
+            self.backend.set(self.NAMESPACE, oab, item)
+        if self.backend.shared:
+            return
+        try:
+            with open(self.arquivo, 'wb') as f:
+                pickle.dump(self.backend.get_all(self.NAMESPACE), f)
+        except Exception as e:
+            print(f"❌ Erro ao salvar monitoramento: {e}")
+    
+    def _proxima(self, base=None):
+        """Próxima verificação: intervalo ± jitter, para as OABs não vencerem todas juntas"""
+        segundos = base if base is not None else self.intervalo
+        return datetime.now() + timedelta(seconds=segundos * random.uniform(1 - self.jitter, 1 + self.jitter))
+    
+    def oabs(self):
+        return self.backend.get_all(self.NAMESPACE)
+    
+    def do_usuario(self, username, chat_id):
+        assinante = f"{username}_{chat_id}"
+        return [item for item in self.oabs().values() if assinante in item['assinantes']]
+    
+    def adicionar(self, username, chat_id, oab, snapshots):
+        """Inscreve o usuário; devolve a mensagem de resposta"""
+        if len(self.do_usuario(username, chat_id)) >= self.max_por_usuario:
+            return f"❌ Limite de {self.max_por_usuario} OABs monitoradas atingido\n💡 `/desmonitorar OAB` para liberar"
+        
+        item = self.backend.get(self.NAMESPACE, oab)
+        if item is None:
+            # Sem snapshot ainda, a primeira verificação (que cria a base) sai em poucos minutos
+            tem_base = snapshots.ultimo(oab, completo=True) is not None
+            item = {
+                'oab': oab,
+                'assinantes': {},
+                'criado_em': datetime.now(),
+                'ultima_verificacao': None,
+                'proxima_verificacao': self._proxima() if tem_base else self._proxima(300),
+                'total': None,
+                'erro': None
+            }
+        item['assinantes'][f"{username}_{chat_id}"] = {'username': username, 'chat_id': chat_id, 'desde': datetime.now()}
+        self._salvar(oab, item)
+        return (
+            f"🔔 **OAB {oab} monitorada!**\n"
+            f"⏰ Próxima verificação: {item['proxima_verificacao'].strftime('%d/%m %H:%M')}\n"
+            f"📬 Você recebe só os processos novos ou alterados"
+        )
+    
+    def remover(self, username, chat_id, oab):
+        item = self.backend.get(self.NAMESPACE, oab)
+        if not item or item['assinantes'].pop(f"{username}_{chat_id}", None) is None:
+            return False
+        self._salvar(oab, item if item['assinantes'] else None)
+        return True
+    
+    def vencidas(self):
+        agora = datetime.now()
+        return [
+            oab for oab, item in self.oabs().items()
+            if item['proxima_verificacao'] <= agora and oab not in self.em_execucao
+        ]
+    
+    @staticmethod
+    def _digest(processo):
+        return hashlib.md5(json.dumps([processo[campo] for campo in ProcessoStore.CAMPOS], ensure_ascii=False).encode()).hexdigest()
+    
+    def diferencas(self, anteriores, processos):
+        """Processos novos e alterados em relação aos digests do último snapshot (por id)"""
+        novos, alterados = [], []
+        for processo in processos:
+            anterior = anteriores.get(processo['id'])
+            if anterior is None:
+                novos.append(processo)
+            elif anterior != self._digest(processo):
+                alterados.append(processo)
+        return novos, alterados
+    
+    async def executar(self, bot):
+        """Laço do agendador (roda junto com o bot)"""
+        semaforo = asyncio.Semaphore(self.concorrencia)
+        while True:
+            for oab in self.vencidas():
+                self.em_execucao.add(oab)
+                # Referência guardada até o fim: o event loop só mantém referências fracas às tasks
+                tarefa = asyncio.create_task(self._verificar_com_limite(oab, semaforo, bot))
+                self.tarefas.add(tarefa)
+                tarefa.add_done_callback(self.tarefas.discard)
+            await asyncio.sleep(self.TICK)
+    
+    async def _verificar_com_limite(self, oab, semaforo, bot):
+        try:
+            async with semaforo:
+                await self.verificar(oab, bot)
+        except Exception as e:
+            print(f"❌ Erro no monitoramento da OAB {oab}: {e}")
+        finally:
+            self.em_execucao.discard(oab)
+    
+    def _carregar_base(self, snapshots, oab):
+        """Digests do último snapshot completo (ou None); lê o disco, chamar fora do event loop"""
+        # Base só de consulta completa: numa que parou no meio, tudo depois da falha pareceria novo
+        snapshot = snapshots.ultimo(oab, completo=True)
+        if not snapshot:
+            return None
+        return {processo['id']: self._digest(processo) for processo in snapshots.carregar(oab, snapshot['arquivo'])}
+    
+    @rastrear('monitoramento.verificar', raiz=True)
+    async def verificar(self, oab, bot):
+        """Consulta a OAB, compara com o snapshot anterior e avisa os assinantes"""
+        tracer.anotar(oab=oab)
+        service = TJSPScrapingService()
+        anteriores = await asyncio.to_thread(self._carregar_base, service.snapshots, oab)
+        
+        async with vez_no_tjsp(self.USUARIO_AGENDADOR, cota=False) as recusa:
+            if recusa:
+                # Fica vencida e volta na próxima passada do monitoramento
+                metrics.incrementar('tjsp_monitoramento_verificacoes_total', resultado='sem_memoria')
+                return
+            if scrape_workers.ativo:
+                processos, erro = await scrape_workers.consultar_por_oab(oab, service)
+            else:
+                processos, erro = await service.consultar_por_oab(oab)
+        
+        item = self.backend.get(self.NAMESPACE, oab)
+        if item is None:
+            return
+        item['ultima_verificacao'] = datetime.now()
+        item['proxima_verificacao'] = self._proxima()
+        item['erro'] = erro if not processos else None
+        metrics.incrementar('tjsp_monitoramento_verificacoes_total', resultado='ok' if processos else 'erro')
+        if not processos:
+            self._salvar(oab, item)
+            return
+        item['total'] = len(processos)
+        if not processos.incompleto:
+            result_cache.save_resultado(oab, processos)
+        
+        # Já avisados desde a última base completa: consultas incompletas não repetem o mesmo aviso
+        avisados = item.get('avisados') or {}
+        mensagem = None
+        if anteriores is None and not avisados:
+            mensagem = f"🔔 **MONITORAMENTO - {oab}**\n📋 Base criada com {len(processos)} processos\n📬 Próximos avisos: só novidades"
+            avisados = {processo['id']: self._digest(processo) for processo in processos} if processos.incompleto else {}
+        else:
+            novos, alterados = self.diferencas({**(anteriores or {}), **avisados}, processos)
+            metrics.incrementar('tjsp_monitoramento_novidades_total', len(novos) + len(alterados))
+            if novos or alterados:
+                mensagem = self.formatar_novidades(oab, novos, alterados)
+            # Consulta completa vira a próxima base; incompleta acumula o que já foi avisado
+            avisados = {} if not processos.incompleto else {
+                **avisados, **{processo['id']: self._digest(processo) for processo in novos + alterados}
+            }
+        item['avisados'] = avisados
+        self._salvar(oab, item)
+        if mensagem is None:
+            return
+        
+        for assinante in list(item['assinantes'].values()):
+            try:
+                await bot.send_message(chat_id=assinante['chat_id'], text=mensagem)
+            except Exception as e:
+                print(f"⚠️ Erro ao avisar {assinante['username']} sobre a OAB {oab}: {e}")
+    
+    def formatar_novidades(self, oab, novos, alterados):
+        mensagem = (
+            f"🔔 **NOVIDADES - OAB {oab}**\n"
+            f"🆕 {len(novos)} novos | ✏️ {len(alterados)} alterados\n\n"
+        )
+        listados = [('🆕', processo) for processo in novos] + [('✏️', processo) for processo in alterados]
+        for marcador, processo in listados[:self.MAX_LISTADOS]:
+            mensagem += (
+                f"{marcador} **{processo['numero']}**\n"
+                f"   ⚖ {processo['classe']}\n"
+                f"   📅 {processo['data_movimentacao']}\n\n"
+            )
+        if len(listados) > self.MAX_LISTADOS:
+            mensagem += f"... e mais {len(listados) - self.MAX_LISTADOS}\n\n"
+        mensagem += f"💡 Envie `{oab}` para consultar e ver os detalhes"
+        return mensagem
+
+class MemoryGovernor:
+    """RSS do bot e dos processos filhos (Chromium, driver do Playwright, workers) e fila de admissão de scrapes"""
+    
+    VALIDADE_AMOSTRA = 2
+    INTERVALO_FILA = 2
+    
+    def __init__(self):
+        self.limite_mb = float(os.environ.get('MEMORIA_LIMITE_MB', '450'))
+        self.espera = float(os.environ.get('MEMORIA_FILA_SEGUNDOS', '120'))
+        # Sem /proc (fora do Linux) não há amostragem e nenhum scrape é barrado
+        self.disponivel = os.path.isdir('/proc')
+        self.pagina_bytes = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.aguardando = 0
+        self.recusados = 0
+        self._amostra = {'bot_mb': 0.0, 'filhos_mb': 0.0, 'total_mb': 0.0}
+        self._amostrado_em = 0
+    
+    def _ler_processos(self):
+        """{pid: (ppid, rss em bytes)} de todos os processos visíveis em /proc"""
+        processos = {}
+        for nome in os.listdir('/proc'):
+            if not nome.isdigit():
+                continue
+            try:
+                with open(f'/proc/{nome}/stat', 'rb') as f:
+                    dados = f.read()
+            except OSError:
+                continue
+            # O nome do processo (2º campo) pode ter espaços: os campos seguintes começam após o último ')'
+            campos = dados[dados.rindex(b')') + 2:].split()
+            processos[int(nome)] = (int(campos[1]), int(campos[21]) * self.pagina_bytes)
+        return processos
+    
+    def amostrar(self):
+        """RSS em MB deste processo e da soma dos descendentes (amostra reaproveitada por alguns segundos)"""
+        if not self.disponivel or time.monotonic() - self._amostrado_em < self.VALIDADE_AMOSTRA:
+            return self._amostra
+        try:
+            processos = self._ler_processos()
+        except Exception as e:
+            print(f"⚠️ Erro ao ler memória em /proc: {e}")
+            return self._amostra
+        
+        filhos_por_pai = {}
+        for pid, (ppid, _) in processos.items():
+            filhos_por_pai.setdefault(ppid, []).append(pid)
+        proprio = os.getpid()
+        filhos, pendentes = 0, list(filhos_por_pai.get(proprio, []))
+        while pendentes:
+            pid = pendentes.pop()
+            filhos += processos[pid][1]
+            pendentes.extend(filhos_por_pai.get(pid, []))
+        bot = processos.get(proprio, (0, 0))[1]
+        
+        self._amostra = {
+            'bot_mb': round(bot / 1048576, 1),
+            'filhos_mb': round(filhos / 1048576, 1),
+            'total_mb': round((bot + filhos) / 1048576, 1)
         }
-        return session_id
+        self._amostrado_em = time.monotonic()
+        return self._amostra
     
-    def get_session(self, username, chat_id):
-        """Obtém a sessão do usuário"""
-        session_id = f"{username}_{chat_id}"
-        session = self.user_sessions.get(session_id)
+    def invalidar(self):
+        """Descarta a amostra atual: a próxima leitura vai ao /proc (ex.: logo depois de reciclar o Chromium)"""
+        self._amostrado_em = 0
+    
+    def apertada(self):
+        """Memória total acima do limite de admissão"""
+        return self.disponivel and self.amostrar()['total_mb'] >= self.limite_mb
+    
+    async def aguardar(self, avisar=None):
+        """Fila de admissão: espera a memória baixar (reciclando o Chromium); False se não baixar a tempo"""
+        if not self.apertada():
+            return True
         
-        if session:
-            elapsed = (datetime.now() - session['created_at']).seconds
-            if elapsed > self.session_timeout:
-                self.clear_session(username, chat_id)
-                return None
-        return session
+        self.aguardando += 1
+        try:
+            if avisar:
+                await avisar(
+                    f"⏳ **Memória do servidor alta** ({self.amostrar()['total_mb']:.0f} MB)\n"
+                    f"Sua consulta está na fila e começa assim que houver memória livre"
+                )
+            limite = time.monotonic() + self.espera
+            while self.apertada():
+                if time.monotonic() >= limite:
+                    self.recusados += 1
+                    metrics.incrementar('tjsp_scrapes_recusados_memoria_total')
+                    return False
+                browser_pool.pedir_reciclagem('memoria')
+                await asyncio.sleep(self.INTERVALO_FILA)
+            return True
+        finally:
+            self.aguardando -= 1
     
-    def clear_session(self, username, chat_id):
-        """Limpa a sessão do usuário"""
-        session_id = f"{username}_{chat_id}"
-        if session_id in self.user_sessions:
-            del self.user_sessions[session_id]
+    def mensagem_recusa(self):
+        return (
+            f"🚫 **Servidor sem memória livre** ({self.amostrar()['total_mb']:.0f} MB de {self.limite_mb:.0f} MB)\n"
+            f"⏳ Tente novamente em alguns minutos"
+        )
     
-    def get_user_sessions(self, username):
-        """Obtém todas as sessões de um usuário"""
-        return {k: v for k, v in self.user_sessions.items() if k.startswith(f"{username}_")}
+    def resumo(self):
+        """Memória e estado do navegador para o /health"""
+        return dict(
+            self.amostrar(),
+            disponivel=self.disponivel,
+            limite_mb=self.limite_mb,
+            aguardando=self.aguardando,
+            recusados=self.recusados,
+            navegador=browser_pool.resumo()
+        )
 
-class TJSPScrapingService:
+class EsajRateLimiter:
+    """Token bucket das navegações deste processo ao ESAJ, com taxa adaptativa (AIMD) e circuit breaker"""
+    
+    # Páginas de bloqueio/captcha do ESAJ (só verificadas quando a página não trouxe o conteúdo esperado)
+    BLOQUEIO = re.compile(r'captcha|acesso negado|too many requests|requisi[çc][õo]es excessivas', re.I)
+    PAUSA_MAXIMA = 600
+    
+    def __init__(self):
+        # O limite é por processo: com workers cada um tem o seu bucket e a taxa configurada é dividida entre eles;
+        # réplicas não dividem nada entre si (N réplicas = N x ESAJ_TAXA)
+        processos = max(1, int(os.environ.get('SCRAPE_WORKERS', '0')))
+        self.taxa_maxima = float(os.environ.get('ESAJ_TAXA', '2')) / processos
+        self.taxa_minima = min(float(os.environ.get('ESAJ_TAXA_MIN', '0.2')) / processos, self.taxa_maxima)
+        self.rajada = max(1.0, float(os.environ.get('ESAJ_RAJADA', '4')))
+        self.latencia_alvo = float(os.environ.get('ESAJ_LATENCIA_ALVO', '5'))
+        self.limiar_falhas = int(os.environ.get('ESAJ_CIRCUITO_FALHAS', '5'))
+        self.pausa_base = float(os.environ.get('ESAJ_CIRCUITO_SEGUNDOS', '60'))
+        self.ativo = self.taxa_maxima > 0
+        
+        self.taxa = self.taxa_maxima
+        self.tokens = self.rajada
+        self.reposto_em = time.monotonic()
+        self.falhas_seguidas = 0
+        self.aberto_ate = None
+        self.pausa = self.pausa_base
+        self.sondando = False
+        self.aguardando = 0
+    
+    @property
+    def estado(self):
+        """'fechado' (normal), 'aberto' (pausado) ou 'meio_aberto' (uma requisição de teste liberada)"""
+        if self.aberto_ate is None:
+            return 'fechado'
+        return 'aberto' if time.monotonic() < self.aberto_ate else 'meio_aberto'
+    
+    def _repor(self):
+        agora = time.monotonic()
+        self.tokens = min(self.rajada, self.tokens + (agora - self.reposto_em) * self.taxa)
+        self.reposto_em = agora
+    
+    async def adquirir(self, tipo):
+        """Espera um token (e o circuito fechar); devolve se esta é a requisição de teste do meio-aberto"""
+        if not self.ativo:
+            return False
+        inicio = time.monotonic()
+        self.aguardando += 1
+        try:
+            while True:
+                estado = self.estado
+                if estado == 'aberto':
+                    await asyncio.sleep(self.aberto_ate - time.monotonic())
+                    continue
+                if estado == 'meio_aberto':
+                    if self.sondando:
+                        await asyncio.sleep(1)
+                        continue
+                    self.sondando = True
+                    return True
+                
+                self._repor()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return False
+                await asyncio.sleep((1 - self.tokens) / self.taxa)
+        finally:
+            self.aguardando -= 1
+            metrics.observar('tjsp_esaj_espera_segundos', time.monotonic() - inicio, tipo=tipo)
+    
+    def registrar(self, tipo, latencia, erro=False, sonda=False):
+        """Ajusta a taxa pela resposta: sobe devagar quando rápida, cai pela metade em erro/bloqueio"""
+        if sonda:
+            self.sondando = False
+        if latencia is not None:
+            metrics.observar('tjsp_esaj_latencia_segundos', latencia, tipo=tipo)
+        if not self.ativo:
+            return
+        
+        if erro:
+            metrics.incrementar('tjsp_esaj_erros_total', tipo=tipo)
+            self.taxa = max(self.taxa_minima, self.taxa * 0.5)
+            self.falhas_seguidas += 1
+            if sonda or (self.aberto_ate is None and self.falhas_seguidas >= self.limiar_falhas):
+                self._abrir()
+            return
+        
+        self.falhas_seguidas = 0
+        if self.aberto_ate is not None:
+            print(f"✅ ESAJ respondendo de novo - circuito fechado ({self.taxa:.2f} req/s)")
+            self.aberto_ate = None
+            self.pausa = self.pausa_base
+        if latencia is not None and latencia > self.latencia_alvo:
+            self.taxa = max(self.taxa_minima, self.taxa * 0.85)
+        else:
+            self.taxa = min(self.taxa_maxima, self.taxa + self.taxa_maxima * 0.05)
+    
+    def _abrir(self):
+        # Pausa dobra a cada reabertura seguida (até PAUSA_MAXIMA)
+        if self.aberto_ate is not None:
+            self.pausa = min(self.PAUSA_MAXIMA, self.pausa * 2)
+        self.aberto_ate = time.monotonic() + self.pausa
+        self.tokens = 0
+        metrics.incrementar('tjsp_esaj_circuito_aberturas_total')
+        print(f"🚧 ESAJ degradado ({self.falhas_seguidas} falhas seguidas) - requisições pausadas por {self.pausa:.0f}s")
+    
+    def sinalizar_bloqueio(self, tipo, html):
+        """Conta como erro uma página de captcha/bloqueio percebida só na leitura do conteúdo"""
+        if html and self.BLOQUEIO.search(html):
+            self.registrar(tipo, None, erro=True)
+            return True
+        return False
+    
+    @staticmethod
+    def resposta_com_erro(resposta):
+        """Status de servidor sobrecarregado ou de bloqueio"""
+        return resposta is not None and (resposta.status >= 500 or resposta.status in (403, 429))
+    
+    @contextlib.asynccontextmanager
+    async def requisicao(self, tipo):
+        """Aguarda a vez, mede a latência e registra o resultado ao sair do bloco"""
+        # medicao['erro'] marca erros sem exceção (status, bloqueio); medicao['descontar'] tira esperas fixas;
+        # medicao['espera'] é o tempo na fila do limitador, para as fases do scraping não contarem com ele
+        inicio_espera = time.monotonic()
+        sonda = await self.adquirir(tipo)
+        medicao = {'erro': False, 'descontar': 0, 'espera': time.monotonic() - inicio_espera}
+        inicio = time.monotonic()
+        
+        def latencia():
+            return max(0.0, time.monotonic() - inicio - medicao['descontar'])
+        
+        try:
+            yield medicao
+        except Exception:
+            self.registrar(tipo, latencia(), erro=True, sonda=sonda)
+            raise
+        except BaseException:
+            # Cancelada no meio: libera a vez de teste sem julgar o ESAJ
+            if sonda:
+                self.sondando = False
+            raise
+        else:
+            self.registrar(tipo, latencia(), erro=medicao['erro'], sonda=sonda)
+    
+    def resumo(self):
+        return {
+            'taxa_req_s': round(self.taxa, 3),
+            'taxa_maxima_req_s': round(self.taxa_maxima, 3),
+            'circuito': self.estado,
+            'falhas_seguidas': self.falhas_seguidas,
+            'aguardando': self.aguardando
+        }
+
+class BrowserPool:
+    """Chromium compartilhado pelo processo: um navegador vivo e um contexto novo por consulta"""
+    
+    LAUNCH_ARGS = [
+        '--no-sandbox',
+        '--disable-dev-shm-usage',
+        '--disable-gpu',
+        '--no-first-run',
+        '--no-zygote',
+        '--single-process'
+    ]
+    
     def __init__(self):
+        self._playwright = None
+        self._browser = None
+        self._lock = None
+        # Reciclagem: navegador reiniciado após N páginas ou acima de um RSS, quando não há contextos em uso
+        self.max_paginas = int(os.environ.get('BROWSER_MAX_PAGINAS', '200'))
+        self.reciclar_mb = float(os.environ.get('BROWSER_RECICLAR_MB', '250'))
+        self.paginas = 0
+        self.contextos_ativos = 0
+        self.reciclagens = 0
+        self.reciclagem_pendente = None
+    
+    @property
+    def aquecido(self):
+        """Navegador já iniciado e conectado"""
+        return self._browser is not None and self._browser.is_connected()
+    
+    async def obter_browser(self):
+        """Inicia o Chromium na primeira chamada (ou se ele caiu)"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        
+        async with self._lock:
+            if not self.aquecido:
+                if self._playwright is None:
+                    from playwright.async_api import async_playwright
+                    self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(
+                    headless=True,
+                    timeout=120000,
+                    args=self.LAUNCH_ARGS
+                )
+                print("🌐 Chromium iniciado")
+            return self._browser
+    
+    @contextlib.asynccontextmanager
+    async def contexto(self, **kwargs):
+        """Contexto isolado (cookies/sessão próprios) fechado ao sair"""
+        # Contado antes de obter o navegador para a reciclagem não fechá-lo no meio da abertura
+        self.contextos_ativos += 1
+        try:
+            with tracer.span('browser.contexto', aquecido=self.aquecido):
+                browser = await self.obter_browser()
+                context = await browser.new_context(**kwargs)
+            context.on('page', self._pagina_aberta)
+            try:
+                yield context
+            finally:
+                try:
+                    await context.close()
+                except Exception as e:
+                    print(f"⚠️ Erro ao fechar contexto: {e}")
+        finally:
+            self.contextos_ativos -= 1
+            if not self.contextos_ativos and self._motivo_reciclagem():
+                await self.reciclar()
+    
+    def _pagina_aberta(self, page):
+        self.paginas += 1
+        if self.max_paginas and self.paginas >= self.max_paginas:
+            self.reciclagem_pendente = self.reciclagem_pendente or 'paginas'
+    
+    def _motivo_reciclagem(self):
+        """Por que reciclar o navegador agora (None se não for preciso)"""
+        if not self.aquecido:
+            return None
+        if self.reciclagem_pendente:
+            return self.reciclagem_pendente
+        if self.reciclar_mb and memory_governor.amostrar()['filhos_mb'] >= self.reciclar_mb:
+            return 'memoria'
+        return None
+    
+    def pedir_reciclagem(self, motivo):
+        """Recicla assim que não houver contextos em uso (imediatamente se ocioso)"""
+        if not self.aquecido:
+            return
+        self.reciclagem_pendente = self.reciclagem_pendente or motivo
+        if not self.contextos_ativos:
+            asyncio.ensure_future(self.reciclar())
+    
+    async def reciclar(self):
+        """Fecha o Chromium ocioso para devolver a memória; o próximo contexto sobe um navegador novo"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            motivo = self._motivo_reciclagem()
+            if self.contextos_ativos or not motivo:
+                return
+            paginas, antes = self.paginas, memory_governor.amostrar()['filhos_mb']
+            await self.fechar()
+            memory_governor.invalidar()
+            self.reciclagens += 1
+            metrics.incrementar('tjsp_browser_reciclagens_total', motivo=motivo)
+            print(f"♻️ Chromium reciclado ({motivo}: {paginas} páginas, {antes:.0f} MB)")
+    
+    def resumo(self):
+        return {
+            'aquecido': self.aquecido,
+            'paginas': self.paginas,
+            'contextos_ativos': self.contextos_ativos,
+            'reciclagens': self.reciclagens
+        }
+    
+    async def aquecer(self):
+        """Sobe o Chromium antecipadamente"""
+        try:
+            with inicializacao.fase('chromium'):
+                await self.obter_browser()
+        except Exception as e:
+            print(f"❌ Erro ao iniciar Chromium: {e}")
+    
+    async def fechar(self):
+        """Fecha o navegador e o Playwright"""
+        try:
+            if self._browser is not None:
+                await self._browser.close()
+            if self._playwright is not None:
+                await self._playwright.stop()
+        except Exception as e:
+            print(f"⚠️ Erro ao fechar Chromium: {e}")
+        self._browser = None
+        self._playwright = None
+        self.paginas = 0
+        self.reciclagem_pendente = None
+
+class TJSPScrapingService:
+    MAX_PAGINAS = int(os.environ.get('MAX_PAGINAS', '0'))
+    PAGINA_TENTATIVAS = int(os.environ.get('PAGINA_TENTATIVAS', '3'))
+    MAX_RETOMADAS = int(os.environ.get('MAX_RETOMADAS', '2'))
+    PAGINA_BACKOFF = float(os.environ.get('PAGINA_BACKOFF', '2'))
+    DETALHES_CONCORRENCIA = int(os.environ.get('DETALHES_CONCORRENCIA', '4'))
+    CONTEXTO_DETALHES = {
+        'viewport': {'width': 1920, 'height': 1080},
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
+    
+    def __init__(self, base_url=None):
         self.cache_manager = CacheManager()
+        self.checkpoints = ScrapeCheckpoints()
+        self.snapshots = SnapshotStore()
+        self.paginas_detalhes = DetailFingerprints()
+        # Nos workers cada página vai para o bot, que guarda o resultado: sem store, transbordo nem snapshot no worker
+        self.guardar_resultado = True
+        # ESAJ_BASE_URL aponta o scraping para um ESAJ local (tools/mock_esaj.py)
+        self.base_url = (base_url or os.environ.get('ESAJ_BASE_URL') or 'https://esaj.tjsp.jus.br').rstrip('/')
     
     def _gerar_id_processo(self, numero_processo, oab):
         """Gera ID único para o processo"""
         hash_input = f"{numero_processo}_{oab}"
         return hashlib.md5(hash_input.encode()).hexdigest()[:10]
     
-    async def consultar_por_oab(self, oab: str, update: Update = None):
-        """Consulta TODOS os processos por OAB com timeouts aumentados"""
+    @rastrear('consultar_por_oab')
+    async def consultar_por_oab(self, oab: str, update: Update = None, ao_processar_pagina=None, job=None, notificar=None, retomar=True):
+        """Consulta TODOS os processos por OAB, com retentativas por página e retomada a partir do checkpoint"""
+        tracer.anotar(oab=oab)
+        if notificar is None and update:
+            notificar = update.message.reply_text
+        
         try:
-            if update:
-                await update.message.reply_text("🔍 **Acessando o TJSP...**")
+            if notificar:
+                await notificar("🔍 **Acessando o TJSP...**")
             
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(
-                    headless=True,
-                    timeout=120000,
-                    args=[
-                        '--no-sandbox',
-                        '--disable-dev-shm-usage',
-                        '--disable-gpu',
-                        '--no-first-run',
-                        '--no-zygote',
-                        '--single-process'
-                    ]
-                )
-                context = await browser.new_context(
+            estado = {'oab': oab, 'processos': ProcessoStore() if self.guardar_resultado else WorkerResultado(), 'ids': set(), 'total_paginas': None, 'pagina': 1, 'paginas_lidas': 0}
+            checkpoint = self.checkpoints.carregar(oab) if retomar else None
+            if checkpoint:
+                await self._restaurar_checkpoint(estado, checkpoint, ao_processar_pagina)
+                estado['pagina'] = checkpoint['pagina'] + 1
+                estado['total_paginas'] = checkpoint['total_paginas']
+                if notificar:
+                    await notificar(
+                        f"♻️ **Retomando da página {estado['pagina']}**\n"
+                        f"📋 {len(estado['processos'])} processos já coletados"
+                    )
+            
+            falha = None
+            for sessao in range(self.MAX_RETOMADAS + 1):
+                if sessao:
+                    metrics.incrementar('tjsp_retomadas_total')
+                    await asyncio.sleep(self._backoff(sessao))
+                    if notificar:
+                        await notificar(f"🔁 **Retomando da página {estado['pagina']}** em uma nova sessão ({sessao}/{self.MAX_RETOMADAS})")
+                
+                # Cada sessão usa um contexto novo (cookies limpos); o Chromium continua no pool
+                async with browser_pool.contexto(
                     viewport={'width': 1920, 'height': 1080},
                     user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                )
-                page = await context.new_page()
-                
-                page.set_default_timeout(60000)
-                page.set_default_navigation_timeout(60000)
-                
-                try:
-                    await page.goto("https://esaj.tjsp.jus.br/cpopg/open.do", 
-                                  wait_until="networkidle", 
-                                  timeout=60000)
-                except Exception as e:
-                    if update:
-                        await update.message.reply_text("❌ **Erro ao carregar página inicial do TJSP**")
-                    await browser.close()
-                    return [], f"❌ Erro ao acessar TJSP: {str(e)}"
-                
-                if update:
-                    await update.message.reply_text("✅ **Site carregado**\n📝 Consultando TODOS os processos...")
-                
-                try:
-                    await page.select_option('select[name="cbPesquisa"]', "NUMOAB", timeout=30000)
-                    await page.wait_for_selector('#campo_NUMOAB:not([disabled])', timeout=30000)
-                    await page.fill('#campo_NUMOAB', '')
-                    await page.type('#campo_NUMOAB', oab, delay=100)
-                    await page.click('#botaoConsultarProcessos')
-                except Exception as e:
-                    if update:
-                        await update.message.reply_text("❌ **Erro ao preencher formulário**")
-                    await browser.close()
-                    return [], f"❌ Erro no formulário: {str(e)}"
-                
-                if update:
-                    await update.message.reply_text("🔄 **Buscando TODOS os processos...**\n⏳ Isso pode demorar vários minutos...")
-                
-                try:
-                    await page.wait_for_load_state("networkidle", timeout=60000)
-                    await asyncio.sleep(5)
-                except:
-                    pass
-                
-                todos_processos = []
-                pagina_atual = 1
-                total_processos = 0
-                max_paginas = 50
-                
-                while pagina_atual <= max_paginas:
-                    try:
-                        if update and pagina_atual % 10 == 1:
-                            await update.message.reply_text(f"📄 **Processando página {pagina_atual}**")
-                        
-                        try:
-                            html = await page.content()
-                        except:
-                            html = ""
-                        
-                        processos_pagina = self._parse_processos_pagina(html, oab)
-                        todos_processos.extend(processos_pagina)
-                        
-                        if len(processos_pagina) > 0:
-                            total_processos += len(processos_pagina)
-                            if update and pagina_atual % 5 == 0:
-                                await update.message.reply_text(f"✅ **{total_processos} processos indexados**")
-                        
-                        try:
-                            next_button = await page.query_selector('.unj-pagination__next:not(.disabled)')
-                            if not next_button:
-                                if update:
-                                    await update.message.reply_text(f"🏁 **Consulta finalizada!**\n📋 Total: {total_processos} processos")
-                                break
-                            
-                            await next_button.click()
-                            await asyncio.sleep(3)
-                            
-                            try:
-                                await page.wait_for_load_state("networkidle", timeout=30000)
-                            except:
-                                pass
-                                
-                        except Exception as e:
-                            print(f"⚠️ Erro ao mudar de página: {e}")
-                            break
-                            
-                        pagina_atual += 1
-                        
-                    except Exception as e:
-                        print(f"⚠️ Erro na página {pagina_atual}: {e}")
-                        break
-                
-                await browser.close()
-                
-                if not todos_processos:
-                    return [], "❌ Nenhum processo encontrado"
-                
-                self._salvar_processos_json(todos_processos, oab)
-                
-                if update:
-                    await update.message.reply_text(f"🎉 **CONSULTA COMPLETA!**\n📋 {len(todos_processos)} processos indexados")
+                ) as context:
+                    page = await context.new_page()
+                    
+                    page.set_default_timeout(60000)
+                    page.set_default_navigation_timeout(60000)
+                    
+                    falha = await self._abrir_consulta(page, oab, notificar if sessao == 0 else None)
+                    if falha is None and estado['pagina'] > 1:
+                        falha = await self._ir_para_pagina(page, estado['pagina'])
+                    if falha is None:
+                        falha = await self._percorrer_paginas(page, oab, estado, ao_processar_pagina, job, notificar)
                 
-                return todos_processos, None
+                if falha is None:
+                    break
+                print(f"⚠️ Consulta {oab} interrompida na página {estado['pagina']}: {falha}")
+            
+            todos_processos = estado['processos']
+            metrics.observar('tjsp_paginas_por_oab', estado['paginas_lidas'])
+            metrics.observar('tjsp_processos_indexados', len(todos_processos))
+            
+            if not todos_processos:
+                self.checkpoints.limpar(oab)
+                if falha:
+                    if notificar:
+                        await notificar("❌ **Erro ao consultar o TJSP**")
+                    return [], falha
+                return [], "❌ Nenhum processo encontrado"
+            
+            if falha:
+                # O checkpoint fica guardado: enviar a mesma OAB de novo continua desta página
+                todos_processos.incompleto = True
+                todos_processos.pagina_falha = estado['pagina']
+                metrics.incrementar('tjsp_consultas_incompletas_total')
+                if notificar:
+                    await notificar(
+                        f"⚠️ **CONSULTA INCOMPLETA**\n"
+                        f"📋 {len(todos_processos)} processos até a página {estado['pagina'] - 1}\n"
+                        f"🔁 Envie a OAB novamente para retomar da página {estado['pagina']}"
+                    )
+            else:
+                self.checkpoints.limpar(oab)
+            
+            if self.guardar_resultado:
+                await asyncio.get_running_loop().run_in_executor(None, self._salvar_snapshot, todos_processos, oab)
+            return todos_processos, None
                 
         except Exception as e:
             error_msg = f"❌ Erro na consulta: {str(e)}"
-            if update:
-                await update.message.reply_text(error_msg)
+            if notificar:
+                await notificar(error_msg)
             return [], error_msg
+    
+    def _backoff(self, tentativa):
+        """Espera exponencial com jitter entre tentativas (2s, 4s, 8s... até 30s)"""
+        return min(30, self.PAGINA_BACKOFF * 2 ** (tentativa - 1)) * random.uniform(0.8, 1.2)
+    
+    async def _novos(self, estado, processos):
+        """Processos da lista que ainda não foram coletados (consulta ao SQLite fora do event loop)"""
+        if isinstance(estado['processos'], ProcessoArquivo):
+            return await asyncio.to_thread(estado['processos'].novos, processos)
+        return [processo for processo in processos if processo['id'] not in estado['ids']]
+    
+    async def _registrar_processos(self, estado, processos, ao_processar_pagina=None):
+        """Adiciona ao resultado só os processos ainda não coletados; devolve os novos"""
+        novos = await self._novos(estado, processos)
+        if isinstance(estado['processos'], ProcessoArquivo):
+            await asyncio.to_thread(estado['processos'].extend, novos)
+        else:
+            estado['processos'].extend(novos)
+            estado['ids'].update(processo['id'] for processo in novos)
+            if self.guardar_resultado and ProcessoArquivo.precisa_disco(estado['processos']):
+                estado['processos'] = await asyncio.to_thread(
+                    ProcessoArquivo.transbordar, estado['processos'], estado['oab']
+                )
+            if isinstance(estado['processos'], ProcessoArquivo):
+                # Daqui em diante a deduplicação é feita no próprio arquivo
+                estado['ids'] = set()
+        if ao_processar_pagina and novos:
+            ao_processar_pagina(novos)
+        return novos
+    
+    async def _restaurar_checkpoint(self, estado, checkpoint, ao_processar_pagina=None):
+        """Continua a coleta do checkpoint; um arquivo em disco é reaproveitado sem copiar"""
+        processos = checkpoint['processos']
+        if not isinstance(processos, ProcessoArquivo) or not self.guardar_resultado:
+            await self._registrar_processos(estado, processos, ao_processar_pagina)
+            return
+        
+        estado['processos'] = processos
+        if ao_processar_pagina:
+            for inicio in range(0, len(processos), ProcessoArquivo.LOTE):
+                ao_processar_pagina(await asyncio.to_thread(list, processos[inicio:inicio + ProcessoArquivo.LOTE]))
+    
+    async def _abrir_consulta(self, page, oab, notificar=None):
+        """Abre o cpopg e pesquisa a OAB; devolve a mensagem de erro ou None"""
+        try:
+            with tracer.span('esaj.landing'):
+                async with esaj_limiter.requisicao('landing') as requisicao:
+                    with metrics.cronometrar('tjsp_scrape_fase_segundos', fase='landing'):
+                        resposta = await page.goto(f"{self.base_url}/cpopg/open.do", 
+                                                   wait_until="networkidle", 
+                                                   timeout=60000)
+                    requisicao['erro'] = esaj_limiter.resposta_com_erro(resposta)
+        except Exception as e:
+            return f"❌ Erro ao acessar TJSP: {str(e)}"
+        
+        if notificar:
+            await notificar("✅ **Site carregado**\n📝 Consultando TODOS os processos...")
+        
+        inicio_form = time.monotonic()
+        try:
+            await page.select_option('select[name="cbPesquisa"]', "NUMOAB", timeout=30000)
+            await page.wait_for_selector('#campo_NUMOAB:not([disabled])', timeout=30000)
+            await page.fill('#campo_NUMOAB', '')
+            await page.type('#campo_NUMOAB', oab, delay=100)
+        except Exception as e:
+            return f"❌ Erro no formulário: {str(e)}"
+        
+        if notificar:
+            await notificar("🔄 **Buscando TODOS os processos...**\n⏳ Isso pode demorar vários minutos...")
+        
+        try:
+            async with esaj_limiter.requisicao('pesquisa') as requisicao:
+                espera = requisicao['espera']
+                await page.click('#botaoConsultarProcessos')
+                with contextlib.suppress(Exception):
+                    await page.wait_for_load_state("networkidle", timeout=60000)
+        except Exception as e:
+            return f"❌ Erro no formulário: {str(e)}"
+        await asyncio.sleep(5)
+        metrics.observar('tjsp_scrape_fase_segundos', time.monotonic() - inicio_form - espera, fase='form')
+        tracer.registrar('esaj.form', inicio_form)
+        return None
+    
+    async def _ir_para_pagina(self, page, pagina, fase=None):
+        """Abre diretamente uma página de resultados da pesquisa atual (retentativas e retomadas)"""
+        try:
+            async with esaj_limiter.requisicao('pagina') as requisicao:
+                if fase is not None:
+                    fase['descontar'] += requisicao['espera']
+                resposta = await page.goto(f"{self.base_url}/cpopg/trocarPagina.do?paginaConsulta={pagina}",
+                                           wait_until="networkidle", timeout=60000)
+                requisicao['erro'] = esaj_limiter.resposta_com_erro(resposta)
+            return None
+        except Exception as e:
+            return f"❌ Erro ao abrir a página {pagina}: {str(e)}"
+    
+    async def _ler_pagina(self, page, oab, estado):
+        """Lê a página aberta; devolve (processos, erro). Erro quando ela veio vazia ou repetida"""
+        pagina = estado['pagina']
+        try:
+            html = await page.content()
+        except Exception as e:
+            return None, f"❌ Erro ao ler a página {pagina}: {str(e)}"
+        
+        if estado['total_paginas'] is None:
+            estado['total_paginas'] = self._extrair_total_paginas(html)
+        
+        processos_pagina = self._parse_processos_pagina(html, oab)
+        if not processos_pagina:
+            if esaj_limiter.sinalizar_bloqueio('pagina', html):
+                return None, f"❌ Página {pagina} bloqueada pelo ESAJ (captcha/limite de acesso)"
+            # Página vazia só é válida como primeira página de uma OAB sem processos
+            if pagina == 1 and not estado['total_paginas']:
+                return [], None
+            return None, f"❌ Página {pagina} veio sem processos"
+        
+        if not await self._novos(estado, processos_pagina):
+            return None, f"❌ Página {pagina} repetiu a página anterior"
+        return processos_pagina, None
+    
+    async def _localizar_proxima(self, page, pagina, fase):
+        """Botão da próxima página (None na última); se não for possível localizá-lo, reabre a mesma página e tenta de novo"""
+        erro = None
+        for tentativa in range(self.PAGINA_TENTATIVAS):
+            if tentativa:
+                metrics.incrementar('tjsp_pagina_retentativas_total')
+                print(f"⚠️ {erro} - tentativa {tentativa + 1}/{self.PAGINA_TENTATIVAS}")
+                await asyncio.sleep(self._backoff(tentativa))
+                erro = await self._ir_para_pagina(page, pagina, fase)
+                if erro:
+                    continue
+            try:
+                return await page.query_selector('.unj-pagination__next:not(.disabled)'), None
+            except Exception as e:
+                erro = f"❌ Erro ao localizar a página seguinte à {pagina}: {str(e)}"
+        return None, erro
+    
+    async def _percorrer_paginas(self, page, oab, estado, ao_processar_pagina=None, job=None, notificar=None):
+        """Processa da página estado['pagina'] em diante; devolve None ao terminar ou o erro da página que falhou"""
+        while not self.MAX_PAGINAS or estado['pagina'] <= self.MAX_PAGINAS:
+            pagina = estado['pagina']
+            inicio_pagina = time.monotonic()
+            fase = {'descontar': 0}
+            if notificar and pagina % 10 == 1:
+                await notificar(f"📄 **Processando página {pagina}**")
+            
+            processos_pagina, erro = await self._ler_pagina(page, oab, estado)
+            for tentativa in range(1, self.PAGINA_TENTATIVAS):
+                if processos_pagina is not None:
+                    break
+                metrics.incrementar('tjsp_pagina_retentativas_total')
+                print(f"⚠️ {erro} - tentativa {tentativa + 1}/{self.PAGINA_TENTATIVAS}")
+                await asyncio.sleep(self._backoff(tentativa))
+                erro = await self._ir_para_pagina(page, pagina, fase)
+                if erro is None:
+                    processos_pagina, erro = await self._ler_pagina(page, oab, estado)
+            
+            if processos_pagina is None:
+                return erro
+            
+            novos = await self._registrar_processos(estado, processos_pagina, ao_processar_pagina)
+            estado['paginas_lidas'] += 1
+            total_processos = len(estado['processos'])
+            if processos_pagina and notificar and pagina % 5 == 0:
+                await notificar(f"✅ **{total_processos} processos indexados**")
+            
+            if job:
+                job.atualizar_progresso(pagina, estado['total_paginas'], total_processos)
+            if processos_pagina:
+                self.checkpoints.salvar(oab, pagina, estado['total_paginas'], estado['processos'], novos)
+            
+            next_button, erro = await self._localizar_proxima(page, pagina, fase)
+            if erro:
+                # A página já foi lida e está no checkpoint: a retomada começa pela seguinte
+                estado['pagina'] += 1
+                return erro
+            
+            metrics.observar('tjsp_scrape_fase_segundos', time.monotonic() - inicio_pagina - fase['descontar'], fase='pagina')
+            tracer.registrar('esaj.pagina', inicio_pagina, pagina=pagina, processos=len(processos_pagina))
+            
+            if not next_button:
+                if notificar:
+                    await notificar(f"🏁 **Consulta finalizada!**\n📋 Total: {total_processos} processos")
+                return None
+            
+            try:
+                async with esaj_limiter.requisicao('pagina') as requisicao:
+                    await next_button.click()
+                    await asyncio.sleep(3)
+                    requisicao['descontar'] = 3
+                    
+                    try:
+                        await page.wait_for_load_state("networkidle", timeout=30000)
+                    except Exception:
+                        pass
+            except Exception as e:
+                # Sem o clique, abre a próxima página pelo endereço; se falhar, a leitura cai na retentativa
+                print(f"⚠️ Erro ao mudar de página: {e}")
+                await self._ir_para_pagina(page, pagina + 1)
+            
+            estado['pagina'] += 1
+        
+        return None
 
     def _parse_processos_pagina(self, html_content, oab):
         """Parseia processos de uma página"""
@@ -544,18 +3704,20 @@ class TJSPScrapingService:
         if not html_content:
             return processos
             
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(html_content, 'html.parser')
         
         links_processos = soup.find_all('a', class_='linkProcesso')
+        links_cache = []
         
         for link in links_processos:
             try:
                 numero_processo = link.get_text(strip=True)
                 href = link.get('href', '')
-                link_completo = f"https://esaj.tjsp.jus.br{href}" if href.startswith('/') else href
+                link_completo = f"{self.base_url}{href}" if href.startswith('/') else href
                 
                 processo_id = self._gerar_id_processo(numero_processo, oab)
-                self.cache_manager.save_link(processo_id, numero_processo, link_completo)
+                links_cache.append((processo_id, numero_processo, link_completo))
                 
                 ano_processo = self._extrair_ano_processo(numero_processo)
                 
@@ -591,37 +3753,30 @@ class TJSPScrapingService:
                 print(f"⚠️ Erro ao processar link: {e}")
                 continue
         
+        if links_cache:
+            self.cache_manager.save_links(links_cache)
+        
         return processos
 
-    def _salvar_processos_json(self, processos, oab):
-        """Salva TODOS os processos em arquivo JSON"""
+    def _extrair_total_paginas(self, html_content, por_pagina=25):
+        """Estima o total de páginas pelo contador de resultados do ESAJ"""
+        if not html_content:
+            return None
+        from bs4 import BeautifulSoup
+        texto = BeautifulSoup(html_content, 'html.parser').get_text(" ", strip=True)
+        match = (re.search(r'Resultados\s+[\d\.]+\s+a\s+[\d\.]+\s+de\s+([\d\.]+)', texto) or
+                 re.search(r'([\d\.]+)\s+Processos?\s+encontrados?', texto, re.IGNORECASE))
+        if not match:
+            return None
+        total = int(match.group(1).replace('.', ''))
+        return max(1, -(-total // por_pagina))
+
+    def _salvar_snapshot(self, processos, oab):
+        """Salva TODOS os processos no snapshot da OAB (processos/*.jsonl.gz)"""
         try:
-            if not os.path.exists('processos'):
-                os.makedirs('processos')
-            
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            nome_arquivo = f"processos/processos_{oab}_{timestamp}.json"
-            
-            dados = {
-                'oab': oab,
-                'data_consulta': datetime.now().isoformat(),
-                'total_processos': len(processos),
-                'processos_por_ano': {}
-            }
-            
-            for processo in processos:
-                ano = processo['ano']
-                if ano not in dados['processos_por_ano']:
-                    dados['processos_por_ano'][ano] = []
-                dados['processos_por_ano'][ano].append(processo)
-            
-            with open(nome_arquivo, 'w', encoding='utf-8') as f:
-                json.dump(dados, f, ensure_ascii=False, indent=2)
-            
-            return nome_arquivo
-            
+            return self.snapshots.salvar(oab, processos, incompleto=processos.incompleto)
         except Exception as e:
-            print(f"❌ Erro ao salvar arquivo JSON: {e}")
+            print(f"❌ Erro ao salvar snapshot: {e}")
             return None
 
     def _extrair_ano_processo(self, numero_processo):
@@ -657,12 +3812,13 @@ class TJSPScrapingService:
         
         return mensagem
 
-    def formatar_todos_processos(self, processos):
+    def formatar_todos_processos(self, processos, processos_por_ano=None):
         """Formata todos os processos agrupados por ano"""
         if not processos:
             return "❌ Nenhum processo encontrado"
         
-        processos_por_ano = self.agrupar_por_ano(processos)
+        if processos_por_ano is None:
+            processos_por_ano = self.agrupar_por_ano(processos)
         
         mensagem = "📋 **TODOS OS PROCESSOS**\n\n"
         
@@ -684,16 +3840,17 @@ class TJSPScrapingService:
             
             mensagem += "─" * 40 + "\n\n"
         
-        mensagem += "💡 Use `/nums` para ver apenas números ou `/2024` para um ano específico"
+        mensagem += "💡 Use `/nums` para ver apenas números, `/2024` para um ano específico ou `/exportar` para a lista completa em arquivo"
         
         return mensagem
 
-    def formatar_apenas_numeros(self, processos):
+    def formatar_apenas_numeros(self, processos, processos_por_ano=None):
         """Formata apenas números com comandos"""
         if not processos:
             return "❌ Nenhum processo encontrado"
         
-        processos_por_ano = self.agrupar_por_ano(processos)
+        if processos_por_ano is None:
+            processos_por_ano = self.agrupar_por_ano(processos)
         anos_ordenados = sorted(processos_por_ano.keys(), reverse=True)
         
         mensagem = "🔢 **NÚMEROS DOS PROCESSOS**\n\n"
@@ -726,7 +3883,8 @@ class TJSPScrapingService:
             return numero
         return "❌ ID não encontrado no cache. Execute uma nova consulta."
 
-    async def obter_detalhes_processo(self, processo_id, update: Update = None):
+    @rastrear('obter_detalhes_processo')
+    async def obter_detalhes_processo(self, processo_id, update: Update = None, workers=None):
         """Obtém detalhes COMPLETOS do processo com análise profunda de CPF"""
         try:
             link = self.obter_link_por_id(processo_id)
@@ -736,57 +3894,172 @@ class TJSPScrapingService:
             if update:
                 await update.message.reply_text("🔍 **Acessando detalhes COMPLETOS do processo...**\n🔎 **Análise profunda de CPF/CNPJ ativada**")
             
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(
-                    headless=True,
-                    timeout=120000,
-                    args=[
-                        '--no-sandbox',
-                        '--disable-dev-shm-usage',
-                        '--disable-gpu',
-                        '--no-first-run',
-                        '--no-zygote',
-                        '--single-process'
-                    ]
-                )
-                context = await browser.new_context(
-                    viewport={'width': 1920, 'height': 1080},
-                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                )
-                page = await context.new_page()
+            if workers and workers.ativo:
+                return await workers.obter_detalhes_por_link(link)
+            return await self.obter_detalhes_por_link(link)
                 
-                page.set_default_timeout(45000)
-                page.set_default_navigation_timeout(45000)
+        except Exception as e:
+            return f"❌ Erro ao obter detalhes: {str(e)}"
+
+    async def obter_detalhes_por_link(self, link):
+        """Abre a página do processo no Chromium e extrai os detalhes"""
+        try:
+            async with browser_pool.contexto(**self.CONTEXTO_DETALHES) as context:
+                return await self._extrair_detalhes(context, link)
+        except Exception as e:
+            return f"❌ Erro ao obter detalhes: {str(e)}"
+    
+    async def _extrair_detalhes(self, context, link):
+        """Carrega a página do processo em uma aba nova do contexto e parseia os detalhes"""
+        page = await context.new_page()
+        
+        page.set_default_timeout(45000)
+        page.set_default_navigation_timeout(45000)
+        
+        try:
+            with tracer.span('esaj.detalhe'), metrics.cronometrar('tjsp_scrape_fase_segundos', fase='detalhe') as fase:
+                async with esaj_limiter.requisicao('detalhe') as requisicao:
+                    fase['descontar'] = requisicao['espera']
+                    resposta = await page.goto(link, wait_until="networkidle", timeout=45000)
+                    requisicao['erro'] = esaj_limiter.resposta_com_erro(resposta)
+                await asyncio.sleep(3)
                 
-                try:
-                    await page.goto(link, wait_until="networkidle", timeout=45000)
-                    await asyncio.sleep(3)
-                    
-                    html_content = await page.content()
-                    
-                    if "Número não localizado" in html_content or "Não existem informações" in html_content:
-                        await browser.close()
-                        return "❌ Processo não encontrado no TJSP."
-                    
-                    # Análise básica para esta versão
-                    detalhes = self._parse_detalhes_completos(html_content)
-                    await browser.close()
-                    
-                    if detalhes:
-                        return detalhes
-                    else:
-                        return "❌ Não foi possível extrair os detalhes do processo."
-                        
-                except Exception as e:
-                    await browser.close()
-                    return f"❌ Erro ao carregar página do processo: {str(e)}"
+                html_content = await page.content()
+            
+            if "Número não localizado" in html_content or "Não existem informações" in html_content:
+                return "❌ Processo não encontrado no TJSP."
+            if 'numeroProcesso' not in html_content and esaj_limiter.sinalizar_bloqueio('detalhe', html_content):
+                return "❌ ESAJ bloqueou o acesso (captcha/limite de acesso). Tente novamente em alguns minutos."
+            
+            # Página igual à da última visita: reaproveita o parse guardado sob o hash
+            impressao = self.paginas_detalhes.impressao(html_content)
+            anteriores = self.paginas_detalhes.inalterada(link, impressao)
+            if anteriores is not None:
+                metrics.incrementar('tjsp_detalhes_paginas_total', resultado='inalterada')
+                return anteriores
+            
+            # Análise básica para esta versão
+            with tracer.span('parse.detalhes'):
+                detalhes = self._parse_detalhes_completos(html_content)
+            
+            if detalhes:
+                alterada = self.paginas_detalhes.registrar(link, impressao, detalhes)
+                metrics.incrementar('tjsp_detalhes_paginas_total', resultado='alterada' if alterada else 'nova')
+                return detalhes
+            else:
+                return "❌ Não foi possível extrair os detalhes do processo."
                 
         except Exception as e:
-            return f"❌ Erro ao obter detalhes: {str(e)}"
+            return f"❌ Erro ao carregar página do processo: {str(e)}"
+        finally:
+            try:
+                await page.close()
+            except Exception:
+                pass
+    
+    @rastrear('obter_detalhes_lote')
+    async def obter_detalhes_lote(self, processos, workers=None, ao_concluir=None, vaga_extra=None):
+        """Detalhes de vários processos em paralelo (cache primeiro); devolve [(processo, detalhes ou erro)] na ordem"""
+        # A primeira frente usa a vaga de quem chamou; cada frente a mais pede a sua com vaga_extra()
+        # (vez no agendador + cota), que entrega a recusa ou None
+        resultados = [None] * len(processos)
+        pendentes = []
+        for posicao, processo in enumerate(processos):
+            detalhes = result_cache.get_detalhes(processo['id'])
+            if detalhes is not None:
+                resultados[posicao] = (processo, detalhes)
+                continue
+            link = self.obter_link_por_id(processo['id'])
+            if link.startswith('http'):
+                pendentes.append((posicao, processo, link))
+            else:
+                resultados[posicao] = (processo, "❌ Link não encontrado. Execute uma nova consulta.")
+        
+        concluidos = len(processos) - len(pendentes)
+        if ao_concluir:
+            ao_concluir(concluidos)
+        
+        if not pendentes:
+            return resultados
+        
+        fila = deque(pendentes)
+        frentes = []
+        iniciadas = set()
+        
+        async def buscar_um(buscar, posicao, processo, link):
+            nonlocal concluidos
+            try:
+                detalhes = await buscar(link)
+            except Exception as e:
+                detalhes = f"❌ Erro ao obter detalhes: {str(e)}"
+            if isinstance(detalhes, dict):
+                result_cache.save_detalhes(processo['id'], detalhes)
+            resultados[posicao] = (processo, detalhes)
+            concluidos += 1
+            if ao_concluir:
+                ao_concluir(concluidos)
+        
+        async def frente(indice):
+            """Um contexto (ou um worker) que atende um processo por vez até a fila acabar"""
+            vaga = vaga_extra() if indice and vaga_extra else contextlib.nullcontext()
+            async with vaga as recusa:
+                if recusa or not fila:
+                    return
+                iniciadas.add(indice)
+                if workers and workers.ativo:
+                    while fila:
+                        await buscar_um(workers.obter_detalhes_por_link, *fila.popleft())
+                else:
+                    async with browser_pool.contexto(**self.CONTEXTO_DETALHES) as context:
+                        while fila:
+                            await buscar_um(functools.partial(self._extrair_detalhes, context), *fila.popleft())
+                # Fila vazia: frentes que ainda esperam a vez desistem sem ocupar vaga nem gastar cota
+                for outro, tarefa in enumerate(frentes):
+                    if outro not in iniciadas:
+                        tarefa.cancel()
+        
+        frentes.extend(asyncio.create_task(frente(indice))
+                       for indice in range(min(self.DETALHES_CONCORRENCIA, len(pendentes))))
+        try:
+            erros = [erro for erro in await asyncio.gather(*frentes, return_exceptions=True)
+                     if isinstance(erro, Exception)]
+        finally:
+            for tarefa in frentes:
+                tarefa.cancel()
+        
+        # Processos que nenhuma frente atendeu (contexto que não abriu, vagas recusadas)
+        for posicao, processo, _ in fila:
+            erro = f": {erros[0]}" if erros else ""
+            resultados[posicao] = (processo, f"❌ Erro ao obter detalhes{erro}")
+        return resultados
+    
+    def formatar_detalhes_lote(self, titulo, resultados, duracao):
+        """Relatório único com os detalhes de um lote de processos"""
+        obtidos = sum(1 for _, detalhes in resultados if isinstance(detalhes, dict))
+        mensagem = (
+            f"📋 **DETALHES EM LOTE - {titulo}**\n"
+            f"✅ {obtidos} obtidos | ❌ {len(resultados) - obtidos} falhas | ⏱ {int(duracao)}s\n\n"
+        )
+        for i, (processo, detalhes) in enumerate(resultados, 1):
+            mensagem += f"**{i}. {processo['numero']}**\n"
+            if isinstance(detalhes, dict):
+                mensagem += (
+                    f"⚖ {detalhes['classe']}\n"
+                    f"📝 {detalhes['assunto']}\n"
+                    f"🏛 {detalhes['foro']} - {detalhes['vara']}\n"
+                    f"📍 {detalhes['area']}\n"
+                )
+                if detalhes.get('sem_alteracoes_desde'):
+                    mensagem += f"🕒 Sem alterações desde {detalhes['sem_alteracoes_desde'].strftime('%d/%m')}\n"
+            else:
+                mensagem += f"{detalhes}\n"
+            mensagem += "─" * 30 + "\n\n"
+        return mensagem
 
     def _parse_detalhes_completos(self, html_content):
         """Parseia detalhes básicos do processo"""
         try:
+            from bs4 import BeautifulSoup
             soup = BeautifulSoup(html_content, 'html.parser')
             
             detalhes = {
@@ -827,18 +4100,18 @@ class TJSPScrapingService:
             f"🏛 **Foro:** {detalhes['foro']}\n"
             f"⚖ **Vara:** {detalhes['vara']}\n"
             f"📍 **Área:** {detalhes['area']}\n\n"
-            f"💡 *Análise de CPF/CNPJ disponível em versões futuras*"
         )
+        if detalhes.get('sem_alteracoes_desde'):
+            mensagem += f"🕒 Sem alterações desde {detalhes['sem_alteracoes_desde'].strftime('%d/%m')}\n\n"
+        mensagem += "💡 *Análise de CPF/CNPJ disponível em versões futuras*"
         
         return mensagem
 
-    def buscar_por_numero(self, processos, numero):
-        """Busca processo por número"""
-        resultados = []
-        for processo in processos:
-            if numero in processo['numero']:
-                resultados.append(processo)
-        return resultados
+    def buscar_por_numero(self, processos, numero, indice=None):
+        """Busca processo por número (com ou sem pontuação), classe, assunto ou advogado"""
+        if indice is None:
+            indice = SearchIndex.para(processos)
+        return indice.buscar(numero)
 
     def agrupar_por_ano(self, processos):
         """Agrupa processos por ano"""
@@ -850,12 +4123,477 @@ class TJSPScrapingService:
             anos[ano].append(processo)
         return dict(sorted(anos.items(), reverse=True))
 
+class WorkerResultado:
+    """Resultado de uma consulta no worker: os processos vão para o bot a cada página, aqui fica só a contagem"""
+    
+    incompleto = False
+    pagina_falha = None
+    
+    def __init__(self):
+        self.total = 0
+    
+    def extend(self, processos):
+        self.total += len(processos)
+    
+    def __len__(self):
+        return self.total
+
+class WorkerCacheManager(CacheManager):
+    """Cache de links do worker: acumula os links novos para enviar ao processo do bot"""
+    
+    def __init__(self):
+        super().__init__()
+        self.pendentes = []
+    
+    def save_links(self, itens):
+        self.pendentes.extend(itens)
+    
+    def retirar_pendentes(self):
+        pendentes, self.pendentes = self.pendentes, []
+        return pendentes
+
+class WorkerCheckpoints(ScrapeCheckpoints):
+    """Checkpoints do worker: o do bot chega com o job e cada página concluída volta para o bot gravar"""
+    
+    def __init__(self, fila_eventos):
+        super().__init__()
+        self.fila_eventos = fila_eventos
+        self.job_id = None
+        self.recebido = None
+    
+    def iniciar(self, job_id, checkpoint):
+        self.job_id = job_id
+        self.recebido = checkpoint
+    
+    def carregar(self, oab):
+        if self.recebido and self.recebido['oab'] == oab:
+            return self.recebido
+        return None
+    
+    def salvar(self, oab, pagina, total_paginas, processos, novos=()):
+        # Os processos já foram para o bot nos eventos 'pagina'; basta a posição
+        self.fila_eventos.put(('checkpoint', self.job_id, (oab, pagina, total_paginas)))
+    
+    def limpar(self, oab):
+        self.recebido = None
+        self.fila_eventos.put(('checkpoint', self.job_id, (oab, None, None)))
+
+class WorkerJobProxy:
+    """Lado do worker de um ScrapeJob: repassa o progresso ao processo do bot"""
+    
+    def __init__(self, job_id, fila_eventos):
+        self.id = job_id
+        self.fila_eventos = fila_eventos
+    
+    def atualizar_progresso(self, pagina, total_paginas=None, processos=None):
+        self.fila_eventos.put(('progresso', self.id, pagina, total_paginas, processos))
+
+def _worker_main(indice, fila_jobs, fila_eventos, fila_controle):
+    """Ponto de entrada de um processo worker de scraping"""
+    try:
+        asyncio.run(_worker_loop(indice, fila_jobs, fila_eventos, fila_controle))
+    except KeyboardInterrupt:
+        pass
+
+async def _worker_loop(indice, fila_jobs, fila_eventos, fila_controle):
+    """Consome jobs da fila local e devolve eventos/resultados ao bot"""
+    loop = asyncio.get_running_loop()
+    service = TJSPScrapingService()
+    service.cache_manager = WorkerCacheManager()
+    service.guardar_resultado = False
+    # Checkpoints ficam no bot (que tem os processos) e sobrevivem à queda do worker
+    service.checkpoints = WorkerCheckpoints(fila_eventos)
+    # Sem backend compartilhado os hashes de detalhes também voltam para o bot
+    repassar_estado = not state_backend.shared
+    atual = {'job_id': None, 'task': None}
+    metrics.encaminhar = []
+    
+    def vigiar_controle():
+        while True:
+            comando = fila_controle.get()
+            if comando is None:
+                return
+            acao, job_id = comando
+            if acao == 'cancelar' and atual['job_id'] == job_id and atual['task']:
+                loop.call_soon_threadsafe(atual['task'].cancel)
+    
+    Thread(target=vigiar_controle, daemon=True).start()
+    # Chromium sobe enquanto o worker já aguarda jobs; o primeiro job espera no lock do pool
+    aquecimento = asyncio.create_task(browser_pool.aquecer())
+    print(f"👷 Worker {indice} pronto (pid {os.getpid()})")
+    
+    while True:
+        item = await loop.run_in_executor(None, fila_jobs.get)
+        if item is None:
+            break
+        
+        tipo, job_id, argumento, estado = item
+        fila_eventos.put(('inicio', job_id, indice))
+        if tipo == 'oab':
+            service.checkpoints.iniciar(job_id, estado)
+        elif repassar_estado:
+            service.paginas_detalhes.importar(argumento, estado)
+        
+        async def notificar(texto, job_id=job_id):
+            fila_eventos.put(('mensagem', job_id, texto))
+        
+        def ao_processar_pagina(processos_pagina, job_id=job_id):
+            links = service.cache_manager.retirar_pendentes()
+            fila_eventos.put(('pagina', job_id, list(processos_pagina), links))
+        
+        if tipo == 'oab':
+            coro = service.consultar_por_oab(
+                argumento, ao_processar_pagina=ao_processar_pagina,
+                job=WorkerJobProxy(job_id, fila_eventos), notificar=notificar
+            )
+        else:
+            coro = service.obter_detalhes_por_link(argumento)
+        
+        atual['job_id'] = job_id
+        atual['task'] = asyncio.ensure_future(coro)
+        try:
+            resultado = await atual['task']
+            if tipo == 'oab':
+                processos, erro = resultado
+                fila_eventos.put(('resultado', job_id, (
+                    None if processos else erro,
+                    getattr(processos, 'incompleto', False),
+                    getattr(processos, 'pagina_falha', None)
+                )))
+            else:
+                if repassar_estado:
+                    fila_eventos.put(('impressao', job_id, (argumento, service.paginas_detalhes.exportar(argumento))))
+                fila_eventos.put(('resultado', job_id, resultado))
+        except asyncio.CancelledError:
+            fila_eventos.put(('cancelado', job_id, None))
+        except Exception as e:
+            fila_eventos.put(('erro', job_id, str(e)))
+        finally:
+            atual['job_id'] = None
+            atual['task'] = None
+            fila_eventos.put(('metricas', job_id, metrics.retirar_encaminhados()))
+            if tracer.lentos:
+                fila_eventos.put(('traces', job_id, list(tracer.lentos)))
+                tracer.lentos.clear()
+    
+    await aquecimento
+    await browser_pool.fechar()
+
+class ScrapeWorkerPool:
+    """Processos worker (um Chromium cada), cada um com a própria fila; o bot entrega um job por vez a cada worker livre"""
+    
+    INTERVALO_VIGIA = 2
+    ESPERA_PARADA = 10
+    
+    def __init__(self, quantidade=None):
+        if quantidade is None:
+            quantidade = int(os.environ.get('SCRAPE_WORKERS', '0'))
+        self.quantidade = quantidade
+        self.processos = []
+        self.filas_jobs = []
+        self.filas_controle = []
+        self.fila_eventos = None
+        self.ctx = None
+        self.pendentes = {}
+        self.espera = deque()
+        self.ocupados = {}
+        self.leitor = None
+        self.eventos = None
+        self.consumidor = None
+        self.vigia = None
+        self.reinicios = 0
+        self.checkpoints = ScrapeCheckpoints()
+        self.paginas_detalhes = DetailFingerprints()
+    
+    @property
+    def ativo(self):
+        return bool(self.processos)
+    
+    def tamanho_fila(self):
+        """Jobs aguardando ou em execução nos workers"""
+        return len(self.pendentes)
+    
+    def iniciar(self):
+        """Sobe os processos worker (chamar antes de iniciar threads/event loop)"""
+        if self.quantidade <= 0 or self.processos:
+            return
+        
+        self.ctx = multiprocessing.get_context('spawn')
+        self.fila_eventos = self.ctx.Queue()
+        for indice in range(self.quantidade):
+            self.processos.append(None)
+            self.filas_jobs.append(None)
+            self.filas_controle.append(None)
+            self._iniciar_worker(indice)
+        
+        print(f"👷 {self.quantidade} workers de scraping iniciados")
+    
+    def _iniciar_worker(self, indice):
+        """Processo novo (com filas novas) na posição do worker"""
+        fila_jobs = self.ctx.Queue()
+        fila_controle = self.ctx.Queue()
+        processo = self.ctx.Process(
+            target=_worker_main,
+            args=(indice, fila_jobs, self.fila_eventos, fila_controle),
+            name=f"scrape-worker-{indice}",
+            daemon=True
+        )
+        processo.start()
+        self.processos[indice] = processo
+        self.filas_jobs[indice] = fila_jobs
+        self.filas_controle[indice] = fila_controle
+    
+    async def parar(self):
+        """Encerra os workers: cancela os jobs em andamento e espera cada um fechar o seu Chromium"""
+        processos, self.processos = self.processos, []
+        if not processos:
+            return
+        for indice, job_id in list(self.ocupados.items()):
+            self.filas_controle[indice].put(('cancelar', job_id))
+        for fila_jobs in self.filas_jobs:
+            fila_jobs.put(None)
+        for fila_controle in self.filas_controle:
+            fila_controle.put(None)
+        for processo in processos:
+            await asyncio.to_thread(processo.join, self.ESPERA_PARADA)
+            if processo.is_alive():
+                print(f"⚠️ {processo.name} não encerrou em {self.ESPERA_PARADA}s - forçando")
+                processo.terminate()
+        if self.fila_eventos:
+            self.fila_eventos.put(None)
+        for tarefa in (self.vigia, self.consumidor):
+            if tarefa:
+                tarefa.cancel()
+        self.filas_jobs = []
+        self.filas_controle = []
+        print(f"👷 {len(processos)} workers de scraping encerrados")
+    
+    def _garantir_leitor(self):
+        if self.consumidor is None or self.consumidor.done():
+            self.eventos = asyncio.Queue()
+            self.consumidor = asyncio.create_task(self._consumir_eventos())
+        if self.leitor is None or not self.leitor.is_alive():
+            loop = asyncio.get_running_loop()
+            self.leitor = Thread(target=self._ler_eventos, args=(loop,), daemon=True)
+            self.leitor.start()
+        if self.vigia is None or self.vigia.done():
+            self.vigia = asyncio.create_task(self._vigiar())
+    
+    def _ler_eventos(self, loop):
+        """Thread que lê a fila de eventos dos workers e despacha no event loop do bot"""
+        while True:
+            evento = self.fila_eventos.get()
+            if evento is None:
+                return
+            loop.call_soon_threadsafe(self.eventos.put_nowait, evento)
+    
+    async def _consumir_eventos(self):
+        """Despacha os eventos na ordem de chegada (uma página só é gravada depois da anterior)"""
+        while True:
+            evento = await self.eventos.get()
+            await self._despachar(evento)
+    
+    async def _vigiar(self):
+        """Confere periodicamente se os workers continuam vivos (OOM kill, queda do Chromium)"""
+        while self.processos:
+            await asyncio.sleep(self.INTERVALO_VIGIA)
+            for indice, processo in enumerate(self.processos):
+                if not processo.is_alive():
+                    self._substituir(indice, processo.exitcode)
+    
+    def _substituir(self, indice, codigo):
+        """Falha o job do worker que morreu e sobe outro processo no lugar"""
+        self.reinicios += 1
+        metrics.incrementar('tjsp_workers_reiniciados_total')
+        print(f"💥 Worker {indice} morreu (código {codigo}) - reiniciando")
+        
+        job_id = self.ocupados.pop(indice, None)
+        pendente = self.pendentes.pop(job_id, None) if job_id else None
+        if pendente and not pendente['futuro'].done():
+            checkpoint = self.checkpoints.carregar(pendente['oab']) if pendente['oab'] else None
+            if checkpoint and pendente['processos']:
+                # O que chegou até a queda vira resultado incompleto; reenviar a OAB retoma do checkpoint do bot
+                pendente['futuro'].set_result((None, True, checkpoint['pagina'] + 1))
+            else:
+                pendente['futuro'].set_exception(
+                    RuntimeError(f"worker de scraping {indice} encerrado inesperadamente (código {codigo})")
+                )
+        
+        self._iniciar_worker(indice)
+        self._distribuir()
+    
+    def _distribuir(self):
+        """Entrega os jobs em espera aos workers livres"""
+        livres = [indice for indice in range(len(self.processos)) if indice not in self.ocupados]
+        while self.espera and livres:
+            tipo, job_id, argumento = self.espera.popleft()
+            pendente = self.pendentes.get(job_id)
+            if not pendente or pendente['cancelado']:
+                continue
+            
+            indice = livres.pop(0)
+            pendente['worker'] = indice
+            self.ocupados[indice] = job_id
+            if tipo == 'oab':
+                estado = self.checkpoints.carregar(argumento)
+            elif self.paginas_detalhes.backend.shared:
+                estado = None
+            else:
+                estado = self.paginas_detalhes.exportar(argumento)
+            self.filas_jobs[indice].put((tipo, job_id, argumento, estado))
+    
+    @staticmethod
+    def _acumular(processos, oab, processos_pagina):
+        """Acrescenta a página ao resultado e transborda para o disco se preciso (bloqueante)"""
+        processos.extend(processos_pagina)
+        return ProcessoArquivo.transbordar(processos, oab)
+    
+    async def _despachar(self, evento):
+        """Entrega um evento de worker ao job que o aguarda"""
+        tipo, job_id = evento[0], evento[1]
+        if tipo == 'metricas':
+            metrics.aplicar(evento[2])
+            return
+        if tipo == 'traces':
+            tracer.lentos.extend(evento[2])
+            return
+        if tipo == 'impressao':
+            self.paginas_detalhes.importar(*evento[2])
+            return
+        
+        pendente = self.pendentes.get(job_id)
+        if not pendente:
+            return
+        
+        try:
+            if tipo == 'inicio':
+                if pendente['cancelado']:
+                    self.filas_controle[evento[2]].put(('cancelar', job_id))
+            elif tipo == 'mensagem':
+                if pendente['notificar']:
+                    asyncio.ensure_future(pendente['notificar'](evento[2]))
+            elif tipo == 'progresso':
+                if pendente['job']:
+                    pendente['job'].atualizar_progresso(evento[2], evento[3], evento[4])
+            elif tipo == 'pagina':
+                processos_pagina, links = evento[2], evento[3]
+                if pendente['cache_manager'] and links:
+                    pendente['cache_manager'].save_links(links)
+                if ProcessoArquivo.precisa_disco(pendente['processos']) or \
+                        len(pendente['processos']) + len(processos_pagina) > ProcessoArquivo.LIMITE_MEMORIA:
+                    pendente['processos'] = await asyncio.to_thread(
+                        self._acumular, pendente['processos'], pendente['oab'], processos_pagina
+                    )
+                else:
+                    pendente['processos'].extend(processos_pagina)
+                pendente['novos'].extend(processos_pagina)
+                if pendente['ao_processar_pagina']:
+                    pendente['ao_processar_pagina'](processos_pagina)
+            elif tipo == 'checkpoint':
+                oab, pagina, total_paginas = evento[2]
+                if pagina is None:
+                    self.checkpoints.limpar(oab)
+                else:
+                    self.checkpoints.salvar(oab, pagina, total_paginas, pendente['processos'], pendente['novos'])
+                pendente['novos'] = []
+            else:
+                self.pendentes.pop(job_id, None)
+                if self.ocupados.get(pendente['worker']) == job_id:
+                    del self.ocupados[pendente['worker']]
+                    self._distribuir()
+                if pendente['futuro'].done():
+                    return
+                if tipo == 'resultado':
+                    pendente['futuro'].set_result(evento[2])
+                elif tipo == 'cancelado':
+                    pendente['futuro'].cancel()
+                else:
+                    pendente['futuro'].set_exception(RuntimeError(evento[2]))
+        except Exception as e:
+            print(f"⚠️ Erro ao despachar evento do worker: {e}")
+    
+    async def _executar(self, tipo, argumento, **extras):
+        """Enfileira um job e aguarda o resultado; cancelamento é repassado ao worker"""
+        self._garantir_leitor()
+        job = extras.get('job')
+        job_id = job.id if job else uuid.uuid4().hex[:8]
+        
+        pendente = {
+            'futuro': asyncio.get_running_loop().create_future(),
+            'worker': None,
+            'cancelado': False,
+            'processos': ProcessoStore(),
+            # Processos recebidos desde o último checkpoint (só eles vão para o backend)
+            'novos': [],
+            'oab': argumento if tipo == 'oab' else None,
+            'job': job,
+            'notificar': extras.get('notificar'),
+            'ao_processar_pagina': extras.get('ao_processar_pagina'),
+            'cache_manager': extras.get('cache_manager')
+        }
+        self.pendentes[job_id] = pendente
+        self.espera.append((tipo, job_id, argumento))
+        self._distribuir()
+        
+        try:
+            resultado = await asyncio.shield(pendente['futuro'])
+            return pendente, resultado
+        except asyncio.CancelledError:
+            pendente['cancelado'] = True
+            if pendente['worker'] is None:
+                # Ainda na espera: nenhum worker vai responder por ele
+                self.pendentes.pop(job_id, None)
+            else:
+                self.filas_controle[pendente['worker']].put(('cancelar', job_id))
+            raise
+    
+    async def consultar_por_oab(self, oab, service, update: Update = None, ao_processar_pagina=None, job=None):
+        """Mesmo contrato de TJSPScrapingService.consultar_por_oab, executado em um worker (o snapshot é gravado aqui)"""
+        notificar = update.message.reply_text if update else None
+        try:
+            pendente, (erro, incompleto, pagina_falha) = await self._executar(
+                'oab', oab, job=job, notificar=notificar,
+                ao_processar_pagina=ao_processar_pagina, cache_manager=service.cache_manager
+            )
+        except RuntimeError as e:
+            return [], f"❌ Erro na consulta: {e}"
+        if erro or not pendente['processos']:
+            return [], erro or "❌ Nenhum processo encontrado"
+        if incompleto:
+            pendente['processos'].incompleto = True
+            pendente['processos'].pagina_falha = pagina_falha
+        await asyncio.to_thread(service._salvar_snapshot, pendente['processos'], oab)
+        return pendente['processos'], None
+    
+    async def obter_detalhes_por_link(self, link):
+        """Busca os detalhes de um processo em um worker"""
+        try:
+            _, resultado = await self._executar('detalhes', link)
+        except RuntimeError as e:
+            return f"❌ Erro ao obter detalhes: {e}"
+        return resultado
+
 # ✅ BOT_TOKEN - Usar variável de ambiente
 BOT_TOKEN = os.environ.get('BOT_TOKEN', '7152880157:AAGt6SUNaDvN2RxWc88Px_eMaxK3rY3OdnY')
 
 # Gerenciadores
+inicializacao = StartupTimings(INICIO_PROCESSO)
+inicializacao.marco('imports')
+metrics = MetricsRegistry()
+declarar_metricas(metrics)
+tracer = Tracer()
+state_backend = criar_state_backend()
 license_manager = LicenseManager()
+result_cache = ResultCache()
 session_manager = SessionManager()
+job_registry = JobRegistry()
+watchlist = WatchlistManager()
+memory_governor = MemoryGovernor()
+esaj_limiter = EsajRateLimiter()
+browser_pool = BrowserPool()
+scrape_workers = ScrapeWorkerPool()
+scrape_scheduler = ScrapeScheduler()
+inicializacao.marco('gerenciadores')
 
 # Handlers do Bot
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -899,16 +4637,45 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• `/2025` - Ver processos de 2025\n" 
         f"• `/todos` - Ver todos os processos\n"
         f"• `/nums` - Apenas números\n"
-        f"• `/buscar 123456` - Buscar por número\n"
+        f"• `/exportar csv` - Arquivo com todos os processos (csv, xlsx ou json)\n"
+        f"• `/buscar 123456` - Buscar por número, classe, assunto ou parte\n"
         f"• `/link_ID` - Obter link (clique nos IDs)\n"
         f"• `/detalhes_ID` - Ver detalhes (clique nos IDs)\n"
+        f"• `/detalhes_ano 2024` - Detalhes de todos os processos do ano\n"
+        f"• `/detalhes_busca` - Detalhes de todos os resultados da última busca\n"
         f"• `/stats` - Estatísticas\n"
+        f"• `/status` - Andamento da consulta\n"
+        f"• `/cancelar` - Cancelar consulta em andamento\n"
+        f"• `/monitorar 123456SP` - Avisar novos processos da OAB (sem OAB: lista)\n"
+        f"• `/desmonitorar 123456SP` - Parar de monitorar\n"
         f"• `/licenca` - Info da licença\n"
         f"• `/giststatus` - Status do Gist (admin)\n"
         f"• `/sync` - Sincronizar licenças (admin)\n"
         f"• `/limpar` - Encerrar sessão\n"
     )
 
+@contextlib.asynccontextmanager
+async def vez_no_tjsp(username, chave=None, avisar=None, cota=True):
+    """Cota da licença, vez no agendador e memória livre antes de consultar o TJSP; entrega a recusa ou None"""
+    if cota:
+        permitido, motivo = license_manager.verificar_cota(username)
+        if not permitido:
+            yield motivo
+            return
+    
+    async with scrape_scheduler.vez(username, license_manager.is_admin(username), chave, avisar):
+        if not await memory_governor.aguardar(avisar):
+            yield memory_governor.mensagem_recusa()
+            return
+        if cota:
+            # Outros pedidos da mesma licença (em qualquer réplica) podem ter gastado a cota enquanto este esperava
+            permitido, motivo = license_manager.reservar_consulta(username)
+            if not permitido:
+                yield motivo
+                return
+        yield None
+
+@rastrear('consultar_oab')
 async def consultar_oab(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.message.from_user.username or "Anônimo"
     
@@ -929,8 +4696,17 @@ async def consultar_oab(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     oab = texto
     
+    job_ativo = job_registry.job_ativo(username, chat_id)
+    if job_ativo:
+        await update.message.reply_text(
+            f"⏳ **Já existe uma consulta em andamento!**\n\n"
+            f"{job_ativo.descrever()}\n\n"
+            f"💡 Use `/status` para acompanhar ou `/cancelar` para interromper"
+        )
+        return
+    
     session_manager.clear_session(username, chat_id)
-    session_id = session_manager.create_session(username, chat_id, oab)
+    session_manager.create_session(username, chat_id, oab)
     session = session_manager.get_session(username, chat_id)
     
     license_info = license_manager.get_license_info(username)
@@ -942,26 +4718,73 @@ async def consultar_oab(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_header = "👤 **Licenciado**"
         license_header = f"📅 **Licença:** {license_info['days_left']} dias restantes"
     
+    job = job_registry.criar(username, chat_id, oab)
+    job_registry.iniciar(job, executar_consulta_oab(job, update, session))
+    
     await update.message.reply_text(
         f"🔍 **CONSULTANDO OAB:** {oab}\n"
         f"{user_header}: @{username}\n"
         f"{license_header}\n"
         f"💬 **Sessão:** Privada\n"
-        f"⏳ Isso pode demorar vários minutos..."
+        f"🆔 **Job:** `{job.id}`\n"
+        f"⏳ Isso pode demorar vários minutos...\n\n"
+        f"💡 `/status` - Acompanhar | `/cancelar` - Interromper"
     )
+
+@rastrear('executar_consulta_oab', raiz=True)
+async def executar_consulta_oab(job, update: Update, session):
+    """Executa a consulta de um job em segundo plano e envia o resumo ao final"""
+    username = job.username
+    chat_id = job.chat_id
+    oab = job.oab
+    tracer.anotar(job=job.id, oab=oab)
+    
+    def limpar_sessao():
+        # Só remove a sessão se ela ainda for deste job (o usuário pode ter iniciado outra)
+        if session_manager.user_sessions.get(f"{username}_{chat_id}") is session:
+            session_manager.clear_session(username, chat_id)
     
     try:
         service = session['service']
-        processos, _ = await service.consultar_por_oab(oab, update)
+        em_cache = result_cache.get_resultado(oab)
+        if em_cache:
+            processos, erro = em_cache['processos'], None
+            await update.message.reply_text(
+                f"♻️ **Resultado recente em cache**\n"
+                f"🕒 Consulta de {em_cache['data_consulta'].strftime('%d/%m/%Y %H:%M')}"
+            )
+        else:
+            async with vez_no_tjsp(username, job.id, update.message.reply_text) as recusa:
+                if recusa:
+                    job.finalizar('failed', recusa)
+                    await update.message.reply_text(recusa)
+                    limpar_sessao()
+                    return
+                if scrape_workers.ativo:
+                    processos, erro = await scrape_workers.consultar_por_oab(
+                        oab, service, update, ao_processar_pagina=session['agregados'].adicionar, job=job
+                    )
+                else:
+                    processos, erro = await service.consultar_por_oab(
+                        oab, update, ao_processar_pagina=session['agregados'].adicionar, job=job
+                    )
         
         if not processos:
+            job.finalizar('failed', erro)
             await update.message.reply_text("❌ Nenhum processo encontrado para esta OAB")
-            session_manager.clear_session(username, chat_id)
+            limpar_sessao()
             return
         
-        session['processos'] = processos
+        session = session_manager.set_processos(username, chat_id, processos)
+        if not session:
+            job.finalizar('cancelled')
+            return
+        job.finalizar('done')
+        incompleto = getattr(processos, 'incompleto', False)
+        if not em_cache and not incompleto:
+            result_cache.save_resultado(oab, session['processos'])
         
-        anos = service.agrupar_por_ano(processos)
+        anos = session['agregados'].agrupado()
         
         mensagem = (
             f"🎉 **CONSULTA COMPLETA!**\n\n"
@@ -969,8 +4792,13 @@ async def consultar_oab(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"👤 **Usuário:** @{username}\n"
             f"📊 **Total:** {len(processos)} processos\n"
             f"📅 **Período:** {min(anos.keys())} - {max(anos.keys())}\n\n"
-            f"🚀 **COMANDOS DISPONÍVEIS:**\n"
         )
+        if incompleto:
+            mensagem += (
+                f"⚠️ **Resultado incompleto:** a consulta parou na página {processos.pagina_falha}\n"
+                f"🔁 Envie a OAB novamente para continuar de onde parou\n\n"
+            )
+        mensagem += f"🚀 **COMANDOS DISPONÍVEIS:**\n"
         
         for ano in list(anos.keys())[:5]:
             mensagem += f"• `/{ano}` - {len(anos[ano])} processos\n"
@@ -978,7 +4806,9 @@ async def consultar_oab(update: Update, context: ContextTypes.DEFAULT_TYPE):
         mensagem += (
             f"• `/todos` - Ver resumo geral\n"
             f"• `/nums` - Apenas números\n"
-            f"• `/buscar NÚMERO` - Buscar processo\n"
+            f"• `/exportar csv` - Arquivo com todos os processos (csv, xlsx ou json)\n"
+            f"• `/buscar TERMO` - Buscar por número, classe, assunto ou parte\n"
+            f"• `/detalhes_ano {max(anos.keys())}` - Detalhes de todos os processos do ano\n"
             f"• `/stats` - Estatísticas\n"
             f"• `/licenca` - Info da licença\n"
             f"• `/limpar` - Encerrar sessão\n\n"
@@ -993,11 +4823,179 @@ async def consultar_oab(update: Update, context: ContextTypes.DEFAULT_TYPE):
             mensagem += "• `/sync` - Sincronizar licenças\n"
         
         await update.message.reply_text(mensagem)
+    
+    except asyncio.CancelledError:
+        job.finalizar('cancelled')
+        limpar_sessao()
+        await update.message.reply_text(f"🛑 **Consulta cancelada!**\n🆔 Job `{job.id}` - OAB {oab}")
             
     except Exception as e:
-        session_manager.clear_session(username, chat_id)
+        job.finalizar('failed', str(e))
+        limpar_sessao()
         await update.message.reply_text(f"❌ **Erro na consulta:** {str(e)}")
 
+@rastrear('executar_detalhes_lote', raiz=True)
+async def executar_detalhes_lote(job, update: Update, service, processos, titulo):
+    """Busca os detalhes de um lote em segundo plano e envia um relatório único"""
+    tracer.anotar(job=job.id, oab=job.oab, processos=len(processos))
+    inicio = time.monotonic()
+    
+    try:
+        sem_cache = any(result_cache.get_detalhes(processo['id'], contar=False) is None for processo in processos)
+        async with contextlib.AsyncExitStack() as pilha:
+            if sem_cache:
+                recusa = await pilha.enter_async_context(vez_no_tjsp(job.username, job.id, update.message.reply_text))
+                if recusa:
+                    job.finalizar('failed', recusa)
+                    await update.message.reply_text(recusa)
+                    return
+            
+            # Cada contexto aberto em paralelo ocupa uma vaga no agendador e uma unidade da cota
+            resultados = await service.obter_detalhes_lote(
+                processos, workers=scrape_workers,
+                ao_concluir=lambda concluidos: job.atualizar_progresso(concluidos, len(processos), concluidos),
+                vaga_extra=lambda: vez_no_tjsp(job.username, job.id)
+            )
+        job.finalizar('done')
+        
+        mensagem = service.formatar_detalhes_lote(titulo, resultados, time.monotonic() - inicio)
+        for i in range(0, len(mensagem), 4000):
+            await update.message.reply_text(mensagem[i:i+4000])
+    
+    except asyncio.CancelledError:
+        job.finalizar('cancelled')
+        await update.message.reply_text(f"🛑 **Detalhes em lote cancelados!**\n🆔 Job `{job.id}`")
+    
+    except Exception as e:
+        job.finalizar('failed', str(e))
+        await update.message.reply_text(f"❌ **Erro ao obter detalhes:** {str(e)}")
+
+async def executar_detalhes_processo(job, update: Update, service, processo_id, numero, username):
+    """Busca os detalhes de um processo em segundo plano, na fila do agendador como as demais consultas"""
+    tracer.anotar(job=job.id, oab=job.oab, processo=processo_id)
+    
+    try:
+        async with vez_no_tjsp(username, job.id, update.message.reply_text) as recusa:
+            if recusa:
+                job.finalizar('failed', recusa)
+                await update.message.reply_text(recusa)
+                return
+            detalhes = await service.obter_detalhes_processo(processo_id, update, workers=scrape_workers)
+        
+        if isinstance(detalhes, str):
+            job.finalizar('failed', detalhes)
+            await update.message.reply_text(detalhes)
+            return
+        result_cache.save_detalhes(processo_id, detalhes)
+        job.atualizar_progresso(1, 1, 1)
+        job.finalizar('done')
+        await enviar_detalhes_processo(update, service, numero, detalhes, username)
+    
+    except asyncio.CancelledError:
+        job.finalizar('cancelled')
+        await update.message.reply_text(f"🛑 **Detalhes cancelados!**\n🆔 Job `{job.id}`")
+    
+    except Exception as e:
+        job.finalizar('failed', str(e))
+        await update.message.reply_text(f"❌ **Erro ao obter detalhes:** {str(e)}")
+
+async def enviar_detalhes_processo(update: Update, service, numero, detalhes, username):
+    """Envia os detalhes formatados, em partes quando passam do limite do Telegram"""
+    mensagem_detalhes = service.formatar_detalhes_processo(numero, detalhes)
+    user_type = "👑 **Admin**" if license_manager.is_admin(username) else "👤 **Licenciado**"
+    header_detalhes = f"{user_type}: @{username}\n🔢 **Processo:** {numero}\n\n"
+    
+    if len(mensagem_detalhes) > 4096:
+        partes = [mensagem_detalhes[i:i+4000] for i in range(0, len(mensagem_detalhes), 4000)]
+        for parte in partes:
+            await update.message.reply_text(header_detalhes + parte)
+    else:
+        await update.message.reply_text(header_detalhes + mensagem_detalhes)
+
+async def status_consulta(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mostra o andamento do último job de consulta do usuário"""
+    username = update.message.from_user.username or "Anônimo"
+    
+    has_license, license_msg = license_manager.check_license(username)
+    if not has_license:
+        await update.message.reply_text(f"❌ **Licença necessária!**\n{license_msg}")
+        return
+    
+    job = job_registry.ultimo_job(username, update.message.chat.id)
+    if not job:
+        await update.message.reply_text("ℹ️ **Nenhuma consulta recente**\nDigite uma OAB para iniciar (ex: `123456SP`)")
+        return
+    
+    await update.message.reply_text(f"📊 **STATUS DA CONSULTA**\n\n{job.descrever()}")
+
+async def cancelar_consulta(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancela o job de consulta em andamento"""
+    username = update.message.from_user.username or "Anônimo"
+    
+    has_license, license_msg = license_manager.check_license(username)
+    if not has_license:
+        await update.message.reply_text(f"❌ **Licença necessária!**\n{license_msg}")
+        return
+    
+    job = job_registry.cancelar(username, update.message.chat.id)
+    if not job:
+        await update.message.reply_text("ℹ️ **Nenhuma consulta em andamento**")
+        return
+    
+    await update.message.reply_text(f"🛑 **Cancelando consulta...**\n🆔 Job `{job.id}` - OAB {job.oab}\n🌐 Fechando navegador")
+
+async def monitorar_oab(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inscreve, lista ou remove OABs monitoradas (/monitorar e /desmonitorar)"""
+    username = update.message.from_user.username or "Anônimo"
+    
+    has_license, license_msg = license_manager.check_license(username)
+    if not has_license:
+        await update.message.reply_text(f"❌ **Licença necessária!**\n{license_msg}")
+        return
+    
+    chat_id = update.message.chat.id
+    comando = update.message.text.split()[0].split('@')[0]
+    oab = (context.args[0] if context.args else '').upper()
+    
+    if oab and not re.match(r'^\d{6}[A-Z]{2}$', oab):
+        await update.message.reply_text("❌ **Formato inválido!**\nUse: `/monitorar 123456SP`")
+        return
+    
+    if comando == '/desmonitorar':
+        if not oab:
+            await update.message.reply_text("❌ **Formato:** `/desmonitorar 123456SP`")
+        elif watchlist.remover(username, chat_id, oab):
+            await update.message.reply_text(f"🔕 **OAB {oab} removida do monitoramento**")
+        else:
+            await update.message.reply_text(f"❌ Você não monitora a OAB {oab}")
+        return
+    
+    if oab:
+        await update.message.reply_text(watchlist.adicionar(username, chat_id, oab, SnapshotStore()))
+        return
+    
+    itens = watchlist.do_usuario(username, chat_id)
+    if not itens:
+        await update.message.reply_text("ℹ️ **Nenhuma OAB monitorada**\n💡 `/monitorar 123456SP` para receber as novidades")
+        return
+    
+    mensagem = "🔔 **OABs MONITORADAS**\n\n"
+    for item in itens:
+        ultima = item['ultima_verificacao'].strftime('%d/%m %H:%M') if item['ultima_verificacao'] else "ainda não verificada"
+        mensagem += (
+            f"🔍 **{item['oab']}**\n"
+            f"   🕒 Última: {ultima}\n"
+            f"   ⏰ Próxima: {item['proxima_verificacao'].strftime('%d/%m %H:%M')}\n"
+        )
+        if item['total'] is not None:
+            mensagem += f"   📋 {item['total']} processos\n"
+        if item['erro']:
+            mensagem += f"   ⚠️ {item['erro']}\n"
+        mensagem += "\n"
+    mensagem += "💡 `/desmonitorar OAB` para parar"
+    await update.message.reply_text(mensagem)
+
+@rastrear('handle_commands')
 async def handle_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manipula comandos de ano e outros"""
     username = update.message.from_user.username or "Anônimo"
@@ -1025,7 +5023,17 @@ async def handle_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
+    job_ativo = job_registry.job_ativo(username, chat_id)
+    if job_ativo and texto not in ('/licenca', '/limpar'):
+        await update.message.reply_text(
+            f"⏳ **Consulta ainda em andamento**\n\n"
+            f"{job_ativo.descrever()}\n\n"
+            f"💡 `/status` - Acompanhar | `/cancelar` - Interromper"
+        )
+        return
+    
     processos = session['processos']
+    agregados = session['agregados']
     service = session['service']
     oab = session['oab']
     
@@ -1061,6 +5069,7 @@ async def handle_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         f"⏰ **Expira em:** {license_info['expiry_date']}\n"
                         f"📊 **Dias restantes:** {license_info['days_left']}\n"
                         f"🕒 **Duração:** {license_info['duration_days']} dias\n"
+                        f"🎫 **Cota:** {formatar_cota(username)}\n"
                         f"✅ **Status:** ATIVA"
                     )
                 await update.message.reply_text(mensagem)
@@ -1069,12 +5078,13 @@ async def handle_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         if texto == '/limpar':
+            job_registry.cancelar(username, chat_id)
             session_manager.clear_session(username, chat_id)
             await update.message.reply_text("🗑️ **Sessão encerrada!**\nDigite uma nova OAB para nova consulta")
             return
         
         if texto == '/todos':
-            mensagem = service.formatar_todos_processos(processos)
+            mensagem = service.formatar_todos_processos(processos, agregados.agrupado())
             if len(mensagem) > 4096:
                 partes = [mensagem[i:i+4000] for i in range(0, len(mensagem), 4000)]
                 for parte in partes:
@@ -1083,7 +5093,7 @@ async def handle_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text(header + mensagem)
         
         elif texto == '/nums':
-            mensagem = service.formatar_apenas_numeros(processos)
+            mensagem = service.formatar_apenas_numeros(processos, agregados.agrupado())
             if len(mensagem) > 4096:
                 partes = [mensagem[i:i+4000] for i in range(0, len(mensagem), 4000)]
                 for parte in partes:
@@ -1091,9 +5101,38 @@ async def handle_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 await update.message.reply_text(header + mensagem)
         
+        elif texto == '/exportar' or texto.startswith('/exportar '):
+            formato = texto[9:].strip().lower() or 'csv'
+            if formato not in ResultExporter.FORMATOS:
+                await update.message.reply_text("❌ **Formato:** `/exportar csv`, `/exportar xlsx` ou `/exportar json`")
+                return
+            
+            await update.message.reply_text(f"📦 **Gerando {formato.upper()} com {len(processos)} processos...**")
+            
+            descritor, destino = tempfile.mkstemp(suffix=f".{formato}")
+            os.close(descritor)
+            try:
+                exportador = ResultExporter(service.cache_manager)
+                # Arquivo gerado em uma thread para não travar o bot durante a escrita
+                await asyncio.get_running_loop().run_in_executor(None, exportador.exportar, processos, formato, destino)
+                
+                if os.path.getsize(destino) > 50 * 1024 * 1024:
+                    await update.message.reply_text("❌ Arquivo maior que o limite de 50 MB do Telegram\n💡 Tente `/exportar csv`")
+                    return
+                
+                with open(destino, 'rb') as arquivo:
+                    await update.message.reply_document(
+                        document=arquivo,
+                        filename=f"processos_{oab}_{datetime.now().strftime('%Y%m%d_%H%M')}.{formato}",
+                        caption=f"📦 {len(processos)} processos - OAB {oab}"
+                    )
+            finally:
+                os.remove(destino)
+        
         elif texto.startswith('/buscar '):
             numero_busca = texto[8:].strip()
-            resultados = service.buscar_por_numero(processos, numero_busca)
+            resultados = service.buscar_por_numero(processos, numero_busca, session_manager.indice_busca(session))
+            session_manager.salvar_busca(username, chat_id, numero_busca, resultados)
             
             if resultados:
                 mensagem = f"🔍 **RESULTADOS PARA: {numero_busca}**\n\n"
@@ -1107,6 +5146,7 @@ async def handle_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 
                 if len(resultados) > 10:
                     mensagem += f"💡 Mostrando 10 de {len(resultados)} resultados\n"
+                mensagem += f"📋 `/detalhes_busca` - Detalhes de todos os resultados\n"
                 
                 await update.message.reply_text(header + mensagem)
             else:
@@ -1131,6 +5171,41 @@ async def handle_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 await update.message.reply_text(f"❌ {link}")
         
+        elif texto.startswith('/detalhes_ano') or texto == '/detalhes_busca':
+            limite = int(os.environ.get('DETALHES_LOTE_MAX', '50'))
+            if texto == '/detalhes_busca':
+                busca = session_manager.ultima_busca(username, chat_id)
+                if not busca or not busca['processos']:
+                    await update.message.reply_text("❌ Faça uma busca antes: `/buscar TERMO`")
+                    return
+                titulo = f"BUSCA: {busca['termo']}"
+                alvo, total = busca['processos'], busca['total']
+            else:
+                ano = texto[13:].strip()
+                if not ano.isdigit():
+                    await update.message.reply_text("❌ **Formato:** `/detalhes_ano 2024`")
+                    return
+                alvo = agregados.processos_do_ano(int(ano))
+                titulo = f"ANO {ano}"
+                if not alvo:
+                    await update.message.reply_text(f"❌ Nenhum processo encontrado para {ano}")
+                    return
+                total = len(alvo)
+            
+            lote = list(alvo[:limite])
+            job = job_registry.criar(username, chat_id, oab, unidade='processo')
+            job_registry.iniciar(job, executar_detalhes_lote(job, update, service, lote, titulo))
+            
+            mensagem = (
+                f"🔍 **Obtendo detalhes de {len(lote)} processos** ({titulo})\n"
+                f"⚡ Até {service.DETALHES_CONCORRENCIA} em paralelo\n"
+                f"🆔 **Job:** `{job.id}`\n"
+            )
+            if total > limite:
+                mensagem += f"⚠️ Limitado aos primeiros {limite} de {total} processos\n"
+            mensagem += "\n💡 `/status` - Acompanhar | `/cancelar` - Interromper"
+            await update.message.reply_text(mensagem)
+        
         elif texto.startswith('/detalhes_'):
             processo_id = texto[10:]
             numero = service.obter_numero_por_id(processo_id)
@@ -1139,55 +5214,54 @@ async def handle_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text(numero)
                 return
             
-            await update.message.reply_text("🔍 **Obtendo detalhes COMPLETOS do processo...**")
+            detalhes = result_cache.get_detalhes(processo_id)
+            if detalhes is not None:
+                try:
+                    await enviar_detalhes_processo(update, service, numero, detalhes, username)
+                except Exception as e:
+                    await update.message.reply_text(f"❌ **Erro ao obter detalhes:** {str(e)}")
+                return
             
-            try:
-                detalhes = await service.obter_detalhes_processo(processo_id, update)
-                
-                if isinstance(detalhes, str):
-                    await update.message.reply_text(detalhes)
-                else:
-                    mensagem_detalhes = service.formatar_detalhes_processo(numero, detalhes)
-                    user_type = "👑 **Admin**" if license_manager.is_admin(username) else "👤 **Licenciado**"
-                    header_detalhes = f"{user_type}: @{username}\n🔢 **Processo:** {numero}\n\n"
-                    
-                    if len(mensagem_detalhes) > 4096:
-                        partes = [mensagem_detalhes[i:i+4000] for i in range(0, len(mensagem_detalhes), 4000)]
-                        for parte in partes:
-                            await update.message.reply_text(header_detalhes + parte)
-                    else:
-                        await update.message.reply_text(header_detalhes + mensagem_detalhes)
-            except Exception as e:
-                await update.message.reply_text(f"❌ **Erro ao obter detalhes:** {str(e)}")
+            # Sem cache: entra na fila do agendador em segundo plano, sem segurar o handler
+            job = job_registry.criar(username, chat_id, oab, unidade='processo')
+            job_registry.iniciar(job, executar_detalhes_processo(job, update, service, processo_id, numero, username))
+            await update.message.reply_text(
+                f"🔍 **Obtendo detalhes COMPLETOS do processo...**\n"
+                f"🆔 **Job:** `{job.id}`\n\n"
+                f"💡 `/status` - Acompanhar | `/cancelar` - Interromper"
+            )
         
         elif texto == '/stats':
-            anos = service.agrupar_por_ano(processos)
+            anos = agregados.agrupado()
             
             user_type = "👑 **Admin**" if license_manager.is_admin(username) else "👤 **Licenciado**"
             mensagem = f"📊 **ESTATÍSTICAS - {oab}**\n\n"
             mensagem += f"{user_type}: @{username}\n"
-            mensagem += f"📈 **Total:** {len(processos)} processos\n\n"
+            mensagem += f"📈 **Total:** {agregados.total} processos\n\n"
             
             for ano, procs in anos.items():
                 mensagem += f"**{ano}:** {len(procs)} processos\n"
-                classes = {}
-                for p in procs:
-                    classe = p['classe']
-                    classes[classe] = classes.get(classe, 0) + 1
+                periodo = agregados.periodo(ano)
+                if periodo:
+                    mensagem += f"   📅 {periodo[0].strftime('%d/%m/%Y')} - {periodo[1].strftime('%d/%m/%Y')}\n"
                 
-                classes_comuns = sorted(classes.items(), key=lambda x: x[1], reverse=True)[:2]
-                for classe, count in classes_comuns:
+                for classe, count in agregados.classes_comuns(ano, 2):
                     mensagem += f"   └ {classe[:25]}: {count}\n"
                 mensagem += "\n"
             
+            assuntos_comuns = agregados.assuntos_comuns(5)
+            if assuntos_comuns:
+                mensagem += "📝 **Assuntos mais frequentes:**\n"
+                for assunto, count in assuntos_comuns:
+                    mensagem += f"   └ {assunto[:30]}: {count}\n"
+            
             await update.message.reply_text(mensagem)
         
         elif texto.startswith('/') and texto[1:].isdigit():
             ano = int(texto[1:])
-            anos = service.agrupar_por_ano(processos)
+            processos_ano = agregados.processos_do_ano(ano)
             
-            if ano in anos:
-                processos_ano = anos[ano]
+            if processos_ano:
                 mensagem = service.formatar_processos_ano(processos_ano, ano)
                 
                 if len(mensagem) > 4096:
@@ -1205,6 +5279,13 @@ async def handle_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await update.message.reply_text(f"❌ **Erro no comando:** {str(e)}")
 
+def formatar_cota(username):
+    """Cota da licença e uso atual, ex: '30/h (usadas 2) | 200/dia (usadas 15)'"""
+    por_hora, por_dia = license_manager.cotas(username)
+    na_hora, no_dia = license_manager.uso(username)
+    return (f"{por_hora or '∞'}/h (usadas {na_hora}) | "
+            f"{por_dia or '∞'}/dia (usadas {no_dia})")
+
 async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comandos administrativos para gerenciar licenças"""
     username = update.message.from_user.username or "Anônimo"
@@ -1260,6 +5341,27 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             await update.message.reply_text("❌ **Uso correto:** `/revogar @username`\nEx: `/revogar joaosilva`")
     
+    elif texto.startswith('/cota '):
+        partes = texto.split()
+        try:
+            target_username = partes[1].replace('@', '')
+            por_hora, por_dia = int(partes[2]), int(partes[3])
+        except (IndexError, ValueError):
+            await update.message.reply_text(
+                "❌ **Uso correto:** `/cota @username por_hora por_dia`\n"
+                "Ex: `/cota joaosilva 10 50` (`0` = sem limite)"
+            )
+            return
+        
+        if license_manager.definir_cota(target_username, por_hora, por_dia):
+            await update.message.reply_text(
+                f"✅ **Cota atualizada!**\n\n"
+                f"👤 **Usuário:** @{target_username}\n"
+                f"🎫 **Cota:** {formatar_cota(target_username)}"
+            )
+        else:
+            await update.message.reply_text(f"❌ Licença não encontrada para @{target_username} (ou falha ao salvar no Gist)")
+    
     elif texto == '/licencas':
         active_licenses = license_manager.list_licenses()
         if active_licenses:
@@ -1309,6 +5411,22 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await update.message.reply_text("❌ **Falha na sincronização!**\nVerifique as configurações do Gist.")
     
+    elif texto == '/trace' or texto.startswith('/trace '):
+        """Últimas requisições lentas com a árvore de spans"""
+        partes = texto.split()
+        quantidade = int(partes[1]) if len(partes) > 1 and partes[1].isdigit() else 3
+        traces = tracer.ultimos_lentos(min(quantidade, 20))
+        
+        if not traces:
+            await update.message.reply_text(f"✅ **Nenhuma requisição acima de {tracer.limite_ms:.0f} ms**")
+            return
+        
+        for trace in traces:
+            await update.message.reply_text(
+                f"🐢 **{trace['iniciado_em']}** - trace `{trace['trace_id']}`\n"
+                f"```\n{Tracer.formatar(trace)[:3500]}\n```"
+            )
+    
     elif texto == '/admin':
         await update.message.reply_text(
             "👑 **PAINEL ADMINISTRATIVO**\n\n"
@@ -1317,7 +5435,9 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "• `/revogar @username` - Revogar licença\n"
             "• `/licencas` - Listar licenças ativas\n"
             "• `/giststatus` - Status do Gist\n"
-            "• `/sync` - Sincronizar licenças\n\n"
+            "• `/sync` - Sincronizar licenças\n"
+            "• `/cota @username hora dia` - Consultas ao TJSP por hora/dia\n"
+            "• `/trace [n]` - Últimas requisições lentas\n\n"
             "💡 **Exemplos:**\n"
             "`/addlicenca joaosilva 7` - 7 dias\n"
             "`/addlicenca maria 30` - 30 dias\n"
@@ -1343,21 +5463,34 @@ async def invalid_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 def setup_bot():
     """Configura e inicia o bot"""
     try:
-        app_bot = Application.builder().token(BOT_TOKEN).build()
+        builder = Application.builder().token(BOT_TOKEN).request(
+            MetricsHTTPXRequest(connection_pool_size=256)
+        )
+        # TELEGRAM_API_URL aponta o bot para uma Bot API local (tools/mock_telegram.py)
+        api_url = os.environ.get('TELEGRAM_API_URL')
+        if api_url:
+            builder = builder.base_url(f"{api_url.rstrip('/')}/bot").base_file_url(f"{api_url.rstrip('/')}/file/bot")
+        app_bot = builder.build()
         
         # Comandos principais
         app_bot.add_handler(CommandHandler("start", start))
         app_bot.add_handler(CommandHandler("licenca", handle_commands))
         app_bot.add_handler(CommandHandler("limpar", handle_commands))
+        app_bot.add_handler(CommandHandler("status", status_consulta))
+        app_bot.add_handler(CommandHandler("cancelar", cancelar_consulta))
+        app_bot.add_handler(CommandHandler("monitorar", monitorar_oab))
+        app_bot.add_handler(CommandHandler("desmonitorar", monitorar_oab))
         app_bot.add_handler(CommandHandler("admin", admin_commands))
         app_bot.add_handler(CommandHandler("giststatus", admin_commands))
         app_bot.add_handler(CommandHandler("sync", admin_commands))
+        app_bot.add_handler(CommandHandler("trace", admin_commands))
         
         # Comandos administrativos
         app_bot.add_handler(MessageHandler(
             filters.TEXT & filters.COMMAND & (
                 filters.Regex(r'^/addlicenca\s+@?\w+') |
                 filters.Regex(r'^/revogar\s+@?\w+') |
+                filters.Regex(r'^/cota\s+@?\w+') |
                 filters.Regex(r'^/licencas$')
             ), admin_commands
         ))
@@ -1368,6 +5501,7 @@ def setup_bot():
                 filters.Regex(r'^/todos$') | filters.Regex(r'^/todos@\w+$') |
                 filters.Regex(r'^/nums$') | filters.Regex(r'^/nums@\w+$') |
                 filters.Regex(r'^/stats$') | filters.Regex(r'^/stats@\w+$') |
+                filters.Regex(r'^/exportar(\s+\w+)?$') | filters.Regex(r'^/exportar@\w+(\s+\w+)?$') |
                 filters.Regex(r'^/buscar\s+.+') | filters.Regex(r'^/buscar@\w+\s+.+') |
                 filters.Regex(r'^/\d{4}$') | filters.Regex(r'^/\d{4}@\w+$') |
                 filters.Regex(r'^/link_\w+') | filters.Regex(r'^/link_\w+@\w+') |
@@ -1390,7 +5524,7 @@ def setup_bot():
         print("🤖 Bot TJSP - CONFIGURADO PARA RENDER + GIST")
         print(f"🔑 Token: {BOT_TOKEN[:10]}...")
         print(f"🔗 Gist: {license_manager.gist_id or 'Não configurado'}")
-        print("🚀 Iniciando polling...")
+        print("🚀 Iniciando...")
         
         return app_bot
         
@@ -1398,22 +5532,107 @@ def setup_bot():
         print(f"❌ Erro na configuração do bot: {e}")
         return None
 
-def run_flask():
-    """Executa Flask em porta dinâmica"""
+async def iniciar_servidor_web(bot_app):
+    """Sobe /, /health e /webhook no event loop do bot (porta dinâmica do Render)"""
+    web_app = web.Application()
+    web_app['bot_app'] = bot_app
+    web_app['estado'] = {'modo': 'iniciando'}
+    web_app.add_routes(routes)
+    metrics.gauge_dinamico('tjsp_fila_updates', 'Updates do Telegram aguardando processamento',
+                           bot_app.update_queue.qsize)
+    
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
     port = int(os.environ.get("PORT", 10000))
-    print(f"🌐 Flask rodando na porta {port}")
-    app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    print(f"🌐 Servidor HTTP rodando na porta {port}")
+    return runner, web_app['estado']
+
+async def configurar_webhook(bot_app):
+    """Registra o webhook no Telegram; retorna False para cair no polling"""
+    webhook_url = os.environ.get('WEBHOOK_URL') or os.environ.get('RENDER_EXTERNAL_URL')
+    try:
+        if not webhook_url:
+            raise RuntimeError("WEBHOOK_URL não configurada")
+        if not WEBHOOK_SECRET:
+            # Um segredo previsível (ou diferente em cada réplica) deixaria /webhook aberto ou quebrado
+            raise RuntimeError("WEBHOOK_SECRET não configurado")
+        await bot_app.bot.set_webhook(
+            url=f"{webhook_url.rstrip('/')}/webhook",
+            secret_token=WEBHOOK_SECRET,
+            # Updates que chegaram durante o deploy ficam no Telegram e são entregues ao novo processo
+            drop_pending_updates=False,
+            allowed_updates=Update.ALL_TYPES
+        )
+        print(f"🔗 Webhook configurado: {webhook_url.rstrip('/')}/webhook")
+        return True
+    except Exception as e:
+        print(f"❌ Falha ao configurar webhook ({e}) - usando polling")
+        return False
+
+async def run_bot_async():
+    """Bot, servidor HTTP e Chromium no mesmo event loop (BOT_MODE=webhook ou polling)"""
+    bot_app = setup_bot()
+    if not bot_app:
+        return
+    inicializacao.marco('setup_bot')
+    
+    # Gist e Chromium sobem em paralelo com o servidor HTTP e o Telegram
+    tarefas_fundo = [asyncio.create_task(license_manager.carregar_em_segundo_plano())]
+    if not scrape_workers.ativo:
+        tarefas_fundo.append(asyncio.create_task(browser_pool.aquecer()))
+    
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sinal, parar.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    
+    runner, estado = await iniciar_servidor_web(bot_app)
+    inicializacao.marco('servidor_http')
+    await bot_app.initialize()
+    inicializacao.marco('telegram')
+    
+    modo = os.environ.get('BOT_MODE', 'polling').lower()
+    if modo == 'webhook' and not await configurar_webhook(bot_app):
+        modo = 'polling'
+    if modo != 'webhook':
+        modo = 'polling'
+        await bot_app.updater.start_polling(
+            drop_pending_updates=True,
+            allowed_updates=Update.ALL_TYPES
+        )
+    
+    await bot_app.start()
+    estado['modo'] = modo
+    inicializacao.marco(modo)
+    inicializacao.total()
+    print(f"✅ Bot rodando em modo {modo}")
+    monitoramento = asyncio.create_task(watchlist.executar(bot_app.bot))
+    
+    try:
+        await parar.wait()
+    finally:
+        print("🛑 Encerrando bot...")
+        monitoramento.cancel()
+        for tarefa in tarefas_fundo:
+            tarefa.cancel()
+        await runner.cleanup()
+        if bot_app.updater.running:
+            await bot_app.updater.stop()
+        await bot_app.stop()
+        await bot_app.shutdown()
+        await scrape_workers.parar()
+        await browser_pool.fechar()
 
 def run_bot():
     """Executa o bot"""
     try:
-        bot_app = setup_bot()
-        if bot_app:
-            bot_app.run_polling(
-                drop_pending_updates=True,
-                allowed_updates=Update.ALL_TYPES,
-                close_loop=False
-            )
+        asyncio.run(run_bot_async())
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print(f"❌ Erro no bot: {e}")
         import traceback
@@ -1429,9 +5648,8 @@ if __name__ == "__main__":
     print(f"👑 Admins: {license_manager.admins}")
     print("=" * 60)
     
-    # Iniciar Flask em thread separada
-    flask_thread = Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    # Workers de scraping sobem antes das threads e do event loop
+    scrape_workers.iniciar()
     
-    # Iniciar bot
+    # Iniciar bot (servidor HTTP roda no mesmo event loop)
     run_bot()
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""Importa o main.py do bot num diretório temporário (ele grava caches e sessões no diretório atual)."""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault('BOT_TOKEN', '1:teste')
+os.chdir(tempfile.mkdtemp(prefix='tjspbot_testes_'))
+
+
+@pytest.fixture(scope='session')
+def bot():
+    import main
+    return main
+
+
+@pytest.fixture(scope='session')
+def redis_url():
+    """tools/fake_redis.py numa porta livre"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        porta = s.getsockname()[1]
+    servidor = subprocess.Popen(
+        [sys.executable, os.path.join(RAIZ, 'tools', 'fake_redis.py'), '--port', str(porta)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        limite = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', porta), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > limite:
+                    raise
+                time.sleep(0.05)
+        yield f"redis://127.0.0.1:{porta}/0"
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+
+@pytest.fixture
+def redis_backend(bot, redis_url, request):
+    """RedisStateBackend com prefixo próprio por teste"""
+    return bot.RedisStateBackend.from_url(redis_url, prefixo=f"teste_{request.node.name}")
+
+
+def processo(i, ano=2024):
+    return {
+        'id': f"id{i}",
+        'numero': f"{i:07d}-12.{ano}.8.26.0100",
+        'classe': 'Procedimento Comum Cível',
+        'assunto': 'Cobrança',
+        'ano': ano,
+        'data_movimentacao': '10/01/2024',
+        'advogado': 'Fulano de Tal'
+    }
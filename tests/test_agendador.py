@@ -0,0 +1,133 @@
+import asyncio
+
+
+def test_admins_primeiro_e_rodizio_entre_usuarios(bot):
+    async def cenario():
+        agendador = bot.ScrapeScheduler(capacidade=1)
+        atendidos = []
+        liberar = asyncio.Event()
+
+        async def ocupar():
+            async with agendador.vez('dono'):
+                await liberar.wait()
+
+        async def pedir(usuario, admin=False, rotulo=None):
+            async with agendador.vez(usuario, admin):
+                atendidos.append(rotulo or usuario)
+
+        dono = asyncio.create_task(ocupar())
+        await asyncio.sleep(0)
+        tarefas = [asyncio.create_task(pedir('ana', rotulo=f"ana{i}")) for i in range(3)]
+        tarefas.append(asyncio.create_task(pedir('bia')))
+        tarefas.append(asyncio.create_task(pedir('admin', admin=True)))
+        await asyncio.sleep(0)
+
+        assert agendador.aguardando() == 5
+        assert agendador.em_execucao == 1
+        liberar.set()
+        await asyncio.gather(dono, *tarefas)
+        return atendidos, agendador.em_execucao
+
+    atendidos, em_execucao = asyncio.run(cenario())
+    assert atendidos == ['admin', 'ana0', 'bia', 'ana1', 'ana2']
+    assert em_execucao == 0
+
+
+def test_posicao_e_aviso_da_fila(bot):
+    async def cenario():
+        agendador = bot.ScrapeScheduler(capacidade=1)
+        avisos = []
+
+        async def avisar(texto):
+            avisos.append(texto)
+
+        liberar = asyncio.Event()
+
+        async def ocupar():
+            async with agendador.vez('dono'):
+                await liberar.wait()
+
+        async def pedir(usuario, chave):
+            async with agendador.vez(usuario, chave=chave, avisar=avisar):
+                pass
+
+        dono = asyncio.create_task(ocupar())
+        await asyncio.sleep(0)
+        primeiro = asyncio.create_task(pedir('ana', 'a'))
+        segundo = asyncio.create_task(pedir('bia', 'b'))
+        await asyncio.sleep(0)
+        posicoes = agendador.posicao('a'), agendador.posicao('b'), agendador.posicao('x')
+        liberar.set()
+        await asyncio.gather(dono, primeiro, segundo)
+        return posicoes, avisos
+
+    posicoes, avisos = asyncio.run(cenario())
+    assert posicoes == (1, 2, None)
+    assert sum('Na fila' in aviso for aviso in avisos) == 2
+    assert sum('Sua vez' in aviso for aviso in avisos) == 2
+
+
+def test_cancelar_na_fila_nao_ocupa_vaga(bot):
+    async def cenario():
+        agendador = bot.ScrapeScheduler(capacidade=1)
+        liberar = asyncio.Event()
+        atendidos = []
+
+        async def ocupar():
+            async with agendador.vez('dono'):
+                await liberar.wait()
+
+        async def pedir(usuario):
+            async with agendador.vez(usuario):
+                atendidos.append(usuario)
+
+        dono = asyncio.create_task(ocupar())
+        await asyncio.sleep(0)
+        desistente = asyncio.create_task(pedir('ana'))
+        seguinte = asyncio.create_task(pedir('bia'))
+        await asyncio.sleep(0)
+
+        desistente.cancel()
+        await asyncio.sleep(0)
+        aguardando = agendador.aguardando()
+        liberar.set()
+        await asyncio.gather(dono, seguinte)
+        return desistente.cancelled(), aguardando, atendidos, agendador.em_execucao
+
+    cancelado, aguardando, atendidos, em_execucao = asyncio.run(cenario())
+    assert cancelado
+    assert aguardando == 1
+    assert atendidos == ['bia']
+    assert em_execucao == 0
+
+
+def test_cancelar_depois_de_receber_a_vez_devolve_a_vaga(bot):
+    async def cenario():
+        agendador = bot.ScrapeScheduler(capacidade=1)
+        liberar = asyncio.Event()
+        atendidos = []
+        tarefas = {}
+
+        async def ocupar():
+            async with agendador.vez('dono'):
+                await liberar.wait()
+            # A vaga acabou de ser concedida à 'ana'; a tarefa é cancelada antes de usá-la
+            tarefas['ana'].cancel()
+
+        async def pedir(usuario):
+            async with agendador.vez(usuario):
+                atendidos.append(usuario)
+
+        dono = asyncio.create_task(ocupar())
+        await asyncio.sleep(0)
+        tarefas['ana'] = asyncio.create_task(pedir('ana'))
+        seguinte = asyncio.create_task(pedir('bia'))
+        await asyncio.sleep(0)
+
+        liberar.set()
+        await asyncio.gather(dono, tarefas['ana'], seguinte, return_exceptions=True)
+        return atendidos, agendador.em_execucao, agendador.aguardando()
+
+    atendidos, em_execucao, aguardando = asyncio.run(cenario())
+    assert atendidos == ['bia']
+    assert (em_execucao, aguardando) == (0, 0)
@@ -0,0 +1,48 @@
+from conftest import processo
+
+
+def indice_de(bot, processos):
+    return bot.SearchIndex(bot.ProcessoStore(processos))
+
+
+def test_numero_por_prefixo(bot):
+    indice = indice_de(bot, [processo(1234), processo(1230), processo(99)])
+
+    assert [p['id'] for p in indice.buscar(processo(1234)['numero'])] == ['id1234']
+    assert [p['id'] for p in indice.buscar('000123')] == ['id1234', 'id1230']
+
+
+def test_numero_por_trecho_quando_nenhum_prefixo_casa(bot):
+    indice = indice_de(bot, [processo(1234), processo(5678)])
+    assert [p['id'] for p in indice.buscar('5678-12')] == ['id5678']
+    assert indice.buscar('31415926') == []
+
+
+def test_texto_sem_acento_todas_as_palavras_e_prefixo(bot):
+    processos = [
+        dict(processo(1), classe='Execução de Título Extrajudicial', assunto='Cobrança'),
+        dict(processo(2), classe='Procedimento Comum Cível', assunto='Cobrança de Aluguéis'),
+        dict(processo(3), classe='Procedimento Comum Cível', assunto='Indenização'),
+    ]
+    indice = indice_de(bot, processos)
+
+    assert [p['id'] for p in indice.buscar('EXECUCAO')] == ['id1']
+    assert [p['id'] for p in indice.buscar('cobranca alug')] == ['id2']
+    assert {p['id'] for p in indice.buscar('proced')} == {'id2', 'id3'}
+    assert indice.buscar('cobranca indenizacao') == []
+
+
+def test_texto_pesa_o_campo_e_desempata_pelo_ano(bot):
+    processos = [
+        dict(processo(1, ano=2022), classe='Procedimento Comum Cível', assunto='Família'),
+        dict(processo(2, ano=2021), classe='Família', assunto='Alimentos'),
+        dict(processo(3, ano=2024), classe='Procedimento Comum Cível', assunto='Família'),
+    ]
+    indice = indice_de(bot, processos)
+    # classe pesa mais que assunto; entre pesos iguais o mais recente vem antes
+    assert [p['id'] for p in indice.buscar('familia')] == ['id2', 'id3', 'id1']
+    assert [p['id'] for p in indice.buscar('2021')] == ['id2']
+
+
+def test_termo_vazio(bot):
+    assert indice_de(bot, [processo(1)]).buscar('   ') == []
@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import pytest
+
+
+@pytest.fixture
+def limitador(bot, monkeypatch):
+    monkeypatch.delenv('SCRAPE_WORKERS', raising=False)
+    monkeypatch.setenv('ESAJ_TAXA', '2')
+    monkeypatch.setenv('ESAJ_TAXA_MIN', '0.2')
+    monkeypatch.setenv('ESAJ_RAJADA', '4')
+    monkeypatch.setenv('ESAJ_LATENCIA_ALVO', '5')
+    monkeypatch.setenv('ESAJ_CIRCUITO_FALHAS', '3')
+    monkeypatch.setenv('ESAJ_CIRCUITO_SEGUNDOS', '60')
+    return bot.EsajRateLimiter()
+
+
+def test_aimd_cai_pela_metade_e_sobe_devagar(limitador):
+    limitador.registrar('pagina', 1.0, erro=True)
+    assert limitador.taxa == pytest.approx(1.0)
+    limitador.registrar('pagina', 1.0)
+    assert limitador.taxa == pytest.approx(1.1)
+    limitador.registrar('pagina', 9.0)
+    assert limitador.taxa == pytest.approx(1.1 * 0.85)
+
+
+def test_aimd_respeita_minimo_e_maximo(limitador):
+    for _ in range(10):
+        limitador.registrar('pagina', 1.0, erro=True)
+        # Sem abrir o circuito: só a taxa interessa aqui
+        limitador.falhas_seguidas = 0
+    assert limitador.taxa == pytest.approx(0.2)
+    for _ in range(100):
+        limitador.registrar('pagina', 0.1)
+    assert limitador.taxa == pytest.approx(2.0)
+
+
+def test_circuito_abre_apos_falhas_seguidas(limitador):
+    limitador.registrar('pagina', 1.0, erro=True)
+    limitador.registrar('pagina', 1.0)
+    limitador.registrar('pagina', 1.0, erro=True)
+    limitador.registrar('pagina', 1.0, erro=True)
+    assert limitador.estado == 'fechado'
+
+    limitador.registrar('pagina', 1.0, erro=True)
+    assert limitador.estado == 'aberto'
+    assert limitador.tokens == 0
+    assert limitador.aberto_ate - time.monotonic() == pytest.approx(60, abs=1)
+
+
+def test_meio_aberto_libera_uma_sonda(limitador):
+    async def cenario():
+        for _ in range(3):
+            limitador.registrar('pagina', 1.0, erro=True)
+        limitador.aberto_ate = time.monotonic() - 1
+        assert limitador.estado == 'meio_aberto'
+
+        sonda = await limitador.adquirir('pagina')
+        segunda = asyncio.create_task(limitador.adquirir('pagina'))
+        await asyncio.sleep(0.05)
+        esperando = not segunda.done()
+        segunda.cancel()
+        return sonda, esperando
+
+    sonda, esperando = asyncio.run(cenario())
+    assert sonda and esperando
+
+
+def test_sonda_com_erro_reabre_com_pausa_dobrada(limitador):
+    for _ in range(3):
+        limitador.registrar('pagina', 1.0, erro=True)
+    limitador.aberto_ate = time.monotonic() - 1
+    limitador.sondando = True
+
+    limitador.registrar('pagina', 1.0, erro=True, sonda=True)
+    assert limitador.estado == 'aberto'
+    assert limitador.pausa == 120
+    assert not limitador.sondando
+
+
+def test_sonda_com_sucesso_fecha_e_zera_a_pausa(limitador):
+    for _ in range(3):
+        limitador.registrar('pagina', 1.0, erro=True)
+    limitador.pausa = 240
+    limitador.aberto_ate = time.monotonic() - 1
+    limitador.sondando = True
+
+    limitador.registrar('pagina', 1.0, sonda=True)
+    assert limitador.estado == 'fechado'
+    assert limitador.pausa == 60
+    assert limitador.falhas_seguidas == 0
+
+
+def test_sonda_cancelada_libera_a_vez_de_teste(limitador):
+    async def cenario():
+        for _ in range(3):
+            limitador.registrar('pagina', 1.0, erro=True)
+        limitador.aberto_ate = time.monotonic() - 1
+
+        async def navegar():
+            async with limitador.requisicao('pagina'):
+                await asyncio.sleep(10)
+
+        tarefa = asyncio.create_task(navegar())
+        await asyncio.sleep(0.01)
+        sondando = limitador.sondando
+        tarefa.cancel()
+        await asyncio.gather(tarefa, return_exceptions=True)
+        return sondando
+
+    assert asyncio.run(cenario())
+    assert not limitador.sondando
+    assert limitador.estado == 'meio_aberto'
+
+
+def test_token_bucket_espera_quando_a_rajada_acaba(limitador):
+    async def cenario():
+        limitador.taxa = 20
+        inicio = time.monotonic()
+        for _ in range(5):
+            await limitador.adquirir('pagina')
+        return time.monotonic() - inicio
+
+    # 4 tokens de rajada; o quinto espera ~1/20 s
+    assert 0.03 < asyncio.run(cenario()) < 1
@@ -0,0 +1,79 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import processo
+
+
+@pytest.fixture
+def snapshots(bot, tmp_path):
+    store = bot.SnapshotStore(str(tmp_path / 'processos'))
+    store.manter = 3
+    store.max_dias = 30
+    return store
+
+
+def arquivos(store):
+    return sorted(nome for nome in os.listdir(store.diretorio) if nome.endswith('.jsonl.gz'))
+
+
+def test_conteudo_repetido_so_atualiza_a_data(snapshots):
+    processos = [processo(i) for i in range(3)]
+    primeiro = snapshots.salvar('123456SP', processos)
+    antes = snapshots.ultimo('123456SP')['consultado_em']
+
+    assert snapshots.salvar('123456SP', processos) == primeiro
+    assert len(snapshots.listar('123456SP')) == 1
+    assert len(arquivos(snapshots)) == 1
+    assert snapshots.ultimo('123456SP')['consultado_em'] >= antes
+    assert list(snapshots.carregar('123456SP')) == processos
+
+
+def test_repetido_volta_a_ser_o_mais_recente(snapshots):
+    a, b = [processo(1)], [processo(2)]
+    snapshots.salvar('123456SP', a)
+    snapshots.salvar('123456SP', b)
+    snapshots.salvar('123456SP', a)
+
+    assert [s['total'] for s in snapshots.listar('123456SP')] == [1, 1]
+    assert list(snapshots.carregar('123456SP')) == a
+    assert len(arquivos(snapshots)) == 2
+
+
+def test_retencao_mantem_os_ultimos_e_o_ultimo_completo(snapshots):
+    snapshots.salvar('123456SP', [processo(0)])
+    for i in range(1, 5):
+        snapshots.salvar('123456SP', [processo(i)], incompleto=True)
+
+    listados = snapshots.listar('123456SP')
+    # 3 mais recentes (incompletos) + o último completo, mesmo fora da janela
+    assert [s['incompleto'] for s in listados] == [True, True, True, False]
+    assert len(arquivos(snapshots)) == 4
+    assert list(snapshots.carregar('123456SP', snapshots.ultimo('123456SP', completo=True)['arquivo'])) == [processo(0)]
+
+
+def test_retencao_descarta_os_antigos(snapshots):
+    snapshots.salvar('123456SP', [processo(1)])
+    snapshots.salvar('123456SP', [processo(2)])
+    indice = snapshots._ler_indice()
+    velho = (datetime.now() - timedelta(days=31)).isoformat()
+    indice['123456SP'][1]['consultado_em'] = velho
+    indice['123456SP'][0]['incompleto'] = False
+    snapshots._gravar_indice(indice)
+
+    snapshots.salvar('123456SP', [processo(3)])
+    assert [s['total'] for s in snapshots.listar('123456SP')] == [1, 1]
+    assert velho not in [s['consultado_em'] for s in snapshots.listar('123456SP')]
+    assert len(arquivos(snapshots)) == 2
+
+
+def test_oabs_nao_se_misturam(snapshots):
+    snapshots.salvar('123456SP', [processo(1)])
+    snapshots.salvar('654321SP', [processo(2)])
+    assert list(snapshots.carregar('123456SP')) == [processo(1)]
+    assert list(snapshots.carregar('654321SP')) == [processo(2)]
+    assert snapshots.ultimo('000000SP') is None
+    with open(snapshots.caminho_indice, encoding='utf-8') as f:
+        assert sorted(json.load(f)) == ['123456SP', '654321SP']
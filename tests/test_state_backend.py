@@ -0,0 +1,126 @@
+import pickle
+from datetime import datetime
+
+from conftest import processo
+
+
+def test_redis_valores_voltam_com_os_tipos(bot, redis_backend):
+    agora = datetime(2024, 5, 17, 10, 30, 15)
+    store = bot.ProcessoStore([processo(1), processo(2, ano=2023)])
+    store.incompleto = True
+    store.pagina_falha = 7
+    redis_backend.set('t', 'valor', {'quando': agora, 'ids': {'a', 'b'}, 'processos': store, 'lista': [1, 'x', None]})
+
+    valor = redis_backend.get('t', 'valor')
+    assert valor['quando'] == agora
+    assert valor['ids'] == {'a', 'b'}
+    assert valor['lista'] == [1, 'x', None]
+    assert isinstance(valor['processos'], bot.ProcessoStore)
+    assert [dict(p) for p in valor['processos']] == [processo(1), processo(2, ano=2023)]
+    assert valor['processos'].incompleto and valor['processos'].pagina_falha == 7
+
+
+def test_redis_get_many_em_blocos_e_ausentes(redis_backend):
+    redis_backend.LOTE_MGET = 3
+    redis_backend.set_many('t', {f"k{i}": i for i in range(10)})
+    valores = redis_backend.get_many('t', [f"k{i}" for i in range(12)])
+    assert valores == {f"k{i}": i for i in range(10)}
+    assert sorted(redis_backend.keys('t')) == sorted(f"k{i}" for i in range(10))
+    redis_backend.delete('t', 'k0')
+    assert redis_backend.get('t', 'k0', 'padrao') == 'padrao'
+
+
+def test_redis_contador_com_ttl(redis_backend):
+    assert redis_backend.incr('c', 'x', ttl=60) == 1
+    assert redis_backend.incr('c', 'x', 2, ttl=60) == 3
+    assert redis_backend.incr('c', 'x', -1) == 2
+    assert redis_backend.get_counter('c', 'x') == 2
+    assert redis_backend.get_counter('c', 'y') == 0
+    ttl = redis_backend._comando(('TTL', redis_backend._chave('c', 'x')))[0]
+    assert 0 < ttl <= 60
+
+
+def test_redis_nao_desserializa_pickle(redis_backend):
+    class Explosivo:
+        def __reduce__(self):
+            return (exec, ("raise SystemExit('pickle executado')",))
+
+    redis_backend._comando(('SET', redis_backend._chave('t', 'p'), pickle.dumps(Explosivo())))
+    assert redis_backend.get('t', 'p') is None
+    assert redis_backend.get_many('t', ['p']) == {}
+
+
+def test_redis_arquivo_fora_do_diretorio_fica_ausente(bot, redis_backend, tmp_path):
+    fora = tmp_path / 'processos.sqlite'
+    fora.write_bytes(b'')
+    redis_backend.set('t', 'arquivo', bot.ProcessoArquivo(str(fora)))
+    arquivo = redis_backend.get('t', 'arquivo')
+    assert isinstance(arquivo, bot.ProcessoArquivo)
+    assert arquivo.ausente and len(arquivo) == 0
+
+
+def test_links_por_chave_no_redis(bot, redis_backend):
+    cache = bot.CacheManager(redis_backend)
+    cache.save_links([('id1', '0000001-12.2024.8.26.0100', 'https://esaj/1'), ('id2', '0000002-12.2024.8.26.0100', 'https://esaj/2')])
+    assert cache.get_link('id2', contar=False) == 'https://esaj/2'
+    assert cache.get_links(['id1', 'id3']) == {'id1': 'https://esaj/1'}
+    assert cache.find_by_numero('0000002-12.2024.8.26.0100') == 'id2'
+    assert cache.find_by_numero('9999999-12.2024.8.26.0100') is None
+
+
+def test_links_arquivo_local_so_acrescenta(bot, tmp_path):
+    def novo_cache():
+        cache = bot.CacheManager.__new__(bot.CacheManager)
+        cache.cache_file = str(tmp_path / 'links.jsonl')
+        cache.backend = bot.MemoryStateBackend()
+        return cache
+
+    cache = novo_cache()
+    cache.save_links([('id1', 'n1', 'l1'), ('id2', 'n2', 'l2')])
+    cache.save_links([('id1', 'n1', 'l1b')])
+    assert len((tmp_path / 'links.jsonl').read_text(encoding='utf-8').splitlines()) == 3
+
+    links = novo_cache()._load_cache()
+    assert {processo_id: info['link'] for processo_id, info in links.items()} == {'id1': 'l1b', 'id2': 'l2'}
+
+
+def test_checkpoint_grava_so_a_pagina_nova(bot, redis_backend):
+    checkpoints = bot.ScrapeCheckpoints(redis_backend)
+    processos = bot.ProcessoStore()
+    for pagina in range(1, 4):
+        novos = [processo(pagina * 10 + i) for i in range(5)]
+        processos.extend(novos)
+        checkpoints.salvar('123456SP', pagina, 3, processos, novos)
+
+    partes = redis_backend.get_many(checkpoints.NAMESPACE_PARTES, [f"123456SP:{parte}" for parte in range(4)])
+    assert sorted(partes) == ['123456SP:0', '123456SP:1', '123456SP:2']
+    assert all(len(parte) == 5 for parte in partes.values())
+
+    checkpoint = checkpoints.carregar('123456SP')
+    assert checkpoint['pagina'] == 3 and checkpoint['total_paginas'] == 3
+    assert [p['id'] for p in checkpoint['processos']] == [p['id'] for p in processos]
+
+    checkpoints.limpar('123456SP')
+    assert checkpoints.carregar('123456SP') is None
+    assert redis_backend.keys(checkpoints.NAMESPACE_PARTES) == []
+
+
+def test_checkpoint_de_outra_coleta_recomeca(bot):
+    checkpoints = bot.ScrapeCheckpoints(bot.MemoryStateBackend())
+    antigos = bot.ProcessoStore([processo(i) for i in range(4)])
+    checkpoints.salvar('123456SP', 2, 5, antigos, [processo(2), processo(3)])
+
+    nova_coleta = bot.ProcessoStore([processo(50), processo(51)])
+    checkpoints.salvar('123456SP', 1, 5, nova_coleta, list(nova_coleta))
+    assert [p['id'] for p in checkpoints.carregar('123456SP')['processos']] == ['id50', 'id51']
+
+
+def test_checkpoint_com_parte_expirada_e_descartado(bot):
+    backend = bot.MemoryStateBackend()
+    checkpoints = bot.ScrapeCheckpoints(backend)
+    processos = bot.ProcessoStore([processo(1)])
+    checkpoints.salvar('123456SP', 1, 2, processos, [processo(1)])
+    processos.append(processo(2))
+    checkpoints.salvar('123456SP', 2, 2, processos, [processo(2)])
+    backend.delete(checkpoints.NAMESPACE_PARTES, '123456SP:0')
+    assert checkpoints.carregar('123456SP') is None
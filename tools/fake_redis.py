@@ -0,0 +1,152 @@
+"""Servidor local que fala o protocolo Redis (RESP) para testar o RedisStateBackend.
+
+Implementa só os comandos usados pelo bot (GET/SET/MGET/DEL/SCAN/INCRBY/EXPIRE...).
+Os dados ficam em memória e somem ao encerrar.
+
+Uso:
+    python tools/fake_redis.py --port 6399
+    REDIS_URL=redis://localhost:6399/0 python main.py
+"""
+import argparse
+import asyncio
+import fnmatch
+import time
+
+
+class FakeRedis:
+    def __init__(self):
+        self.bancos = {}
+
+    def _banco(self, conexao):
+        return self.bancos.setdefault(conexao['db'], {})
+
+    def _valor(self, banco, chave):
+        item = banco.get(chave)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] < time.time():
+            del banco[chave]
+            return None
+        return item[0]
+
+    def executar(self, conexao, args):
+        comando = args[0].upper().decode()
+        args = args[1:]
+        banco = self._banco(conexao)
+
+        if comando == 'PING':
+            return ('+', 'PONG')
+        if comando in ('AUTH', 'CLIENT'):
+            return ('+', 'OK')
+        if comando == 'SELECT':
+            conexao['db'] = int(args[0])
+            return ('+', 'OK')
+        if comando == 'GET':
+            return self._valor(banco, args[0])
+        if comando == 'SET':
+            expira = None
+            opcoes = [a.upper() for a in args[2:]]
+            if b'EX' in opcoes:
+                expira = time.time() + int(args[2 + opcoes.index(b'EX') + 1])
+            if b'PX' in opcoes:
+                expira = time.time() + int(args[2 + opcoes.index(b'PX') + 1]) / 1000
+            banco[args[0]] = (args[1], expira)
+            return ('+', 'OK')
+        if comando == 'MGET':
+            return [self._valor(banco, chave) for chave in args]
+        if comando == 'DEL':
+            return sum(1 for chave in args if banco.pop(chave, None) is not None)
+        if comando == 'EXISTS':
+            return sum(1 for chave in args if self._valor(banco, chave) is not None)
+        if comando in ('INCR', 'INCRBY'):
+            quantidade = int(args[1]) if comando == 'INCRBY' else 1
+            atual = self._valor(banco, args[0])
+            novo = int(atual or 0) + quantidade
+            expira = banco[args[0]][1] if atual is not None else None
+            banco[args[0]] = (str(novo).encode(), expira)
+            return novo
+        if comando == 'EXPIRE':
+            if self._valor(banco, args[0]) is None:
+                return 0
+            banco[args[0]] = (banco[args[0]][0], time.time() + int(args[1]))
+            return 1
+        if comando == 'TTL':
+            if self._valor(banco, args[0]) is None:
+                return -2
+            expira = banco[args[0]][1]
+            return -1 if expira is None else int(expira - time.time())
+        if comando in ('KEYS', 'SCAN'):
+            padrao = b'*'
+            if comando == 'KEYS':
+                padrao = args[0]
+            elif b'MATCH' in [a.upper() for a in args]:
+                padrao = args[[a.upper() for a in args].index(b'MATCH') + 1]
+            chaves = [c for c in list(banco) if self._valor(banco, c) is not None
+                      and fnmatch.fnmatchcase(c.decode(), padrao.decode())]
+            return chaves if comando == 'KEYS' else [b'0', chaves]
+        if comando == 'FLUSHDB':
+            banco.clear()
+            return ('+', 'OK')
+        return ('-', f"ERR unknown command '{comando}'")
+
+
+def codificar(resposta):
+    if isinstance(resposta, tuple):
+        return f"{resposta[0]}{resposta[1]}\r\n".encode()
+    if resposta is None:
+        return b"$-1\r\n"
+    if isinstance(resposta, int):
+        return f":{resposta}\r\n".encode()
+    if isinstance(resposta, bytes):
+        return f"${len(resposta)}\r\n".encode() + resposta + b"\r\n"
+    if isinstance(resposta, list):
+        return f"*{len(resposta)}\r\n".encode() + b''.join(codificar(item) for item in resposta)
+    return codificar(str(resposta).encode())
+
+
+async def ler_comando(reader):
+    linha = await reader.readline()
+    if not linha:
+        return None
+    if not linha.startswith(b'*'):
+        return linha.strip().split()
+    args = []
+    for _ in range(int(linha[1:])):
+        tamanho = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(tamanho + 2))[:-2])
+    return args
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Stand-in local do Redis para o bot TJSP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6399)
+    args = parser.parse_args()
+
+    servidor_redis = FakeRedis()
+
+    async def atender(reader, writer):
+        conexao = {'db': 0}
+        try:
+            while True:
+                comando = await ler_comando(reader)
+                if not comando:
+                    break
+                if comando[0].upper() == b'QUIT':
+                    writer.write(b"+OK\r\n")
+                    break
+                writer.write(codificar(servidor_redis.executar(conexao, comando)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    servidor = await asyncio.start_server(atender, args.host, args.port)
+    print(f"🧪 Fake Redis em redis://{args.host}:{args.port}/0")
+    async with servidor:
+        await servidor.serve_forever()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,206 @@
+"""Servidor local que imita o cpopg do ESAJ para testes de carga do scraping sem acessar o TJSP.
+
+Rotas:
+    /cpopg/open.do                        tela de consulta (select cbPesquisa + campo_NUMOAB)
+    /cpopg/search.do                      primeira página de resultados da OAB
+    /cpopg/trocarPagina.do?paginaConsulta=N   demais páginas (OAB guardada no cookie de sessão)
+    /cpopg/show.do?processo.codigo=...    detalhes de um processo
+    /__stats                              contadores de requisições e erros injetados (JSON)
+
+Os processos de cada OAB são determinísticos (seed = OAB), então consultas
+repetidas devolvem as mesmas páginas.
+
+Uso:
+    python tools/mock_esaj.py --port 8089 --processos 300 --latencia-ms 200 --erro-taxa 0.02
+    ESAJ_BASE_URL=http://localhost:8089 python main.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from aiohttp import web  # noqa: E402
+
+from dados import gerar_processos  # noqa: E402
+from esaj_html import pagina_detalhes, pagina_inicial, pagina_resultados  # noqa: E402
+
+POR_PAGINA = 25
+
+
+class MockESAJ:
+    def __init__(self, processos=300, por_pagina=POR_PAGINA, latencia_ms=0, jitter_ms=0,
+                 erro_taxa=0.0, erro_paginas=(), lento_taxa=0.0, lento_ms=0, seed=None):
+        self.processos = processos
+        self.por_pagina = por_pagina
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.erro_taxa = erro_taxa
+        self.erro_paginas = set(erro_paginas)
+        self.lento_taxa = lento_taxa
+        self.lento_ms = lento_ms
+        self.random = random.Random(seed)
+        self.por_oab = {}
+        self.por_codigo = {}
+        self.stats = Counter()
+
+    def processos_da_oab(self, oab):
+        """Lista fixa de processos por OAB; OABs terminadas em 000 não têm processos"""
+        if oab not in self.por_oab:
+            quantidade = 0 if oab[:6].endswith('000') else self.processos
+            processos = gerar_processos(quantidade, seed=oab)
+            for processo in processos:
+                processo['id'] = hashlib.md5(f"{oab}{processo['id']}".encode()).hexdigest()[:10]
+                self.por_codigo[processo['id'].upper()[:10]] = processo
+            self.por_oab[oab] = processos
+        return self.por_oab[oab]
+
+    async def _atrasar(self):
+        atraso = self.latencia_ms + (self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if self.lento_taxa and self.random.random() < self.lento_taxa:
+            atraso += self.lento_ms
+            self.stats['lentas'] += 1
+        if atraso:
+            await asyncio.sleep(atraso / 1000)
+
+    def _falhar(self, pagina=None):
+        if pagina is not None and pagina in self.erro_paginas:
+            return True
+        return bool(self.erro_taxa) and self.random.random() < self.erro_taxa
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        self.stats['requisicoes'] += 1
+        self.stats[request.path] += 1
+        if request.path != '/__stats':
+            await self._atrasar()
+        return await handler(request)
+
+    def _erro(self):
+        self.stats['erros_injetados'] += 1
+        return web.Response(status=500, text="<html><body><h1>Erro interno do servidor</h1></body></html>",
+                            content_type='text/html')
+
+    async def open_do(self, request):
+        if self._falhar():
+            return self._erro()
+        return web.Response(text=pagina_inicial(), content_type='text/html')
+
+    def _pagina(self, oab, pagina):
+        processos = self.processos_da_oab(oab)
+        if not processos:
+            return web.Response(
+                text=pagina_inicial() + '<div class="unj-entity-header__summary">Não existem informações disponíveis '
+                                        'para os parâmetros informados.</div>',
+                content_type='text/html'
+            )
+        total_paginas = -(-len(processos) // self.por_pagina)
+        pagina = max(1, min(pagina, total_paginas))
+        inicio = (pagina - 1) * self.por_pagina
+        proxima = f"/cpopg/trocarPagina.do?paginaConsulta={pagina + 1}" if pagina < total_paginas else None
+        resposta = web.Response(
+            text=pagina_resultados(processos[inicio:inicio + self.por_pagina], inicio=inicio + 1,
+                                   total=len(processos), proxima=proxima),
+            content_type='text/html'
+        )
+        resposta.set_cookie('oab', oab)
+        return resposta
+
+    async def search_do(self, request):
+        oab = request.query.get('dadosConsulta.valorConsulta', '').strip().upper()
+        if request.query.get('cbPesquisa') != 'NUMOAB' or not oab:
+            return web.Response(status=400, text="Parâmetros de consulta inválidos")
+        if self._falhar(pagina=1):
+            return self._erro()
+        return self._pagina(oab, 1)
+
+    async def trocar_pagina(self, request):
+        oab = request.cookies.get('oab') or request.query.get('oab', '').upper()
+        if not oab:
+            # Sem sessão o ESAJ volta para a tela de consulta
+            raise web.HTTPFound('/cpopg/open.do')
+        try:
+            pagina = int(request.query.get('paginaConsulta', '1'))
+        except ValueError:
+            pagina = 1
+        if self._falhar(pagina=pagina):
+            return self._erro()
+        return self._pagina(oab, pagina)
+
+    async def show_do(self, request):
+        if self._falhar():
+            return self._erro()
+        processo = self.por_codigo.get(request.query.get('processo.codigo', '').upper())
+        if not processo:
+            return web.Response(text=pagina_inicial() + '<div class="mensagemRetorno">Número não localizado</div>',
+                                content_type='text/html')
+        return web.Response(text=pagina_detalhes(processo), content_type='text/html')
+
+    async def estatisticas(self, request):
+        return web.json_response(dict(self.stats))
+
+    def aplicacao(self):
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get('/cpopg/open.do', self.open_do)
+        app.router.add_get('/cpopg/search.do', self.search_do)
+        app.router.add_get('/cpopg/trocarPagina.do', self.trocar_pagina)
+        app.router.add_get('/cpopg/show.do', self.show_do)
+        app.router.add_get('/__stats', self.estatisticas)
+        return app
+
+
+async def iniciar(mock, host='127.0.0.1', port=8089):
+    """Sobe o mock no event loop atual e devolve o runner (para benchmarks in-process)"""
+    runner = web.AppRunner(mock.aplicacao(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--processos', type=int, default=300, help='processos por OAB')
+    parser.add_argument('--por-pagina', type=int, default=POR_PAGINA)
+    parser.add_argument('--latencia-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--erro-taxa', type=float, default=0.0, help='fração de respostas 500')
+    parser.add_argument('--erro-paginas', default='', help='páginas que sempre falham, ex: 3,7')
+    parser.add_argument('--lento-taxa', type=float, default=0.0, help='fração de respostas com atraso extra')
+    parser.add_argument('--lento-ms', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    return parser
+
+
+def mock_dos_argumentos(args):
+    return MockESAJ(
+        processos=args.processos, por_pagina=args.por_pagina, latencia_ms=args.latencia_ms,
+        jitter_ms=args.jitter_ms, erro_taxa=args.erro_taxa,
+        erro_paginas=[int(p) for p in args.erro_paginas.split(',') if p],
+        lento_taxa=args.lento_taxa, lento_ms=args.lento_ms, seed=args.seed,
+    )
+
+
+async def main():
+    args = criar_parser().parse_args()
+    mock = mock_dos_argumentos(args)
+    runner = await iniciar(mock, args.host, args.port)
+    print(f"🧪 Mock ESAJ em http://{args.host}:{args.port} ({args.processos} processos por OAB)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(json.dumps(dict(mock.stats)))
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,193 @@
+"""Servidor local que imita a Bot API do Telegram para testes de carga dos handlers.
+
+Implementa o necessário para o python-telegram-bot rodar em polling:
+getMe, getUpdates (long polling com offset), sendMessage, editMessageText,
+sendDocument, sendChatAction e os métodos de webhook/comandos (sempre ok).
+Updates de usuários são injetados com MockTelegram.enviar_mensagem() ou
+POST /__enviar; as mensagens do bot ficam registradas por chat.
+
+Uso:
+    python tools/mock_telegram.py --port 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123:teste python main.py
+    curl -d '{"chat_id": 1, "username": "teste", "texto": "/start"}' http://127.0.0.1:8081/__enviar
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+BOT_USER = {'id': 999999, 'is_bot': True, 'first_name': 'Bot TJSP (mock)', 'username': 'mock_tjsp_bot'}
+
+
+class MockTelegram:
+    def __init__(self, latencia_ms=0):
+        self.latencia_ms = latencia_ms
+        self.updates = []
+        self.proximo_update = itertools.count(1)
+        self.proxima_mensagem = itertools.count(1)
+        self.novos_updates = asyncio.Event()
+        self.mensagens = {}
+        self.nova_mensagem = asyncio.Condition()
+        self.chamadas = {}
+        self.encerrando = False
+
+    # --- lado do usuário -------------------------------------------------
+
+    def enviar_mensagem(self, chat_id, username, texto):
+        """Enfileira um update de mensagem privada e devolve o instante (perf_counter) do envio"""
+        update = {
+            'update_id': next(self.proximo_update),
+            'message': {
+                'message_id': next(self.proxima_mensagem),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private', 'username': username},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': username, 'username': username},
+                'text': texto,
+            },
+        }
+        if texto.startswith('/'):
+            comando = texto.split()[0]
+            update['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(comando)}]
+        self.updates.append(update)
+        self.novos_updates.set()
+        return time.perf_counter()
+
+    async def aguardar_mensagem(self, chat_id, desde, condicao=None, timeout=60):
+        """Primeira mensagem do bot no chat enviada após `desde` que satisfaz condicao(texto)"""
+        limite = time.perf_counter() + timeout
+        async with self.nova_mensagem:
+            while True:
+                for mensagem in self.mensagens.get(chat_id, []):
+                    if mensagem['instante'] >= desde and (condicao is None or condicao(mensagem['text'])):
+                        return mensagem
+                restante = limite - time.perf_counter()
+                if restante <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(self.nova_mensagem.wait(), restante)
+                except asyncio.TimeoutError:
+                    return None
+
+    def total_mensagens(self):
+        return sum(len(mensagens) for mensagens in self.mensagens.values())
+
+    # --- lado do bot (Bot API) --------------------------------------------
+
+    async def _registrar(self, chat_id, texto, tipo='message', message_id=None):
+        mensagem = {
+            'message_id': message_id or next(self.proxima_mensagem),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': texto,
+        }
+        async with self.nova_mensagem:
+            self.mensagens.setdefault(chat_id, []).append(dict(mensagem, instante=time.perf_counter(), tipo=tipo))
+            self.nova_mensagem.notify_all()
+        return mensagem
+
+    async def get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        limite = int(params.get('limit') or 100)
+        if offset:
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates and timeout and not self.encerrando:
+            self.novos_updates.clear()
+            try:
+                await asyncio.wait_for(self.novos_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limite]
+
+    async def chamar(self, metodo, params):
+        self.chamadas[metodo] = self.chamadas.get(metodo, 0) + 1
+        if self.latencia_ms and metodo != 'getUpdates':
+            await asyncio.sleep(self.latencia_ms / 1000)
+
+        if metodo == 'getMe':
+            return BOT_USER
+        if metodo == 'getUpdates':
+            return await self.get_updates(params)
+        if metodo == 'sendMessage':
+            return await self._registrar(int(params['chat_id']), params.get('text', ''))
+        if metodo == 'editMessageText':
+            return await self._registrar(int(params['chat_id']), params.get('text', ''), tipo='edit',
+                                         message_id=int(params.get('message_id') or 0) or None)
+        if metodo == 'sendDocument':
+            mensagem = await self._registrar(int(params['chat_id']), params.get('caption', ''), tipo='document')
+            mensagem['document'] = {'file_id': f"doc{mensagem['message_id']}", 'file_unique_id': 'mock'}
+            return mensagem
+        return True
+
+    async def atender(self, request):
+        metodo = request.match_info['metodo']
+        params = dict(request.query)
+        if request.content_type == 'application/json':
+            params.update(await request.json())
+        elif request.can_read_body:
+            for chave, valor in (await request.post()).items():
+                params[chave] = valor if isinstance(valor, str) else getattr(valor, 'filename', '')
+        try:
+            resultado = await self.chamar(metodo, params)
+        except (KeyError, ValueError) as e:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': f"Bad Request: {e}"}, status=400)
+        return web.json_response({'ok': True, 'result': resultado})
+
+    async def injetar(self, request):
+        dados = await request.json()
+        self.enviar_mensagem(int(dados['chat_id']), dados.get('username', 'teste'), dados['texto'])
+        return web.json_response({'ok': True})
+
+    async def historico(self, request):
+        return web.json_response({
+            'chamadas': self.chamadas,
+            'mensagens': {chat: [m['text'] for m in msgs] for chat, msgs in self.mensagens.items()},
+        })
+
+    def aplicacao(self):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{metodo}', self.atender)
+        app.router.add_post('/__enviar', self.injetar)
+        app.router.add_get('/__historico', self.historico)
+        return app
+
+    def encerrar(self):
+        """Libera os long polls pendentes"""
+        self.encerrando = True
+        self.novos_updates.set()
+
+
+async def iniciar(mock, host='127.0.0.1', port=8081):
+    """Sobe o mock no event loop atual e devolve o runner"""
+    runner = web.AppRunner(mock.aplicacao(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latencia-ms', type=float, default=0, help='atraso de cada chamada à API')
+    args = parser.parse_args()
+
+    mock = MockTelegram(latencia_ms=args.latencia_ms)
+    runner = await iniciar(mock, args.host, args.port)
+    print(f"🧪 Mock Bot API em http://{args.host}:{args.port} (TELEGRAM_API_URL)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(json.dumps(mock.chamadas))
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass